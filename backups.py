@@ -0,0 +1,328 @@
+""" A module dedicated to the backups of the finance database.
+
+Every mapped table is copied in fixed-size chunks : the rows are streamed from a server-side cursor and written
+with executemany, so that the memory used does not depend on the size of the database. The row counts of the source
+and of the backup are compared at the end.
+
+Only the columns existing on both sides are copied and compared : an older database, or an older backup, may lack the
+newest columns (Empreinte before the first import).
+
+A backup can then be updated incrementally : the movements and jobs created since the last exported job are
+appended, and the rows modified since (deactivations, mass updates, rollbacks...) are found by comparing checksums
+of blocks of movements, and of the small tables. The checksums of the last backup are stored in the backup with its
+state : only the source is read, and only the blocks which changed are written. The checksums of an older backup, or
+of another block size, are computed once from the backup itself."""
+import hashlib
+from datetime import datetime, date
+from decimal import Decimal
+from typing import Callable
+
+import sqlalchemy
+from sqlalchemy import Engine, Table, Connection, MetaData, Column, Integer, DateTime, String, select, func, \
+    delete, insert, or_
+
+from datamodel import Mouvement, Job, Impot, Declarant
+
+# Number of rows read and written at once
+CHUNK_SIZE = 10_000
+
+# Number of consecutive movement indexes sharing a checksum
+BLOCK_SIZE = 5_000
+
+# State of the backup, stored in the backup itself
+backup_metadata = MetaData()
+backup_etat = Table('backup_etat', backup_metadata,
+                    Column('etat_id', Integer, primary_key=True),
+                    Column('last_job_id', Integer, nullable=True),
+                    Column('last_backup', DateTime),
+                    Column('full_backup', DateTime))
+# Checksums of the backed up rows, per table and per block (a single block 0 for the tables other than the movements)
+backup_blocs = Table('backup_blocs', backup_metadata,
+                     Column('table_name', String(64), primary_key=True),
+                     Column('bloc', Integer, primary_key=True),
+                     Column('block_size', Integer),
+                     Column('checksum', String(32)))
+
+
+def get_backup_tables() -> list[Table]:
+    """ Returns the tables to back up, in dependency order (the views of dbview_schema are excluded)"""
+    tables = []
+    for metadata in [Mouvement.metadata, Impot.metadata, Declarant.metadata]:
+        tables += [t for t in metadata.sorted_tables if t.schema is None]
+    return tables
+
+
+def print_progress(table: Table, copied: int, total: int):
+    print(f'{table.name} : {copied} / {total} rows copied')
+
+
+def open_source(source: Engine) -> Connection:
+    """ Opens a connection reading a consistent snapshot of the source"""
+    connection = source.connect()
+    if source.dialect.name == 'postgresql':
+        connection = connection.execution_options(isolation_level='REPEATABLE READ')
+    return connection
+
+
+def get_common_columns(connections: list[Connection], table: Table) -> list[Column]:
+    """ Returns the columns of the table existing in every database"""
+    names = [{c['name'] for c in sqlalchemy.inspect(connection).get_columns(table.name)} for connection in connections]
+    return [c for c in table.columns if all(c.name in n for n in names)]
+
+
+def count_rows(connection: Connection, table: Table) -> int:
+    return connection.scalar(select(func.count()).select_from(table))
+
+
+def copy_rows(source: Connection, target: Connection, table: Table, stmt, total: int, chunk_size: int,
+              progress: Callable) -> int:
+    """ Streams the rows selected by stmt into the table of the target, chunk by chunk
+
+    :returns: the number of rows copied"""
+    copied = 0
+    result = source.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(stmt)
+    for rows in result.partitions(chunk_size):
+        target.execute(table.insert(), [dict(r._mapping) for r in rows])
+        copied += len(rows)
+        if progress is not None:
+            progress(table, copied, total)
+    return copied
+
+
+def verify_counts(target: Connection, expected: dict):
+    """ Compares the row counts of the backup with the expected ones
+
+    :raises ValueError: if a table has not the expected number of rows"""
+    tables = {t.name: t for t in get_backup_tables()}
+    errors = [f'{name} : {count_rows(target, tables[name])} rows instead of {count}'
+              for name, count in expected.items() if count_rows(target, tables[name]) != count]
+    if errors:
+        raise ValueError(f"backup verification failed : {', '.join(errors)}")
+
+
+def backup_database(source: Engine, target: Engine, chunk_size: int = CHUNK_SIZE,
+                    progress: Callable = print_progress) -> dict:
+    """ Copies every mapped table of the source database into an empty target database.
+
+    The tables missing in the source (for instance the ledger tables before their creation) are skipped.
+
+    :returns: the number of rows copied per table"""
+    tables = get_backup_tables()
+    for metadata in {t.metadata for t in tables}:
+        metadata.create_all(target, tables=[t for t in tables if t.metadata is metadata])
+
+    copied = {}
+    with open_source(source) as source_connection, target.begin() as target_connection:
+        inspector = sqlalchemy.inspect(source_connection)
+        for table in tables:
+            if not inspector.has_table(table.name):
+                continue
+            total = count_rows(source_connection, table)
+            stmt = select(*get_common_columns([source_connection, target_connection], table))
+            copied[table.name] = copy_rows(source_connection, target_connection, table, stmt, total, chunk_size,
+                                           progress)
+            if copied[table.name] != total:
+                raise ValueError(f'{table.name} : {copied[table.name]} rows copied instead of {total}')
+        verify_counts(target_connection, copied)
+
+    return copied
+
+
+def normalize(value):
+    """ Gives the same representation to a value read from PostgreSQL or from SQLite"""
+    if isinstance(value, (Decimal, float)):
+        return repr(round(float(value), 6))
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return repr(value)
+
+
+def update_checksum(checksum, row):
+    checksum.update('\x1f'.join(normalize(v) for v in row).encode())
+    checksum.update(b'\x1e')
+
+
+def new_checksum(columns: list[Column]):
+    """ Starts a checksum with the names of the columns : the checksums differ when the compared columns change"""
+    checksum = hashlib.md5()
+    update_checksum(checksum, [c.name for c in columns])
+    return checksum
+
+
+def get_table_checksum(connection: Connection, table: Table, columns: list[Column] = None) -> str:
+    """ Returns the checksum of a whole table (of some of its columns), read in primary key order"""
+    columns = columns or list(table.columns)
+    checksum = new_checksum(columns)
+    result = connection.execution_options(stream_results=True).execute(
+        select(*columns).order_by(*table.primary_key.columns))
+    for row in result:
+        update_checksum(checksum, row)
+    return checksum.hexdigest()
+
+
+def get_block_range(block: int, block_size: int):
+    return Mouvement.__table__.c['index'].between(block * block_size, (block + 1) * block_size - 1)
+
+
+def get_block_checksums(connection: Connection, block_size: int, columns: list[Column] = None,
+                        blocks: set = None) -> dict:
+    """ Returns the checksums of the movements (of some of their columns), per block of block_size consecutive
+    indexes. Only the given blocks are read if any"""
+    table = Mouvement.__table__
+    columns = columns or list(table.columns)
+    stmt = select(*columns).order_by(table.c['index'])
+    if blocks is not None:
+        if not blocks:
+            return {}
+        stmt = stmt.where(or_(*[get_block_range(block, block_size) for block in blocks]))
+    checksums = {}
+    result = connection.execution_options(stream_results=True).execute(stmt)
+    for row in result:
+        block = row._mapping['index'] // block_size
+        if block not in checksums:
+            checksums[block] = new_checksum(columns)
+        update_checksum(checksums[block], row)
+    return {block: checksum.hexdigest() for block, checksum in checksums.items()}
+
+
+def get_checksums(source: Connection, target: Connection, block_size: int) -> dict:
+    """ Returns the checksums of the columns common to both databases, per (table, block), read from the target"""
+    inspectors = [sqlalchemy.inspect(source), sqlalchemy.inspect(target)]
+    mouvements = Mouvement.__table__
+    checksums = {(mouvements.name, block): checksum for block, checksum in get_block_checksums(
+        target, block_size, get_common_columns([source, target], mouvements)).items()}
+    for table in get_backup_tables():
+        if table is not mouvements and all(i.has_table(table.name) for i in inspectors):
+            checksums[(table.name, 0)] = get_table_checksum(target, table, get_common_columns([source, target], table))
+    return checksums
+
+
+def get_stored_checksums(target: Connection, block_size: int):
+    """ Returns the checksums stored by the last backup, None if the backup has none or used another block size"""
+    if not sqlalchemy.inspect(target).has_table(backup_blocs.name):
+        return None
+    rows = target.execute(select(backup_blocs)).all()
+    if any(r.table_name == Mouvement.__table__.name and r.block_size != block_size for r in rows):
+        return None
+    return {(r.table_name, r.bloc): r.checksum for r in rows}
+
+
+def store_checksums(target: Connection, checksums: dict, block_size: int):
+    """ Records the checksums of the backup, see get_checksums"""
+    backup_metadata.create_all(target)
+    target.execute(delete(backup_blocs))
+    rows = [dict(table_name=table_name, bloc=block, block_size=block_size, checksum=checksum)
+            for (table_name, block), checksum in checksums.items()]
+    for i in range(0, len(rows), CHUNK_SIZE):
+        target.execute(insert(backup_blocs), rows[i:i + CHUNK_SIZE])
+
+
+def get_backup_state(target: Connection):
+    """ Returns the state row of an existing backup, None if it was never stamped"""
+    if not sqlalchemy.inspect(target).has_table(backup_etat.name):
+        return None
+    return target.execute(select(backup_etat).where(backup_etat.c.etat_id == 1)).first()
+
+
+def stamp_backup(target: Connection, last_job_id: int, full: bool):
+    """ Records the last exported job in the backup"""
+    backup_metadata.create_all(target)
+    now = datetime.now()
+    state = get_backup_state(target)
+    target.execute(delete(backup_etat))
+    target.execute(insert(backup_etat).values(etat_id=1, last_job_id=last_job_id, last_backup=now,
+                                              full_backup=now if full or state is None else state.full_backup))
+
+
+def replace_rows(source: Connection, target: Connection, table: Table, condition, chunk_size: int,
+                 progress: Callable) -> int:
+    """ Replaces the rows of the target matching the condition by the ones of the source"""
+    target.execute(delete(table).where(condition) if condition is not None else delete(table))
+    stmt = select(*get_common_columns([source, target], table))
+    if condition is not None:
+        stmt = stmt.where(condition)
+    total = count_rows(source, table) if condition is None else source.scalar(
+        select(func.count()).select_from(table).where(condition))
+    return copy_rows(source, target, table, stmt, total, chunk_size, progress)
+
+
+def incremental_backup(source: Engine, target: Engine, chunk_size: int = CHUNK_SIZE, block_size: int = BLOCK_SIZE,
+                       progress: Callable = print_progress) -> dict:
+    """ Brings an existing backup up to date. A full backup is made if the target was never stamped.
+
+    - the jobs and movements after the last exported job are appended
+    - the blocks of movements whose checksums differ from the stored ones are replaced, as well as the other tables
+      that changed. Only the source is read : the checksums of the backup are the ones stored by the last backup
+
+    :returns: the number of rows written per table"""
+    with target.connect() as target_connection:
+        state = get_backup_state(target_connection)
+
+    if state is None:
+        copied = backup_database(source, target, chunk_size, progress)
+        with source.connect() as source_connection, target.begin() as target_connection:
+            stamp_backup(target_connection, source_connection.scalar(select(func.max(Job.job_id))), True)
+            store_checksums(target_connection, get_checksums(source_connection, target_connection, block_size),
+                            block_size)
+        return copied
+
+    mouvements = Mouvement.__table__
+    jobs = Job.__table__
+    written = {}
+    with open_source(source) as source_connection, target.begin() as target_connection:
+        inspector = sqlalchemy.inspect(source_connection)
+        last_job_id = source_connection.scalar(select(func.max(Job.job_id)))
+        stored = get_stored_checksums(target_connection, block_size)
+        if stored is None:
+            # an older backup, or another block size
+            stored = get_checksums(source_connection, target_connection, block_size)
+        columns = get_common_columns([source_connection, target_connection], mouvements)
+
+        # 1. append the new jobs and their movements, and update the checksums of the blocks they belong to
+        if state.last_job_id is not None:
+            new_rows = mouvements.c.job_id > state.last_job_id
+            blocks = {index // block_size for connection in [source_connection, target_connection]
+                      for index in connection.scalars(select(mouvements.c['index']).where(new_rows))}
+            written[jobs.name] = replace_rows(source_connection, target_connection, jobs,
+                                              jobs.c.job_id > state.last_job_id, chunk_size, progress)
+            written[mouvements.name] = replace_rows(source_connection, target_connection, mouvements, new_rows,
+                                                    chunk_size, progress)
+            appended = get_block_checksums(target_connection, block_size, columns, blocks)
+            for block in blocks:
+                stored[(mouvements.name, block)] = appended.get(block)
+            stored[(jobs.name, 0)] = get_table_checksum(target_connection, jobs, get_common_columns(
+                [source_connection, target_connection], jobs))
+
+        # 2. replace the blocks of movements which changed since
+        checksums = {(mouvements.name, block): checksum for block, checksum in get_block_checksums(
+            source_connection, block_size, columns).items()}
+        stored_blocks = {key for key, checksum in stored.items() if key[0] == mouvements.name and checksum is not None}
+        for key in sorted(set(checksums) | stored_blocks):
+            if checksums.get(key) != stored.get(key):
+                written[mouvements.name] = written.get(mouvements.name, 0) + replace_rows(
+                    source_connection, target_connection, mouvements, get_block_range(key[1], block_size),
+                    chunk_size, progress)
+
+        # 3. replace the other tables which changed
+        for table in get_backup_tables():
+            if table is mouvements or not inspector.has_table(table.name):
+                continue
+            table.create(target_connection, checkfirst=True)
+            checksums[(table.name, 0)] = get_table_checksum(source_connection, table, get_common_columns(
+                [source_connection, target_connection], table))
+            if checksums[(table.name, 0)] != stored.get((table.name, 0)):
+                written[table.name] = written.get(table.name, 0) + replace_rows(
+                    source_connection, target_connection, table, None, chunk_size, progress)
+
+        verify_counts(target_connection, {t.name: count_rows(source_connection, t) for t in get_backup_tables()
+                                          if inspector.has_table(t.name)})
+        stamp_backup(target_connection, last_job_id, False)
+        store_checksums(target_connection, checksums, block_size)
+
+    return written
+
+
+def compact_backup(target: Engine):
+    """ Reclaims the space left by the rows replaced in a SQLite backup"""
+    with target.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.exec_driver_sql('VACUUM')
@@ -0,0 +1,146 @@
+""" Benchmarks of the main read and write paths, on a synthetic dataset.
+
+Usage : python -m benchmarks --rows 100k [--url sqlite:////tmp/finance_100k.sqlite] [--repeat 5] [--output bench.csv]
+
+Without --url, the dataset is generated in a temporary SQLite file. With a url, the dataset is generated only if
+the database is empty : point it to a throwaway database, never to the finance database."""
+import argparse
+import datetime as dt
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import Engine, create_engine, select, func
+from sqlalchemy.orm import Session
+
+import ledger
+from benchmarks.synthetic import SCALES, create_synthetic_database
+from datamodel import Mouvement
+from functions import fetch_mouvements, get_grouped_transactions, get_categorized_provisions, get_yearly_bilan, \
+    split_mouvement, get_provisions_for_month
+from querycache import query_cache
+
+VIEW = ['index', 'Date', 'Description', 'Dépense', 'Recette', 'Compte', 'Catégorie', 'Mois']
+
+
+def measure(name: str, function, repeat: int) -> dict:
+    """ Runs the function repeat times and returns the timings in milliseconds"""
+    timings = []
+    for i in range(repeat):
+        query_cache.clear()
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'benchmark': name, 'runs': repeat, 'best (ms)': round(min(timings), 2),
+            'median (ms)': round(statistics.median(timings), 2), 'worst (ms)': round(max(timings), 2)}
+
+
+def rolled_back(engine: Engine, function):
+    """ Runs a writing function in a session which is rolled back, so that the dataset does not change"""
+
+    def run():
+        with Session(engine) as s:
+            function(s)
+            s.flush()
+            s.rollback()
+
+    return run
+
+
+def in_session(engine: Engine, function):
+    def run():
+        with Session(engine) as s:
+            function(s)
+
+    return run
+
+
+def run_benchmarks(engine: Engine, repeat: int) -> pd.DataFrame:
+    """ Times the benchmarked functions on the dataset of the engine"""
+    with Session(engine) as s:
+        rows = s.scalar(select(func.count(Mouvement.index)))
+        last_day = s.scalar(select(func.max(Mouvement.date)))
+        middle_index = s.scalar(select(func.max(Mouvement.index))) // 2
+    first_month = dt.date(last_day.year, 1, 1)
+
+    results = []
+
+    def rebuild(s: Session):
+        ledger.create_ledger_tables(s.get_bind())
+        ledger.rebuild_daily_balances(s)
+        s.commit()
+
+    results.append(measure('ledger rebuild', in_session(engine, rebuild), 1))
+    results.append(measure('fetch_mouvements first page', in_session(
+        engine, lambda s: fetch_mouvements(s, VIEW, 50, sort_column='index', sort_order='desc')), repeat))
+    results.append(measure('fetch_mouvements deep offset', in_session(
+        engine, lambda s: fetch_mouvements(s, VIEW, 50, offset=rows // 2, sort_column='index', sort_order='desc')),
+        repeat))
+    results.append(measure('fetch_mouvements keyset page', in_session(
+        engine, lambda s: fetch_mouvements(s, VIEW, 50, sort_column='index', sort_order='desc',
+                                           cursor=('index', middle_index, middle_index))), repeat))
+    results.append(measure('fetch_mouvements search', in_session(
+        engine, lambda s: fetch_mouvements(s, VIEW, 50, search_filter='NICE', sort_column='index',
+                                           sort_order='desc')), repeat))
+    results.append(measure('get_grouped_transactions', in_session(
+        engine, lambda s: get_grouped_transactions(s, 'Courant', last_day - dt.timedelta(days=90), last_day)),
+        repeat))
+    results.append(measure('get_categorized_provisions', in_session(
+        engine, lambda s: get_categorized_provisions(s, 'Courses', first_month, 12, False)), repeat))
+    results.append(measure('get_yearly_bilan', in_session(
+        engine, lambda s: get_yearly_bilan(s, last_day.year, True)), repeat))
+    results.append(measure('get_provisions_for_month', in_session(
+        engine, lambda s: get_provisions_for_month(s, first_month, True)), repeat))
+    results.append(measure('split_mouvement 360 months', rolled_back(
+        engine, lambda s: split_mouvement(s, middle_index, mode='custom', periods=360)), repeat))
+
+    # the backup module opens the finance database engine on import
+    from finance_orm_cli.masterdata import backup
+    with tempfile.TemporaryDirectory() as directory:
+        def run_backup():
+            target = create_engine(f"sqlite+pysqlite:///{Path(directory).joinpath('backup.sqlite').as_posix()}")
+            backup(engine, target)
+            target.dispose()
+            Path(directory).joinpath('backup.sqlite').unlink()
+
+        results.append(measure('backup', run_backup, 1))
+
+    df = pd.DataFrame(results)
+    df.insert(1, 'rows', rows)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmarks', description='Benchmarks on a synthetic finance dataset')
+    parser.add_argument('--rows', default='10k', help=f"number of movements : {', '.join(SCALES)} or an integer")
+    parser.add_argument('--url', default=None, help='database url, a temporary SQLite file by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=None, help='csv file to which the results are appended')
+    args = parser.parse_args()
+
+    rows = SCALES[args.rows] if args.rows in SCALES else int(args.rows)
+    with tempfile.TemporaryDirectory() as directory:
+        url = args.url or f"sqlite+pysqlite:///{Path(directory).joinpath('finance.sqlite').as_posix()}"
+        engine = create_engine(url)
+        if not sqlalchemy.inspect(engine).has_table(Mouvement.__tablename__):
+            start = time.perf_counter()
+            counts = create_synthetic_database(engine, rows, args.seed)
+            print(f'Synthetic dataset generated in {time.perf_counter() - start:.1f} s : {counts}')
+
+        results = run_benchmarks(engine, args.repeat)
+        engine.dispose()
+
+    results.insert(0, 'timestamp', dt.datetime.now().isoformat(timespec='seconds'))
+    results.insert(1, 'dialect', url.split(':')[0])
+    print(results.to_string(index=False))
+    if args.output:
+        output = Path(args.output)
+        results.to_csv(output, mode='a', header=not output.exists(), index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+""" A generator of reproducible synthetic finance datasets, for benchmarks.
+
+The same seed and the same number of rows always give the same database. The movements are inserted with chunked
+multi-row INSERT statements, so that 1M rows can be generated in a local SQLite file in a few minutes."""
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Engine, insert
+from sqlalchemy.orm import Session
+
+from datamodel import Mouvement, Compte, Categorie, Job, MapCategorie, Classifier
+
+# The sizes of the standard datasets
+SCALES = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000, '10M': 10_000_000}
+
+# Number of movements inserted in a single statement
+CHUNK_SIZE = 20_000
+
+# Number of movements per job
+JOB_SIZE = 1_000
+
+# Date of the first movement
+FIRST_DAY = dt.date(2010, 1, 1)
+
+COMPTES = [('Crédit Agricole', 'Courant'), ('Boursorama', 'Courant'), ('Livret A', 'Economies'),
+           ('LDDS', 'Economies'), ('PEA', 'Investissements'), ('Emprunt Immobilier', 'Emprunts')]
+COMPTE_WEIGHTS = [0.55, 0.25, 0.08, 0.05, 0.04, 0.03]
+
+CATEGORIES = {'01 - Quotidien': ['Courses', 'Essence', 'Restaurants', 'Pharmacie', 'Boulangerie'],
+              '02 - Logement': ['Loyer', 'Electricité', 'Eau', 'Internet', 'Assurance Habitation'],
+              '03 - Loisirs': ['Abonnements', 'Voyages', 'Sport', 'Livres', 'Cinéma'],
+              '04 - Revenus': ['Salaire', 'Remboursements', 'Intérêts'],
+              '05 - Divers': ['Impôt Revenu', 'Cadeaux', 'Banque']}
+
+PREFIXES = ['CB', 'PRLV SEPA', 'VIR', 'CARTE', 'PAIEMENT PAR CARTE']
+CITIES = ['PARIS', 'LYON', 'NANTES', 'LILLE', 'BORDEAUX', 'RENNES', 'NICE', 'TOULOUSE']
+
+
+def get_categories() -> list[str]:
+    """ Returns the names of the synthetic categories, the empty category (virements) included"""
+    return [c for group in CATEGORIES.values() for c in group] + ['']
+
+
+def get_merchants(count: int, rng: np.random.Generator) -> pd.DataFrame:
+    """ Returns merchant keywords, each mapped to a category and a group"""
+    categories = [c for group in CATEGORIES.values() for c in group]
+    groups = {c: g for g, cs in CATEGORIES.items() for c in cs}
+    letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+    keywords = []
+    while len(keywords) < count:
+        keyword = ''.join(rng.choice(letters, size=rng.integers(5, 10)))
+        if not any(keyword in k or k in keyword for k in keywords):
+            keywords.append(keyword)
+    merchants = pd.DataFrame({'keyword': keywords,
+                              'categorie': rng.choice(categories, size=count)})
+    merchants['groupe'] = merchants['categorie'].map(groups)
+    return merchants
+
+
+def create_schema(engine: Engine):
+    """ Creates the tables of the finance schema (the views of dbview_schema excepted)"""
+    metadata = Mouvement.metadata
+    metadata.create_all(engine, tables=[t for t in metadata.sorted_tables if t.schema is None])
+
+
+def generate_mouvements(first_index: int, count: int, merchants: pd.DataFrame, years: int,
+                        rng: np.random.Generator) -> list[dict]:
+    """ Generates a chunk of movements, as dictionaries of column values"""
+    indexes = np.arange(first_index, first_index + count)
+    days = rng.integers(0, 365 * years, size=count)
+    dates = (np.datetime64(FIRST_DAY) + days.astype('timedelta64[D]'))
+    months = dates.astype('datetime64[M]').astype('datetime64[D]')
+    picks = rng.integers(0, len(merchants), size=count)
+    amounts = np.round(rng.lognormal(3.5, 1.0, size=count), 2)
+    is_recette = rng.random(size=count) < 0.15
+    is_provision = rng.random(size=count) < 0.05
+    comptes = np.array([c for c, t in COMPTES], dtype=object)[
+        rng.choice(len(COMPTES), size=count, p=COMPTE_WEIGHTS)]
+    comptes[is_provision] = None
+    descriptions = [f'{p} {merchants.keyword[m]} {c} {n:06d}' for p, m, c, n in
+                    zip(rng.choice(PREFIXES, size=count), picks, rng.choice(CITIES, size=count),
+                        rng.integers(0, 1_000_000, size=count))]
+    categories = merchants.categorie.values[picks].copy()
+    categories[rng.random(size=count) < 0.03] = ''
+    out_of_bound = rng.random(size=count) < 0.02
+    economie = np.where(rng.random(size=count) < 0.1, 'true', 'false')
+
+    dates = dates.astype(object)
+    months = months.astype(object)
+    amounts = amounts.tolist()
+    rows = []
+    for i in range(count):
+        provision = bool(is_provision[i])
+        recette = bool(is_recette[i])
+        rows.append({
+            'index': int(indexes[i]),
+            'Date': dates[i],
+            'Description': descriptions[i],
+            'Recette': None if provision else (amounts[i] if recette else 0.0),
+            'Dépense': None if provision else (0.0 if recette else amounts[i]),
+            'Compte': comptes[i],
+            'Catégorie': categories[i],
+            'Economie': economie[i],
+            'Réglé': 'false',
+            'Mois': months[i],
+            'Date insertion': dates[i],
+            'Provision à payer': amounts[i] if provision and not recette else None,
+            'Provision à récupérer': amounts[i] if provision and recette else None,
+            'Date Out of Bound': bool(out_of_bound[i]),
+            'No': int(indexes[i]),
+            'job_id': int(indexes[i] - 1) // JOB_SIZE + 1})
+    return rows
+
+
+def create_synthetic_database(engine: Engine, rows: int, seed: int = 0, years: int = 15,
+                              merchant_count: int = 400) -> dict:
+    """ Fills an empty database with a synthetic dataset.
+
+    :param rows: the number of movements (see SCALES)
+    :returns: the number of rows per table"""
+    rng = np.random.default_rng(seed)
+    merchants = get_merchants(merchant_count, rng)
+    create_schema(engine)
+
+    with Session(engine) as session:
+        for compte, compte_type in COMPTES:
+            session.add(Compte(compte=compte, compte_minuscule=compte.lower(), compte_type=compte_type,
+                               compte_actif=True))
+        order = 0
+        for groupe, categories in CATEGORIES.items():
+            for categorie in categories:
+                order += 1
+                session.add(Categorie(categorie=categorie, categorie_groupe=groupe, categorie_order=order,
+                                      provision_type='Courant'))
+        session.add(Categorie(categorie='', categorie_groupe='00 - Virements', categorie_order=0,
+                              provision_type='Aucune'))
+        session.flush()
+
+        session.execute(insert(MapCategorie), [{'keyword': k, 'categorie': c, 'inactif': False} for k, c in
+                                               zip(merchants.keyword, merchants.categorie)])
+        classifiers = merchants.sample(n=len(merchants) // 4, random_state=seed)
+        session.execute(insert(Classifier), [{'patterns': k, 'classes': g} for k, g in
+                                             zip(classifiers.keyword, classifiers.groupe)])
+
+        job_count = (rows - 1) // JOB_SIZE + 1
+        first_timestamp = dt.datetime.combine(FIRST_DAY, dt.time(8))
+        session.execute(insert(Job), [{'job_id': j + 1, 'job_key': Job.type_import,
+                                       'job_timestamp': first_timestamp + dt.timedelta(hours=j)}
+                                      for j in range(job_count)])
+        session.commit()
+
+    with engine.begin() as connection:
+        for first in range(1, rows + 1, CHUNK_SIZE):
+            count = min(CHUNK_SIZE, rows + 1 - first)
+            connection.execute(insert(Mouvement.__table__),
+                               generate_mouvements(first, count, merchants, years, rng))
+
+    return {'compte_types': len(COMPTES), 'categories_groupes': len(get_categories()),
+            'map_categories': len(merchants), 'classifiers': len(classifiers), 'jobs': job_count, 'comptes': rows}
@@ -0,0 +1,221 @@
+""" An in-process aggregate cube of the movements, by month, category and mode (Courant or Economie).
+
+The cube holds, for every cell, the sums of the realised amounts (Recette, Dépense), of the provisions (Recette
+Provisionnée, Dépense Provisionnée) and the number of movements. What remains of the provisions is computed per cell,
+as in view_bilans_agregation : the provision not realised yet, or 0 once exceeded.
+
+The cube is loaded once with a single grouped query, then kept up to date by job : the movements of the jobs created
+since the last refresh, by any process, are aggregated and added to their cells. The commits updating or deleting rows (deactivations,
+category changes...) bump querycache.update_version, and the cube is then reloaded. The writes of other processes are
+not seen by these events, and their reassignments of categories or months keep the totals : the cube is reloaded
+every MAX_AGE seconds, with the same single grouped query. The monthly and yearly reports are answered by slicing the
+arrays."""
+import threading
+import time
+import weakref
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func, or_
+from sqlalchemy.orm import Session
+
+from datamodel import Mouvement, Job, Categorie
+from querycache import data_version, update_version
+
+# Measures of the cube, in the order of its first axis
+MEASURES = ['Recette', 'Dépense', 'Recette Provisionnée', 'Dépense Provisionnée', 'Mouvements']
+RECETTE, DEPENSE, RECETTE_PROVISIONNEE, DEPENSE_PROVISIONNEE, MOUVEMENTS = range(len(MEASURES))
+
+# Modes, in the order of its last axis : Economie = 'false', then 'true'
+MODES = ['Courant', 'Economie']
+COURANT, ECONOMIE = range(len(MODES))
+
+# Seconds after which the cube is reloaded, even when no commit was seen (writes of other processes)
+MAX_AGE = 60.0
+
+PROVISION_COLUMNS = ['Catégorie Groupe', 'Catégorie', 'Recette', 'Recette Provisionnée', 'Recette Reste', 'Dépense',
+                     'Dépense Provisionnée', 'Dépense Reste', 'Solde sans provisions', 'Solde avec provisions']
+
+
+def get_remaining(provisioned: np.ndarray, realised: np.ndarray) -> np.ndarray:
+    """ Returns what remains of the provisions, cell by cell"""
+    return np.clip(provisioned - realised, 0, None)
+
+
+class AggregateCube:
+    """ Holds the aggregates of the movements of one engine, as an array of shape
+    (measures, months, categories, modes)"""
+
+    def __init__(self):
+        self.__lock__ = threading.RLock()
+        self.__engine__ = None
+        self.__values__ = None
+        self.__first_month__ = None
+        self.__categories__ = {}
+        self.__groups__ = pd.DataFrame(columns=[Categorie.categorie.name, Categorie.categorie_groupe.name,
+                                                Categorie.categorie_order.name])
+        self.__last_job_id__ = None
+        self.__data_version__ = None
+        self.__update_version__ = None
+        self.__loaded__ = 0.0
+
+    def invalidate(self):
+        """ Drops the cube, which is reloaded on the next read"""
+        with self.__lock__:
+            self.__engine__ = None
+            self.__values__ = None
+
+    @property
+    def last_job_id(self) -> int:
+        return self.__last_job_id__
+
+    def __month_position__(self, months: np.ndarray) -> np.ndarray:
+        return (months.astype('datetime64[M]') - self.__first_month__).astype(int)
+
+    def __aggregate__(self, s: Session, last_job_id: int, after_job_id: int = None) -> pd.DataFrame:
+        """ Sums the active movements per cell, up to the job last_job_id (and after after_job_id)"""
+        stmt = select(Mouvement.mois, Mouvement.categorie, (Mouvement.economie == 'true').label('economie'),
+                      func.sum(func.coalesce(Mouvement.recette, 0)), func.sum(func.coalesce(Mouvement.depense, 0)),
+                      func.sum(func.coalesce(Mouvement.provision_recuperer, 0)),
+                      func.sum(func.coalesce(Mouvement.provision_payer, 0)), func.count()).where(
+            Mouvement.date_out_of_bound == False, Mouvement.mois != None).group_by(
+            Mouvement.mois, Mouvement.categorie, Mouvement.economie == 'true')
+        if after_job_id is None:
+            stmt = stmt.where(or_(Mouvement.job_id == None, Mouvement.job_id <= last_job_id))
+        else:
+            stmt = stmt.where(Mouvement.job_id > after_job_id, Mouvement.job_id <= last_job_id)
+        df = pd.DataFrame(s.execute(stmt).all(), columns=['mois', 'categorie', 'economie'] + MEASURES)
+        df['mois'] = pd.to_datetime(df['mois'])
+        df[MEASURES] = df[MEASURES].astype(float)
+        return df
+
+    def __accumulate__(self, df: pd.DataFrame):
+        """ Adds aggregated rows to the cube, growing its axes when needed"""
+        if len(df) == 0:
+            return
+        for categorie in pd.unique(df['categorie']):
+            if categorie not in self.__categories__:
+                self.__categories__[categorie] = len(self.__categories__)
+        months = df['mois'].to_numpy().astype('datetime64[M]')
+        first, last = months.min(), months.max()
+        if self.__values__ is None:
+            self.__first_month__ = first
+            self.__values__ = np.zeros((len(MEASURES), 0, 0, len(MODES)))
+        before = max(int((self.__first_month__ - first).astype(int)), 0)
+        self.__first_month__ = min(self.__first_month__, first)
+        after = max(int((last - self.__first_month__).astype(int)) + 1 - before - self.__values__.shape[1], 0)
+        missing = len(self.__categories__) - self.__values__.shape[2]
+        if before or after or missing:
+            self.__values__ = np.pad(self.__values__, ((0, 0), (before, after), (0, missing), (0, 0)))
+
+        months = self.__month_position__(months)
+        categories = df['categorie'].map(self.__categories__).to_numpy()
+        modes = np.where(df['economie'].fillna(False).astype(bool), ECONOMIE, COURANT)
+        for m, measure in enumerate(MEASURES):
+            np.add.at(self.__values__[m], (months, categories, modes), df[measure].to_numpy())
+
+    def refresh(self, s: Session, force: bool = False):
+        """ Loads the cube, or adds the movements of the new jobs to it"""
+        engine = s.get_bind().engine
+        with self.__lock__:
+            # the engine itself, rather than its url : two in-memory databases share the url sqlite://
+            reload = force or self.__engine__ is None or self.__engine__() is not engine or \
+                self.__update_version__ != update_version.value or time.monotonic() - self.__loaded__ >= MAX_AGE
+            versions = (data_version.value, update_version.value)
+            # an indexed read : the new jobs of the other processes are seen at once
+            last_job_id = s.scalar(select(func.max(Job.job_id))) or 0
+            if not reload and self.__data_version__ == versions[0] and last_job_id == self.__last_job_id__:
+                return
+            if reload:
+                self.__values__ = None
+                self.__categories__ = {}
+                self.__accumulate__(self.__aggregate__(s, last_job_id))
+                self.__loaded__ = time.monotonic()
+            elif last_job_id > self.__last_job_id__:
+                self.__accumulate__(self.__aggregate__(s, last_job_id, self.__last_job_id__))
+            if reload or self.__data_version__ != versions[0]:
+                self.__groups__ = pd.read_sql(select(Categorie.categorie, Categorie.categorie_groupe,
+                                                     Categorie.categorie_order), s.connection())
+            self.__engine__ = weakref.ref(engine)
+            self.__last_job_id__ = last_job_id
+            self.__data_version__, self.__update_version__ = versions
+
+    def get_slice(self, s: Session, first_month: date, last_month: date) -> tuple[np.ndarray, list[str], list]:
+        """ Returns a copy of the cube between two months (included), completed with zeros outside of the data
+
+        :returns: the array of shape (measures, months, categories, modes), the categories and the months"""
+        self.refresh(s)
+        with self.__lock__:
+            months = np.arange(np.datetime64(first_month, 'M'), np.datetime64(last_month, 'M') + 1)
+            categories = list(self.__categories__)
+            result = np.zeros((len(MEASURES), len(months), len(categories), len(MODES)))
+            if self.__values__ is not None and len(months):
+                positions = self.__month_position__(months)
+                inside = (positions >= 0) & (positions < self.__values__.shape[1])
+                result[:, inside] = self.__values__[:, positions[inside]]
+        return result, categories, [m.astype('datetime64[D]').astype(object) for m in months]
+
+    def get_groups(self) -> pd.DataFrame:
+        """ Returns the categories, with their group and order, as read at the last refresh"""
+        with self.__lock__:
+            return self.__groups__.copy()
+
+    def get_month(self, s: Session, month: date, is_courant: bool = True) -> pd.DataFrame:
+        """ Returns the aggregates of the categories having movements in the month, as get_provisions_for_month.
+
+        The amounts are the ones of the mode, the balances of the Economie mode being the totals of both modes."""
+        values, categories, _ = self.get_slice(s, month, month)
+        values = values[:, 0]
+        mode = COURANT if is_courant else ECONOMIE
+        present = values[MOUVEMENTS].sum(axis=1) > 0
+        recette_reste = get_remaining(values[RECETTE_PROVISIONNEE], values[RECETTE])
+        depense_reste = get_remaining(values[DEPENSE_PROVISIONNEE], values[DEPENSE])
+        balance_modes = [COURANT] if is_courant else [COURANT, ECONOMIE]
+        solde = (values[RECETTE] - values[DEPENSE])[:, balance_modes].sum(axis=1)
+        reste = (recette_reste - depense_reste)[:, balance_modes].sum(axis=1)
+        df = pd.DataFrame({'Catégorie': categories,
+                           'Recette': values[RECETTE, :, mode],
+                           'Recette Provisionnée': values[RECETTE_PROVISIONNEE, :, mode],
+                           'Recette Reste': recette_reste[:, mode],
+                           'Dépense': values[DEPENSE, :, mode],
+                           'Dépense Provisionnée': values[DEPENSE_PROVISIONNEE, :, mode],
+                           'Dépense Reste': depense_reste[:, mode],
+                           'Solde sans provisions': solde,
+                           'Solde avec provisions': solde + reste})[present]
+        groups = self.get_groups().set_index(Categorie.categorie.name)[Categorie.categorie_groupe.name]
+        df.insert(0, 'Catégorie Groupe', df['Catégorie'].map(groups))
+        return df[PROVISION_COLUMNS].sort_values(['Catégorie Groupe', 'Catégorie'], ignore_index=True).round(2)
+
+    def get_year(self, s: Session, annee: int, is_courant: bool) -> pd.DataFrame:
+        """ Returns, per category, the realised amounts plus the remaining provisions of every month of the year, and
+        the provisions of the year, for one mode
+
+        :returns: a dataframe with the columns Catégorie, Recette, Dépense, Recette Provisionnée and
+            Dépense Provisionnée"""
+        values, categories, _ = self.get_slice(s, date(annee, 1, 1), date(annee, 12, 1))
+        values = values[..., COURANT if is_courant else ECONOMIE]
+        recette = values[RECETTE] + get_remaining(values[RECETTE_PROVISIONNEE], values[RECETTE])
+        depense = values[DEPENSE] + get_remaining(values[DEPENSE_PROVISIONNEE], values[DEPENSE])
+        present = values[MOUVEMENTS].sum(axis=0) > 0
+        return pd.DataFrame({'Catégorie': categories, 'Recette': recette.sum(axis=0), 'Dépense': depense.sum(axis=0),
+                             'Recette Provisionnée': values[RECETTE_PROVISIONNEE].sum(axis=0),
+                             'Dépense Provisionnée': values[DEPENSE_PROVISIONNEE].sum(axis=0)})[present]
+
+    def get_monthly(self, s: Session, category: str, annee: int, measure: int, is_economie: bool) -> pd.DataFrame:
+        """ Returns the sums of a measure per month of the year, for the months having movements of the category
+
+        :param is_economie: only the Economie mode if True, both modes otherwise
+        :returns: a dataframe with the columns Mois and the measure"""
+        values, categories, months = self.get_slice(s, date(annee, 1, 1), date(annee, 12, 1))
+        if category not in categories:
+            return pd.DataFrame(columns=['Mois', MEASURES[measure]])
+        values = values[:, :, categories.index(category)]
+        values = values[..., ECONOMIE] if is_economie else values.sum(axis=-1)
+        present = values[MOUVEMENTS] > 0
+        return pd.DataFrame({'Mois': np.array(months, dtype=object)[present],
+                             MEASURES[measure]: values[measure][present].round(2)})
+
+
+# The cube shared by the whole process
+aggregate_cube = AggregateCube()
@@ -2,7 +2,7 @@ import datetime as dt
 from datetime import datetime, date
 from typing import List
 
-from sqlalchemy import Boolean, ForeignKey, Engine
+from sqlalchemy import Boolean, ForeignKey, Engine, Sequence, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, relationship, mapped_column, validates
 from sqlalchemy.types import String, Integer, Date, Numeric, Float
 
@@ -51,6 +51,8 @@ class Job(Base):
     type_split = 'split'
     type_shut = 'shutdown'
     type_provision = 'provision'
+    # jobs deriving movements from other movements (not bank rows)
+    types_derived = [type_split, type_salary, type_provision]
 
     job_id: Mapped[int] = mapped_column(Integer, primary_key=True)
     job_key: Mapped[str]
@@ -97,6 +99,10 @@ class Mouvement(Base):
                                            comment="Désigne le déclarant pour un contexte d'impôts")
     employeur: Mapped[str] = mapped_column('employeur', String, nullable=True,
                                            comment="Désigne l'employeur et permet de déterminer les salaires")
+    # deferred : the column is added to the older databases at their first import (see ingestion)
+    empreinte: Mapped[str] = mapped_column('Empreinte', String(32), nullable=True, deferred=True,
+                                           comment="Empreinte du contenu (date, montant, description, compte) "
+                                                   "pour dédoublonner les imports")
 
     compte_object: Mapped[Compte] = relationship(back_populates="mouvements")
     categorie_object: Mapped[Categorie] = relationship(back_populates="mouvements")
@@ -153,6 +159,64 @@ class Mouvement(Base):
         return result
 
 
+# Sequence allocating the transaction numbers (column No of comptes)
+mouvement_no_sequence = Sequence('comptes_no_seq', metadata=Base.metadata)
+
+# Index des filtres fréquents. Les index partiels ne portent que sur les mouvements actifs, les seuls lus par les
+# formulaires (condition "Date Out of Bound" = false)
+mouvement_actif = Mouvement.date_out_of_bound == False
+Index('comptes_actifs_categorie_mois_idx', Mouvement.categorie, Mouvement.mois,
+      postgresql_where=mouvement_actif, sqlite_where=mouvement_actif)
+Index('comptes_actifs_compte_date_idx', Mouvement.compte, Mouvement.date,
+      postgresql_where=mouvement_actif, sqlite_where=mouvement_actif)
+Index('comptes_actifs_mois_idx', Mouvement.mois,
+      postgresql_where=mouvement_actif, sqlite_where=mouvement_actif)
+Index('comptes_actifs_date_idx', Mouvement.date, Mouvement.index,
+      postgresql_where=mouvement_actif, sqlite_where=mouvement_actif)
+Index('comptes_reference_idx', Mouvement.no_de_reference,
+      postgresql_where=Mouvement.no_de_reference.is_not(None), sqlite_where=Mouvement.no_de_reference.is_not(None))
+# les rollbacks et les règles lisent aussi les mouvements désactivés d'un job
+Index('comptes_job_idx', Mouvement.job_id)
+# le dédoublonnage des imports compare aussi les mouvements désactivés
+Index('comptes_empreinte_idx', Mouvement.empreinte)
+
+
+class SoldeJournalier(Base):
+    __tablename__ = 'soldes_journaliers'
+
+    compte: Mapped[str] = mapped_column('compte', String, primary_key=True)
+    jour: Mapped[date] = mapped_column('jour', Date, primary_key=True)
+    mouvement: Mapped[float] = mapped_column('mouvement', Numeric, default=0,
+                                             comment='Variation nette du compte sur la journée')
+    solde: Mapped[float] = mapped_column('solde', Numeric, default=0,
+                                         comment='Solde du compte en fin de journée')
+
+    def __repr__(self):
+        return f'Solde {self.compte} au {self.jour} : {self.solde}'
+
+
+class SoldeJournalierEtat(Base):
+    __tablename__ = 'soldes_journaliers_etat'
+
+    etat_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    last_job_id: Mapped[int] = mapped_column(Integer, nullable=True,
+                                             comment='Le dernier job intégré dans les soldes journaliers')
+    last_refresh: Mapped[datetime] = mapped_column(nullable=True)
+
+    def __repr__(self):
+        return f'Soldes journaliers à jour du job {self.last_job_id}, rafraîchis le {self.last_refresh}'
+
+
+class SoldeJournalierJob(Base):
+    __tablename__ = 'soldes_journaliers_jobs'
+
+    job_id: Mapped[int] = mapped_column(Integer, primary_key=True,
+                                        comment='Un job intégré dans les soldes journaliers')
+
+    def __repr__(self):
+        return f'Job {self.job_id} intégré dans les soldes journaliers'
+
+
 class MapCategorie(Base):
     __tablename__ = 'map_categories'
 
@@ -177,6 +241,26 @@ class MapCategorie(Base):
         return f'Map {self.keyword} to {self.categorie}'
 
 
+class MapCategorieEtat(Base):
+    __tablename__ = 'map_categories_etat'
+
+    keyword: Mapped[str] = mapped_column('Keyword', String, primary_key=True,
+                                         comment='Le mot-clé de la règle (map_categories)')
+    first_job_id: Mapped[int] = mapped_column(Integer, nullable=True,
+                                              comment="Le job après lequel la règle a été appliquée (0 : tout "
+                                                      "l'historique)")
+    last_job_id: Mapped[int] = mapped_column(Integer, nullable=True,
+                                             comment='Le dernier job auquel la règle a été appliquée')
+    hits: Mapped[int] = mapped_column(Integer, default=0,
+                                      comment='Nombre total de mouvements reconnus par la règle')
+    last_hits: Mapped[int] = mapped_column(Integer, default=0,
+                                           comment='Nombre de mouvements reconnus lors de la dernière application')
+    last_run: Mapped[datetime] = mapped_column(nullable=True)
+
+    def __repr__(self):
+        return f'Règle {self.keyword} appliquée jusqu\'au job {self.last_job_id}, {self.hits} mouvements reconnus'
+
+
 class Classifier(Base):
     __tablename__ = 'classifiers'
 
@@ -0,0 +1,150 @@
+""" A module dedicated to the detection of duplicate movements, such as overlapping exports or manual entries of
+transactions imported later.
+
+The movements are bucketed by account and amount, then sorted by date : the candidates of a movement are its
+followers in the bucket, up to MAX_DAYS days later, which are found by comparing the sorted arrays with themselves
+shifted by 1, 2, ... rows. Only these candidates have their descriptions (and user labels) compared.
+
+A duplicate is 'exact' when it has the date and the description of its original, 'fuzzy' otherwise. The original of a
+group of duplicates is the first movement entered (lowest index).
+
+The movements derived from another one (split sub-transactions, salary components, provisions) repeat its date and
+description by design : they are not compared."""
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func, or_
+from sqlalchemy.orm import Session
+
+from datamodel import Mouvement, Job
+from functions import deactivate_transactions
+from search import fold, trigrams
+
+# Largest number of days between a movement and its duplicate
+MAX_DAYS = 3
+
+# Smallest trigram similarity of the descriptions (or of the labels) of a fuzzy duplicate
+SIMILARITY_THRESHOLD = 0.5
+
+# Largest number of followers compared to a movement, for the buckets of many identical amounts on the same days
+MAX_WINDOW = 50
+
+DUPLICATE_COLUMNS = ['index', 'Original', 'Type', 'Date', 'Compte', 'Description', 'Label utilisateur', 'Montant',
+                     'Écart (jours)', 'Similarité']
+
+
+def get_active_mouvements(s: Session, comptes: list[str] = None, first_date: date = None) -> pd.DataFrame:
+    """ Returns the active movements of the accounts, with their signed amount, the derived movements being left out"""
+    stmt = select(Mouvement.index, Mouvement.date.label('Date'), Mouvement.compte.label('Compte'),
+                  Mouvement.description.label('Description'),
+                  Mouvement.label_utilisateur.label('Label utilisateur'),
+                  (func.coalesce(Mouvement.recette, 0) - func.coalesce(Mouvement.depense, 0)).label('Montant')).outerjoin(
+        Job, Mouvement.job_id == Job.job_id).where(
+        Mouvement.date_out_of_bound == False, Mouvement.compte != None, Mouvement.date != None,
+        Mouvement.index_parent == None, or_(Job.job_key == None, Job.job_key.notin_(Job.types_derived)))
+    if comptes:
+        stmt = stmt.where(Mouvement.compte.in_(comptes))
+    if first_date is not None:
+        stmt = stmt.where(Mouvement.date >= first_date)
+    df = pd.read_sql(stmt, s.connection())
+    df[['Description', 'Label utilisateur']] = df[['Description', 'Label utilisateur']].fillna('')
+    return df
+
+
+def get_candidate_pairs(df: pd.DataFrame, max_days: int, across_accounts: bool) -> tuple[np.ndarray, np.ndarray]:
+    """ Returns the positions (in df) of the pairs of movements of the same bucket, at most max_days apart"""
+    cents = np.round(df['Montant'].astype(float).to_numpy() * 100).astype(np.int64)
+    keys = [cents] if across_accounts else [cents, df['Compte'].to_numpy()]
+    buckets = pd.MultiIndex.from_arrays(keys).factorize()[0] if len(keys) > 1 else pd.factorize(cents)[0]
+    days = pd.to_datetime(df['Date']).to_numpy().astype('datetime64[D]').astype(np.int64)
+
+    order = np.lexsort((df['index'].to_numpy(), days, buckets))
+    buckets, days = buckets[order], days[order]
+    firsts, seconds = [], []
+    for shift in range(1, min(MAX_WINDOW, len(order) - 1) + 1):
+        close = (buckets[shift:] == buckets[:-shift]) & (days[shift:] - days[:-shift] <= max_days)
+        if not close.any():
+            # the followers further away are further in days too
+            break
+        positions = np.flatnonzero(close)
+        firsts.append(order[positions])
+        seconds.append(order[positions + shift])
+    if not firsts:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def get_groups(indexes: np.ndarray, firsts: np.ndarray, seconds: np.ndarray) -> dict:
+    """ Returns the original (the lowest index) of every movement of a group of duplicates"""
+    parents = {}
+
+    def find(i):
+        while parents.get(i, i) != i:
+            parents[i] = parents.get(parents[i], parents[i])
+            i = parents[i]
+        return i
+
+    for a, b in zip(indexes[firsts], indexes[seconds]):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parents[max(root_a, root_b)] = min(root_a, root_b)
+    return {i: find(i) for i in list(parents)}
+
+
+def find_duplicates(s: Session, comptes: list[str] = None, first_date: date = None, max_days: int = MAX_DAYS,
+                    threshold: float = SIMILARITY_THRESHOLD, across_accounts: bool = False) -> pd.DataFrame:
+    """ Finds the movements duplicating an earlier one : same amount, same account (any account if across_accounts),
+    dates at most max_days apart and similar descriptions or labels.
+
+    :returns: one row per duplicate, with the columns DUPLICATE_COLUMNS ('Original' is the index of the movement
+        kept), the most recent first"""
+    df = get_active_mouvements(s, comptes, first_date)
+    firsts, seconds = get_candidate_pairs(df, max_days, across_accounts)
+
+    # comparison of the texts of the candidates only
+    positions = np.unique(np.concatenate([firsts, seconds]))
+    descriptions = {p: ' '.join(fold(df['Description'].iat[p]).split()) for p in positions}
+    labels = {p: fold(df['Label utilisateur'].iat[p]).strip() for p in positions}
+    description_trigrams = {p: trigrams(t) for p, t in descriptions.items()}
+    label_trigrams = {p: trigrams(t) for p, t in labels.items()}
+
+    def get_similarity(a, b) -> float:
+        if descriptions[a] == descriptions[b] or (labels[a] and labels[a] == labels[b]):
+            return 1.0
+        result = 0.0
+        for grams in (description_trigrams, label_trigrams):
+            if grams[a] and grams[b]:
+                result = max(result, len(grams[a] & grams[b]) / len(grams[a] | grams[b]))
+        return result
+
+    similarities = np.array([get_similarity(a, b) for a, b in zip(firsts, seconds)])
+    kept = similarities >= threshold
+    firsts, seconds, similarities = firsts[kept], seconds[kept], similarities[kept]
+
+    indexes = df['index'].to_numpy()
+    originals = get_groups(indexes, firsts, seconds)
+    duplicates = df[[originals.get(i, i) != i for i in indexes]].copy()
+    duplicates['Original'] = duplicates['index'].map(originals)
+
+    # best similarity of every duplicate
+    best = pd.concat([pd.Series(similarities, index=indexes[firsts]),
+                      pd.Series(similarities, index=indexes[seconds])]).groupby(level=0).max()
+    duplicates['Similarité'] = duplicates['index'].map(best).round(2)
+
+    # the originals are in the candidate pairs too
+    original_positions = pd.Series(np.arange(len(df)), index=indexes)[duplicates['Original']].to_numpy()
+    duplicates['Écart (jours)'] = [abs((d - df['Date'].iat[o]).days)
+                                   for d, o in zip(duplicates['Date'], original_positions)]
+    same_description = [descriptions[p] == descriptions[o] for p, o in zip(
+        np.flatnonzero(df['index'].isin(duplicates['index'])), original_positions)]
+    duplicates['Type'] = np.where((duplicates['Écart (jours)'] == 0) & np.array(same_description, dtype=bool),
+                                  'exact', 'fuzzy')
+    return duplicates[DUPLICATE_COLUMNS].sort_values(['Date', 'index'], ascending=False, ignore_index=True)
+
+
+def deactivate_duplicates(s: Session, duplicates: pd.DataFrame) -> int:
+    """ Deactivates the duplicates found by find_duplicates, their originals being kept
+
+    :returns: the number of movements deactivated"""
+    return deactivate_transactions(s, duplicates['index'].astype(int).tolist())
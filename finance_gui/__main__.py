@@ -12,6 +12,10 @@ from sqlalchemy.orm import Session
 import matplotlib.pyplot as plt
 from interests import generate_payment_schedule
 from graphs import GraphSolde
+from matching import KeywordAutomaton
+from registry import keyword_registry
+from finance_gui.worker import QueryWorker, QUERY_DONE
+from duplicates import find_duplicates, deactivate_duplicates, MAX_DAYS
 
 import engines
 import pandas as pd
@@ -25,7 +29,7 @@ from functions import get_comptes, get_type_comptes, fetch_mouvements, get_group
     save_capital_reimbursements, get_provisions_for_month, deactivate_transactions, deactivate_transaction, \
     apply_mass_update, import_keyword, get_matching_keywords, get_keywords, simple_split, split_mouvement, split_number, \
     get_balances, calculate_labels, find_salary_transaction, get_salary_candidates, get_jobs, get_numeros_reference, \
-    save_map_categorie, identify_gaps, fetch_soldes, JobMapper, split_value, get_salaries
+    save_map_categorie, identify_gaps, document_salary_candidates, fetch_soldes, JobMapper, split_value, get_salaries
 
 # Connexion à la base de données PostgreSQL
 engine = engines.get_pgfin_engine()
@@ -38,7 +42,7 @@ declarants = ['Vincent', 'Aurélie']
 
 
 def makesession() -> Session:
-    return Session(engines.get_pgfin_engine())
+    return engines.makesession()
 
 
 def fetch_provisions(view: Iterable, offset_size: int, category_filter: str, month_filter: datetime.date,
@@ -53,7 +57,7 @@ def fetch_provisions(view: Iterable, offset_size: int, category_filter: str, mon
 
 def fetch_keywords():
     with Session(engine) as session:
-        result = session.scalars(select(MapCategorie).order_by(MapCategorie.categorie)).all()
+        result = keyword_registry.get_maps(session)
 
     return result
 
@@ -65,29 +69,56 @@ def fetch_balances():
     return result
 
 
-def fetch_salary_candidates():
-    result = get_salary_candidates(engine)
+def fetch_main_page(view: Iterable, offset_size: int, selected_type: str, **filters) -> tuple:
+    """ Loads the movements, the account balances and the transfer balances of the main form"""
+    with makesession() as s:
+        df = fetch_mouvements(s, view=view, offset_size=offset_size, sort_order="desc", **filters)
+        soldes = fetch_soldes(s, selected_type)
+    return df, soldes, fetch_balances()
+
+
+def fetch_solde(compte: str, period_begin: datetime.date, period_end: datetime.date) -> pd.DataFrame:
+    with makesession() as s:
+        return get_solde(s, compte, period_begin, period_end)
+
+
+def fetch_yearly_realise(toggle_state: bool, is_economie: bool, categorie: str, annee: int, group) -> tuple:
+    """ Loads the realised amounts of the previous year and the provisions of the year"""
+    with makesession() as s:
+        realise = get_yearly_realise(s, False, toggle_state, is_economie, categorie, annee - 1, group)
+        provisionne = get_yearly_realise(s, True, toggle_state, is_economie, categorie, annee, group)
+    return realise, provisionne
+
+
+def fetch_groups_of_category(categorie: str, annee: int) -> list:
+    with makesession() as s:
+        groups = get_groups_of_category(s, categorie, annee)
+    return groups['Classe'].values.tolist()
+
+
+def fetch_salary_candidates(rescan: bool = False) -> pd.DataFrame:
+    with makesession() as s:
+        result = get_salary_candidates(s, rescan)
     return result
 
 
-def format_metrics(depense: float, recette: float, solde: float):
-    return f"Dépense : {round(depense, 2)} | Recette : {round(recette, 2)} | Solde : {round(solde, 2)}"
+def fetch_duplicates(max_days: int, across_accounts: bool) -> pd.DataFrame:
+    with makesession() as s:
+        result = find_duplicates(s, max_days=max_days, across_accounts=across_accounts)
+    return result
 
 
-def classify(value: str, classification_matrix):
-    for pattern, result in classification_matrix:
-        if pattern in value:
-            return pattern, result
-    return None, 'Common'
+def format_metrics(depense: float, recette: float, solde: float):
+    return f"Dépense : {round(depense, 2)} | Recette : {round(recette, 2)} | Solde : {round(solde, 2)}"
 
 
 def categorize_provisions(transactions: pd.DataFrame, patterns: pd.DataFrame) -> pd.DataFrame:
     """ categorizes the provisions in groups and patterns"""
+    classifier = KeywordAutomaton.from_dataframe(patterns, 'patterns', 'classes', 'Common')
 
     # Classifying
-    transactions['Group'] = transactions['Description'].apply(classify, classification_matrix=patterns.values)
-
-    transactions[['Pattern', 'Group']] = transactions['Group'].apply(pd.Series)
+    transactions['Group'] = classifier.classify_series(transactions['Description'])
+    transactions['Pattern'] = classifier.pattern_series(transactions['Description'])
     # Returning
     result = transactions[['Group', 'Pattern', 'index', 'Description', 'Solde', 'Provision']].sort_values(
         ['Group', 'Description'])
@@ -445,6 +476,7 @@ def form_update_provision(offset_size: int, categorie: str, mois: datetime.date,
                 with Session(engine) as session:
                     session.add(cl)
                     session.commit()
+                    keyword_registry.invalidate()
                     sg.popup_ok(f'Creation of classifier : {cl} done')
                     update_values = True
         elif event == "-DELETE-":
@@ -532,9 +564,10 @@ def form_update_keyword(description: str):
                 with Session(engine) as session:
                     for mc in mcs:
                         mc.categorie = new_cat
-                        session.add(mc)
+                        session.merge(mc)
 
                     session.commit()
+                keyword_registry.invalidate()
 
                 sg.popup("Changes saved")
                 break
@@ -819,6 +852,7 @@ def form_manage_yearly_provisions():
     ##########
     update_values: bool = False
     update_groups: bool = False
+    show_realise: bool = False
     status_message: str = ''
     toggle_state = True
 
@@ -886,6 +920,7 @@ def form_manage_yearly_provisions():
 
     # Display
     window = sg.Window(f"Créer des provisions annuelles pour {categorie}", layout=layout, modal=True)
+    worker = QueryWorker(window)
 
     while True:
         event, values = window.read()
@@ -972,11 +1007,18 @@ def form_manage_yearly_provisions():
                 status_message = "Save successfull"
             else:
                 sg.PopupError(error_message)
+        elif event == QUERY_DONE:
+            query = values[QUERY_DONE]
+            if query.error is not None:
+                window['-STATUS-BAR-'].update(f"Erreur de chargement : {query.error}")
+            elif query.name == 'groups':
+                window['-GROUP-'].update(values=query.result)
+            elif query.name == 'realise':
+                realise, provisionne = query.result
+                show_realise = True
 
         if update_groups:
-            with makesession() as s:
-                groups = get_groups_of_category(s, categorie, annee - 1)
-            window['-GROUP-'].update(values=groups['Classe'].values.tolist())
+            worker.submit('groups', fetch_groups_of_category, categorie, annee - 1)
             group = None
 
             update_groups = False
@@ -985,11 +1027,13 @@ def form_manage_yearly_provisions():
             window['-TOGGLE-'].update('Dépense' if toggle_state else 'Recette',
                                       button_color=get_toggle_style(toggle_state))
 
-            # update réalisé et provisionné
-            with makesession() as s:
-                realise = get_yearly_realise(s, False, toggle_state, is_economie, categorie, annee - 1, group)
-                provisionne = get_yearly_realise(s, True, toggle_state, is_economie, categorie, annee, group)
+            # update réalisé et provisionné, in the background
+            worker.submit('realise', fetch_yearly_realise, toggle_state, is_economie, categorie, annee, group)
+
+            window['-STATUS-BAR-'].update(status_message)
+            update_values = False
 
+        if show_realise:
             window['-REALISE-'].update(realise.values.tolist())
             window['-TOTALREALISE-'].update(
                 f"Total : {realise['Dépense'].sum() if toggle_state else realise['Recette'].sum():.2f} €")
@@ -1001,10 +1045,9 @@ def form_manage_yearly_provisions():
                 f"Total : {provisionne['Dépense Provisionnée'].sum() if toggle_state else provisionne['Recette Provisionnée'].sum():.2f} €")
             window['-MOYENNEPROVISIONNE-'].update(
                 f"Moyenne : {provisionne['Dépense Provisionnée'].mean() if toggle_state else provisionne['Recette Provisionnée'].mean():.2f} €")
+            show_realise = False
 
-            window['-STATUS-BAR-'].update(status_message)
-            update_values = False
-
+    worker.shutdown()
     window.close()
 
     # TODO : pour une catégorie et une année donnée, récupérer toutes les transactions, classifier
@@ -1284,9 +1327,8 @@ def form_check_keywords(df: pd.DataFrame, offset_size: int):
         if update_values:
             # retrieve the keywords
             keywords = fetch_keywords()
-            kw_list = [kw.keyword for kw in keywords]
-            df['Matched ?'] = df.apply(lambda x: any([True if kw in x.Description else False for kw in kw_list]),
-                                       axis=1)
+            automaton = KeywordAutomaton([kw.keyword for kw in keywords])
+            df['Matched ?'] = automaton.match_series(df['Description']).notna()
             unmatched = df.loc[~df['Matched ?']]
             percentage = 1 - len(unmatched) / len(df)
             # update layout
@@ -1326,6 +1368,52 @@ def form_check_keywords(df: pd.DataFrame, offset_size: int):
         window['-STATUS-BAR-'].update(status_message)
 
 
+def form_duplicates() -> bool:
+    """ Lists the duplicate transactions, which can be deactivated (the originals are kept)
+
+    :returns: True if transactions were deactivated"""
+    df = fetch_duplicates(MAX_DAYS, False)
+
+    layout = [
+        [sg.Text("Jours d'écart : "), sg.InputText(default_text=str(MAX_DAYS), key='-DAYS-', size=(5, 1)),
+         sg.Checkbox("Tous comptes confondus", key='-ACROSS-'), sg.Button("Scan")],
+        [sg.Table(values=df.values.tolist(), headings=list(df.columns), key='-DUPLICATES-',
+                  justification="center", auto_size_columns=True, num_rows=20)],
+        [sg.Button("Deactivate Selected", size=(20, 1)),
+         sg.Button("Deactivate All", size=(20, 1), button_color=("white", "red"))],
+        [sg.HorizontalSeparator()],
+        [sg.Text(f"{len(df)} duplicates found", key='-STATUS-BAR-')]
+    ]
+
+    window = sg.Window("Duplicate transactions", layout, modal=True, finalize=True)
+
+    deactivated = False
+    while True:
+        event, values = window.read()
+        if event == sg.WIN_CLOSED:
+            window.close()
+            break
+        status_message = None
+        if event == "Scan":
+            df = fetch_duplicates(int(values['-DAYS-'] or 0), values['-ACROSS-'])
+            status_message = f"{len(df)} duplicates found"
+        elif event in ("Deactivate Selected", "Deactivate All"):
+            selection = df.iloc[values['-DUPLICATES-']] if event == "Deactivate Selected" else df
+            if len(selection) == 0:
+                sg.PopupOK("No rows selected !")
+                continue
+            with makesession() as s:
+                count = deactivate_duplicates(s, selection)
+            deactivated = True
+            df = df[~df['index'].isin(selection['index'])]
+            status_message = f"Transactions deactivated : {count}"
+        if status_message is not None:
+            window['-DUPLICATES-'].update(values=df.values.tolist())
+            window['-STATUS-BAR-'].update(status_message)
+
+    return deactivated
+
+
 def form_salary_monitor():
     """ Displays a monitor with salaries"""
     # Perform the initial download
@@ -1367,6 +1455,20 @@ def form_salary_monitor():
         if event == sg.WIN_CLOSED:
             window.close()
             break
+        elif event in ("Scan last import", "Re-scan all"):
+            df = fetch_salary_candidates(event == "Re-scan all")
+            window['-DETECTED-'].update(values=df.values.tolist())
+        elif event == "Import":
+            if not values['-DETECTED-']:
+                sg.popup("Sélectionnez les salaires à documenter", title='Salaries')
+                continue
+            # the rules will not scan these jobs again, once the selected candidates are documented
+            with makesession() as s:
+                count = document_salary_candidates(s, df, values['-DETECTED-'])
+                s.commit()
+            sg.popup(f"Salaries documented : {count}", title='Salaries')
+            df = fetch_salary_candidates()
+            window['-DETECTED-'].update(values=df.values.tolist())
 
 
 def form_solde_bancaire(compte: str):
@@ -1399,6 +1501,7 @@ def form_solde_bancaire(compte: str):
     ]
 
     window = sg.Window(f"Solde du compte {compte}", layout, finalize=True)
+    worker = QueryWorker(window)
 
     # Dessiner le graphique sur le canevas
     canvas = FigureCanvasTkAgg(gs.fig, master=window["-CANVAS-"].TKCanvas)
@@ -1411,15 +1514,23 @@ def form_solde_bancaire(compte: str):
         if event in (sg.WIN_CLOSED, "Quitter"):
             break
         elif event in ('-DEBUT-', '-FIN-'):
-            period_begin = datetime.date.fromisoformat(values['-DEBUT-'])
-            period_end = datetime.date.fromisoformat(values['-FIN-'])
-            with makesession() as s:
-                solde = get_solde(s, compte, period_begin, period_end)
+            try:
+                period_begin = datetime.date.fromisoformat(values['-DEBUT-'])
+                period_end = datetime.date.fromisoformat(values['-FIN-'])
+            except ValueError:
+                # date still being typed
+                continue
+            worker.submit('solde', fetch_solde, compte, period_begin, period_end)
+        elif event == QUERY_DONE and values[QUERY_DONE].error is None:
+            solde = values[QUERY_DONE].result
             window['-SOLDES-'].update(values=solde.values.tolist())
             # Update the graph
             gs.plot_solde(solde, linestyle='-', marker='o', linewidth=2.0)
             canvas.draw()
 
+    worker.shutdown()
+    window.close()
+
 
 class StringParser:
     def display(self, value):
@@ -1653,6 +1764,8 @@ def form_main():
     # Définition des variables d'état
     offset_size = 30  # Default value
     offset = 0
+    cursor = None
+    cursor_backward = False
 
     tag_filter = None
     job_filter = 0
@@ -1697,7 +1810,8 @@ def form_main():
          sg.Button("Pattern Check", size=(15, 1), button_color=("white", "blue")),
          sg.Button("Salary Monitor", size=(15, 1), button_color=("white", "blue")),
          sg.Button("Maps", size=(15, 1), button_color=("white", "blue")),
-         sg.Button("Facts", size=(15, 1), button_color=("white", "blue"))],
+         sg.Button("Facts", size=(15, 1), button_color=("white", "blue")),
+         sg.Button("Duplicates", size=(15, 1), button_color=("white", "blue"))],
         [sg.Text("Filter By :"),
          sg.Text("Catégorie : "), common_category_combo(),
          sg.Text("Compte : "), common_compte_combo(),
@@ -1749,12 +1863,23 @@ def form_main():
 
     # Création de la fenêtre
     window = sg.Window("Finance Interface", layout)
+    # Les requêtes sont exécutées en arrière-plan
+    worker = QueryWorker(window)
+
+    # Les événements qui changent la liste des mouvements : la pagination repart de la première page
+    filter_events = ('-CLEAR-', '-CATEGORIE-', 'Filtrer par cette catégorie...', '-COMPTE-', '-REIMBURSABLE-',
+                     '-AFFECTABLE-', '-ECONOMY-', '-TIME-', '-APPLY-FILTER-', '-JOBS-', '-NOS-', '-SORT-DATE-',
+                     '-SORT-INDEX-', '-OFFSET-')
 
     # Boucle d'événements
     while True:
         event, values = window.read()
         update_values = False
         update_tags = False
+        if event in filter_events:
+            offset = 0
+            cursor = None
+            cursor_backward = False
 
         if event in (sg.WIN_CLOSED, "Quitter"):
             break
@@ -1777,6 +1902,8 @@ def form_main():
             form_manage_keywords()
         elif event == "Facts":
             form_faits_marquants()
+        elif event == "Duplicates":
+            update_values = form_duplicates()
         elif event == "-CLEAR-":
             job_filter = 0
             tag_filter = None
@@ -1831,18 +1958,26 @@ def form_main():
         elif event == '-SORT-INDEX-':
             sort_column = 'index'
             update_values = True
+        elif event in ("Previous", "Next") and worker.is_busy('mouvements'):
+            # the cursors of the page being loaded are not known yet
+            status_message = "Chargement en cours..."
         elif event == "Previous":
             # Revenir aux lignes précédentes
             if offset > 0:
                 offset -= offset_size
                 offset = max(offset, 0)
+                cursor = df.attrs['previous_cursor'] if offset > 0 else None
+                cursor_backward = True
                 update_values = True
         elif event == "Next":
-            offset += offset_size
-            update_values = True
+            if not df.attrs['next_cursor'] is None:
+                offset += offset_size
+                cursor = df.attrs['next_cursor']
+                cursor_backward = False
+                update_values = True
         elif event == "-OFFSET-":
             offset_size = int(values["-OFFSET-"])
-            status_message = f"Offset size changed to {offset}"
+            status_message = f"Offset size changed to {offset_size}"
             update_values = True
         elif event == '-CTYPES-':
             selected_type = values['-CTYPES-']
@@ -1908,8 +2043,9 @@ def form_main():
                 template = form_update_transactions(indexes, nos_ref)
                 if not template is None:
                     with makesession() as session:
-                        apply_mass_update(session, indexes, template)
+                        count = apply_mass_update(session, indexes, template)
                         session.commit()
+                    status_message = f"Transactions updated : {str(count)}"
                     if not template.no_de_reference in nos_ref:
                         nos_ref = [template.no_de_reference] + nos_ref
                         update_tags = True
@@ -1968,9 +2104,8 @@ def form_main():
             else:
                 indexes = df.iloc[selected_rows, 0].values.tolist()
                 with makesession() as s:
-                    deactivate_transactions(s, indexes)
-                    s.commit()
-                status_message = f"Transactions deactivated : {str(len(indexes))}"
+                    count = deactivate_transactions(s, indexes)
+                status_message = f"Transactions deactivated : {str(count)}"
                 update_values = True
         elif event == "Reimbursement Scheme":
             # retrieve the account
@@ -1987,33 +2122,36 @@ def form_main():
             sg.PopupOK(f'Prettification done, affected records : {affected_records}')
             # update the display
             update_values = True
+        elif event == QUERY_DONE:
+            query = values[QUERY_DONE]
+            if query.error is not None:
+                status_message = f"Erreur de chargement : {query.error}"
+            elif query.name == 'mouvements':
+                df, soldes, balances = query.result
+                window["-MVTS-"].update(values=df.values.tolist())
+                window["-SOLDES-"].update(values=soldes.values.tolist())
+                window['-BALANCES-'].update(values=balances.values.tolist())
+                # Metrics
+                metric_label = format_metrics(df.loc[df['Solde'] < 0]['Solde'].sum(),
+                                              df.loc[df['Solde'] > 0]['Solde'].sum(), df['Solde'].sum())
+                window['-METRICS-'].update(metric_label)
         if update_values:
-            with makesession() as s:
-                df = fetch_mouvements(s, view=view_columns, offset_size=offset_size, offset=offset,
-                                      search_filter=desc_filter,
-                                      sort_column=sort_column, sort_order="desc", category_filter=category_filter,
-                                      compte_filter=compte_filter, reimbursable=reimbursable_filter,
-                                      affectable=affectable_filter, economy_mode=economy_mode, job_id=job_filter,
-                                      tag_filter=tag_filter)
-                soldes = fetch_soldes(s, selected_type)
-
-            window["-MVTS-"].update(values=df.values.tolist())
-            window["-SOLDES-"].update(values=soldes.values.tolist())
-            balances = fetch_balances()
-            window['-BALANCES-'].update(values=balances.values.tolist())
+            # the page still being loaded, if any, is replaced by this one
+            worker.submit('mouvements', fetch_main_page, view_columns, offset_size, selected_type,
+                          search_filter=desc_filter, sort_column=sort_column, category_filter=category_filter,
+                          compte_filter=compte_filter, reimbursable=reimbursable_filter,
+                          affectable=affectable_filter, economy_mode=economy_mode, job_id=job_filter,
+                          tag_filter=tag_filter, cursor=cursor, backward=cursor_backward)
             window['-ECONOMY-'].update(text='Economies' if economy_mode else 'All Expenses',
                                        button_color=get_toggle_style(economy_mode))
             window['-TIME-'].update(text='Passé' if toggle_past else 'Futur',
                                     button_color=get_toggle_style(toggle_past))
             if update_tags:
                 window['-NOS-'].update(values=nos_ref)
-            # Metrics
-            metric_label = format_metrics(df.loc[df['Solde'] < 0]['Solde'].sum(),
-                                          df.loc[df['Solde'] > 0]['Solde'].sum(), df['Solde'].sum())
-            window['-METRICS-'].update(metric_label)
         # Updating the status bar
         window["-STATUS-BAR-"].update(status_message)
     # Fermeture de la fenêtre
+    worker.shutdown()
     window.close()
 
 
@@ -0,0 +1,82 @@
+""" Runs the queries of the forms on worker threads, so that the window stays responsive.
+
+Every query is submitted under a name (for instance 'mouvements'). A new submission under the same name makes the
+previous one stale : it is cancelled if it did not start yet, and its result is dropped otherwise. The result of the
+latest submission is posted back to the window with write_event_value, the event value being a QueryResult."""
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, NamedTuple, Any
+
+# Event posted to the window when a query is done
+QUERY_DONE = '-QUERY-DONE-'
+
+
+class QueryResult(NamedTuple):
+    name: str
+    generation: int
+    result: Any
+    error: Exception | None
+
+
+class QueryWorker:
+    """ Executes the queries of one window off the UI thread.
+
+    The submitted functions must open their own session : the sessions cannot be shared between threads."""
+
+    def __init__(self, window, event_key: str = QUERY_DONE, max_workers: int = 2):
+        self.__window__ = window
+        self.__event_key__ = event_key
+        self.__executor__ = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='finance-query')
+        self.__lock__ = threading.Lock()
+        self.__generations__ = {}
+        self.__futures__ = {}
+        self.__closed__ = False
+
+    def is_current(self, name: str, generation: int) -> bool:
+        with self.__lock__:
+            return not self.__closed__ and self.__generations__.get(name) == generation
+
+    def is_busy(self, name: str = None) -> bool:
+        """ Tells if a query (of the given name, or of any name) is still running or waiting"""
+        with self.__lock__:
+            return any(not f.done() for n, f in self.__futures__.items() if name is None or n == name)
+
+    def submit(self, name: str, function: Callable, *args, **kwargs) -> int:
+        """ Runs function(*args, **kwargs) on a worker thread, the previous query of the same name becoming stale
+
+        :returns: the generation of the query, found in the QueryResult posted to the window"""
+        with self.__lock__:
+            if self.__closed__:
+                raise ValueError('the worker is shut down')
+            generation = self.__generations__.get(name, 0) + 1
+            self.__generations__[name] = generation
+            previous = self.__futures__.get(name)
+            if previous is not None:
+                previous.cancel()
+            self.__futures__[name] = self.__executor__.submit(self.__run__, name, generation, function, args, kwargs)
+        return generation
+
+    def __run__(self, name: str, generation: int, function: Callable, args: tuple, kwargs: dict):
+        if not self.is_current(name, generation):
+            return
+        try:
+            result, error = function(*args, **kwargs), None
+        except Exception as e:
+            result, error = None, e
+        if self.is_current(name, generation):
+            self.__window__.write_event_value(self.__event_key__, QueryResult(name, generation, result, error))
+
+    def cancel(self, name: str):
+        """ Makes the query of the given name stale"""
+        with self.__lock__:
+            self.__generations__[name] = self.__generations__.get(name, 0) + 1
+            future: Future = self.__futures__.pop(name, None)
+            if future is not None:
+                future.cancel()
+
+    def shutdown(self):
+        """ Drops every query : to be called before closing the window"""
+        with self.__lock__:
+            self.__closed__ = True
+            self.__futures__.clear()
+        self.__executor__.shutdown(wait=False, cancel_futures=True)
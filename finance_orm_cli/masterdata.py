@@ -1,16 +1,27 @@
 import datetime as dt
 from engines import get_pgfin_engine, get_sqlite_engine
 from datamodel import Compte, Categorie, Mouvement, Base, MapOrganisme, Job, Salaire
-from sqlalchemy import select
+from sqlalchemy import select, Engine
 
 import pandas as pd
 
+from backups import backup_database, incremental_backup, compact_backup
+from ingestion import add_content_hash_column, import_statement
+from indexes import create_indexes, get_index_statistics, get_unused_indexes
+from ledger import create_ledger_tables, rebuild_daily_balances, sync_ledger
+from search import create_search_index
+from recurring import find_recurrences, propose_provisions, insert_provisions, remove_existing_provisions
+from rules import apply_category_maps, get_rule_statistics
+from snapshot import export_snapshot, SNAPSHOT_ROOT
 from functions import fetch_mouvements, get_remaining_provisioned_expenses, close_provision, create_salaries, \
-    split_mouvement, generate_provision
+    split_mouvement, generate_provision, create_number_sequence
 
 # create the engine
 e = get_pgfin_engine()
 
+# the backup updated by the incremental backups
+INCREMENTAL_BACKUP = 'finance_backup_incremental.sqlite'
+
 # create the session
 from sqlalchemy.orm import Session
 
@@ -156,6 +167,10 @@ def mouvements():
         print('4 Salary Import')
         print('5 Close Provision')
         print('6 Generate Provision')
+        print('7 Apply category maps')
+        print('8 Category maps statistics')
+        print('9 Import bank statement')
+        print('10 Propose recurring provisions')
         choice = input('Que voulez-vous faire ? (quit pour quitter) : ')
         if choice == 'quit':
             stay = False
@@ -189,10 +204,63 @@ def mouvements():
                 dep = get_int_input('Provision à payer')
                 rec = get_int_input('Provision à récupérer')
                 generate_provision(cat, year, description, dep, rec)
+        if choice == '7':
+            apply_maps()
+        if choice == '8':
+            with Session(e) as session:
+                print(get_rule_statistics(session))
+        if choice == '9':
+            import_bank_statement(categories)
+        if choice == '10':
+            seed_provisions()
 
     print('Closing the session and exiting. Thank you !')
 
 
+def apply_maps():
+    """ Applies the category maps to the movements of the new jobs, or of the whole history on demand"""
+    rescan = input('Appliquer les règles à tout l\'historique ? (o/N) : ').strip().lower() == 'o'
+    with Session(e) as session:
+        hits = apply_category_maps(session, rescan=rescan)
+        session.commit()
+    print(f'Category maps applied, {sum(hits.values())} movements matched by {len([h for h in hits.values() if h])} '
+          f'maps')
+
+
+def import_bank_statement(categories: list[str]):
+    """ Imports a CSV, OFX or QIF statement into an account, the rows already imported being skipped"""
+    path = input('Statement file (.csv, .ofx or .qif) : ')
+    with Session(e) as session:
+        comptes = session.scalars(select(Compte.compte).order_by(Compte.compte)).all()
+    compte = get_list_input(comptes)
+    print('Catégorie des mouvements non reconnus : ')
+    categorie = get_list_input(categories)
+    statistics = import_statement(e, path, compte, categorie)
+    print(f"{statistics['inserted']} movements imported, {statistics['duplicates']} already imported "
+          f"({statistics['read']} read)")
+
+
+def seed_provisions():
+    """ Proposes the provisions of a year from the recurring transactions, and saves them once confirmed"""
+    year = get_int_input('provision year')
+    with Session(e) as session:
+        recurrences = find_recurrences(session)
+        print(recurrences[recurrences['Active']])
+        proposal = propose_provisions(recurrences, year)
+        rows = remove_existing_provisions(session, proposal)
+        if len(rows) < len(proposal):
+            print(f'{len(proposal) - len(rows)} provisions skipped, their categories being already provisioned in '
+                  f'{year}')
+        print(pd.DataFrame(rows, columns=['description', 'categorie', 'mois', 'provision_payer',
+                                          'provision_recuperer']))
+        if not rows:
+            return
+        if input(f'Save the {len(rows)} provisions ? (y/n) : ') == 'y':
+            insert_provisions(session, rows)
+            session.commit()
+            print('Provisions generated')
+
+
 def shutdown_category():
     """ This function takes a category, a month.
      It calculates the remaining amount
@@ -232,6 +300,11 @@ def database():
     while stay:
         print('1 Backup')
         print('2 Schema update')
+        print('3 Rebuild ledger')
+        print('4 Incremental backup')
+        print('5 Compact incremental backup')
+        print('6 Export analytics snapshot')
+        print('7 Index report')
         choice = input('Que voulez-vous faire ? (quit pour quitter) : ')
         if choice == 'quit':
             stay = False
@@ -239,83 +312,77 @@ def database():
             backup()
         if choice == '2':
             update_schema()
+        if choice == '3':
+            rebuild_ledger()
+        if choice == '4':
+            backup_incremental()
+        if choice == '5':
+            compact_backup(get_sqlite_engine(['FinanceBackups', INCREMENTAL_BACKUP]))
+            print(f'Backup {INCREMENTAL_BACKUP} compacted')
+        if choice == '6':
+            export_analytics()
+        if choice == '7':
+            index_report()
 
     print('Closing the session and exiting. Thank you !')
     session.close()
 
 
-def backup():
+def backup(source: Engine = None, backupengine: Engine = None):
     """ Backup the postgres database to a SQLite extract """
-    # create a new name
-    backupname = '_'.join(['finance_backup_', dt.datetime.now().strftime('%Y-%m-%d_%H-%M-%S'), '.sqlite'])
-    # create a new engine
-    backupengine = get_sqlite_engine(['FinanceBackups', backupname])
+    if backupengine is None:
+        # create a new name
+        backupname = '_'.join(['finance_backup_', dt.datetime.now().strftime('%Y-%m-%d_%H-%M-%S'), '.sqlite'])
+        # create a new engine
+        backupengine = get_sqlite_engine(['FinanceBackups', backupname])
+    else:
+        backupname = str(backupengine.url)
 
-    # reflect the model
-    Base.metadata.create_all(backupengine)
-
-    # collect the data from the postgres
-    with Session(e) as session:
-        listcomptes = session.scalars(select(Compte)).all()
-        listcategories = session.scalars(select(Categorie)).all()
-        listmapo = session.scalars(select(MapOrganisme)).all()
-        listjobs = session.scalars(select(Job)).all()
-        mvts = session.scalars(select(Mouvement)).all()
-
-    # Backup
-    with Session(backupengine) as backup_session:
-        for c in listcomptes:
-            new_c = Compte(compte=c.compte, compte_type=c.compte_type, compte_minuscule=c.compte_minuscule)
-            backup_session.add(new_c)
-
-        for cat in listcategories:
-            new_cat = Categorie(categorie=cat.categorie, categorie_groupe=cat.categorie_groupe,
-                                categorie_order=cat.categorie_order, provision_type=cat.provision_type)
-            backup_session.add(new_cat)
-
-        for mo in listmapo:
-            new_mo = MapOrganisme(keyword=mo.keyword, organisme=mo.organisme)
-            backup_session.add(new_mo)
-
-        for j in listjobs:
-            new_job = Job(job_id=j.job_id, job_key=j.job_key, job_timestamp=j.job_timestamp, job_mois=j.job_mois)
-            backup_session.add(new_job)
-
-        for m in mvts:
-            j = backup_session.get(Job, m.job_id)
-            new_mvt = Mouvement(date=m.date,
-                                description=m.description,
-                                recette=m.recette,
-                                depense=m.depense,
-                                compte=m.compte,
-                                categorie=m.categorie,
-                                economie=m.economie,
-                                regle=m.regle,
-                                mois=m.mois,
-                                date_insertion=m.date_insertion,
-                                provision_payer=m.provision_payer,
-                                provision_recuperer=m.provision_recuperer,
-                                date_remboursement=m.date_remboursement,
-                                organisme=m.organisme,
-                                date_out_of_bound=m.date_out_of_bound,
-                                taux_remboursement=m.taux_remboursement,
-                                fait_marquant=m.fait_marquant,
-                                no=m.no,
-                                no_de_reference=m.no_de_reference,
-                                index_parent=m.index_parent,
-                                depense_initiale=m.depense_initiale,
-                                recette_initiale=m.recette_initiale,
-                                label_utilisateur=m.label_utilisateur,
-                                job=j)
-            backup_session.add(new_mvt)
-
-        backup_session.flush()
-        backup_session.commit()
+    # stream every table to the backup, and check the row counts
+    copied = backup_database(source if source is not None else e, backupengine)
 
     # End
-    print(f'Backup done, database saved as : {backupname}')
+    print(f'Backup done, {sum(copied.values())} rows in {len(copied)} tables, database saved as : {backupname}')
+
+
+def backup_incremental(source: Engine = None, backupengine: Engine = None):
+    """ Brings the incremental backup up to date, it is fully created on the first run """
+    if backupengine is None:
+        backupengine = get_sqlite_engine(['FinanceBackups', INCREMENTAL_BACKUP])
+
+    written = incremental_backup(source if source is not None else e, backupengine)
+
+    print(f'Incremental backup done, {sum(written.values())} rows written : {written}')
+
+
+def export_analytics():
+    """ Exports the movements and the bilans to the Parquet snapshot of the analytical pages"""
+    with Session(e) as session:
+        counts = export_snapshot(session)
+    print(f'Snapshot exported to {SNAPSHOT_ROOT} : {counts}')
 
 
 def update_schema():
     Base.metadata.create_all(e)
+    create_ledger_tables(e)
+    sync_ledger(e)
+    create_number_sequence(e)
+    create_search_index(e)
+    add_content_hash_column(e)
+    created = create_indexes(e)
+    print(f"indexes created : {', '.join(created)}" if created else "indexes up to date")
     print("schema reflected")
+
+
+def index_report():
+    """ Prints the indexes of the database, with their usage and size"""
+    print(get_index_statistics(e))
+    print(f"Unused declared indexes : {get_unused_indexes(e)}")
+
+
+def rebuild_ledger():
+    """ Rebuilds the daily balance ledger from scratch"""
+    with Session(e) as session:
+        count = rebuild_daily_balances(session)
+        session.commit()
+    print(f'Ledger rebuilt, {count} daily balances written')
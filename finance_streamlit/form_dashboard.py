@@ -7,6 +7,7 @@ import plotly.express as px
 from datetime import date, timedelta
 from engines import makesession
 from functions import get_type_comptes, get_grouped_transactions, get_grouped_transactions
+from projection import project_balances
 
 
 def show_dashboard():
@@ -15,7 +16,7 @@ def show_dashboard():
 
     # --- 1. BARRE DE FILTRES (INPUTS) ---
     with st.container(border=True):
-        col_type, col_start, col_end = st.columns(3)
+        col_type, col_start, col_end, col_projection = st.columns(4)
 
         with col_type:
             # Récupération des types via ta fonction
@@ -30,6 +31,10 @@ def show_dashboard():
         with col_end:
             end_date = st.date_input("Date de fin", value=date.today())
 
+        with col_projection:
+            projection_months = st.selectbox("Projection", options=[0, 12, 24], index=0,
+                                             format_func=lambda m: f"{m} mois" if m else "Aucune")
+
     # --- 2. RÉCUPÉRATION DES DONNÉES ---
     # On appelle ta fonction de regroupement
     with makesession() as s:
@@ -87,14 +92,23 @@ def show_dashboard():
     # --- 4. TUILES GRAPHIQUES ---
     col_chart1, col_chart2 = st.columns(2)
 
+    # Projection des soldes à partir d'aujourd'hui (provisions ouvertes et flux récurrents)
+    df_line = df_reset.assign(Série='Réalisé')
+    if projection_months:
+        with makesession() as s:
+            df_projection = project_balances(s, selected_type, projection_months).reset_index()
+        df_projection['Date'] = df_projection['Date'].dt.date
+        df_line = pd.concat([df_line, df_projection.assign(Série='Projection')], ignore_index=True)
+
     with col_chart1:
         st.subheader("Évolution Temporelle")
         # TUILE : Linechart interactif
         fig_line = px.line(
-            df_reset,
+            df_line,
             x="Date",
             y="Solde",
             color="Compte",
+            line_dash="Série",
             title="Solde cumulé par compte",
             render_mode="svg"  # Meilleur rendu pour le surlignage
         )
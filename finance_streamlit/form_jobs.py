@@ -4,6 +4,7 @@ import altair as alt
 from datetime import datetime, date, timedelta
 from sqlalchemy import select, func
 from engines import makesession  # Repris de tes imports précédents
+import ledger
 from datamodel import Job, Mouvement  # Adapte le nom du module si nécessaire
 
 
@@ -15,9 +16,14 @@ def rollback_job(job_id: int):
             job = session.scalar(select(Job).where(Job.job_id == job_id))
 
             if job:
+                # Jours impactés dans le ledger des soldes journaliers
+                touched = ledger.get_mouvement_pairs(session, [m.index for m in job.mouvements])
+
                 # Si ta relation contient cascade="all, delete-orphan",
                 # supprimer le job supprimera automatiquement les mouvements liés en BDD.
                 session.delete(job)
+                session.flush()
+                ledger.refresh_daily_balances(session, touched)
 
                 # S'il ne faut PAS supprimer le job mais juste "désactiver" les mouvements :
                 # (Décommente si tu as un attribut 'actif' ou similaire sur Mouvement)
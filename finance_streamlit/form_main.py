@@ -40,6 +40,18 @@ st_economy_filter = 'main_widget_economy'
 st_deactivated_filter = 'main_widget_deactivated'
 
 
+def cb_reset_page():
+    """ The list of the movements changes : the pagination starts again from the first page"""
+    st.session_state.offset = 0
+    st.session_state.cursor = None
+    st.session_state.cursor_backward = False
+
+
+def cb_set_main_filter(filter_name: str, widget_key: str):
+    cb_set_filter(filter_name, widget_key)
+    cb_reset_page()
+
+
 def color_sur_valeur(val):
     color = 'red' if val < 0 else 'green'
     return f'color: {color}'
@@ -78,9 +90,9 @@ def cb_deactivate_transactions(pks_to_update: list[int]):
     # deactivate the transactions
     with makesession() as s:
         print(f'creating the session')
-        deactivate_transactions(s, pks_to_update)
+        count = deactivate_transactions(s, pks_to_update)
     print('Transactions deactivated')
-    st.success(f"Désactivation de {len(pks_to_update)} transactions")
+    st.success(f"Désactivation de {count} transactions")
 
 
 def cb_mass_update(pks_to_update: list[int]):
@@ -97,9 +109,9 @@ def cb_mass_update(pks_to_update: list[int]):
 
     # mise à jour
     with makesession() as s:
-        apply_mass_update(s, pks_to_update, template)
+        count = apply_mass_update(s, pks_to_update, template)
         s.commit()
-        st.success('Mass update done !')
+        st.success(f'Mass update done : {count} lignes')
         st.session_state.last_event = 'Mass upate done'
 
 
@@ -109,6 +121,11 @@ def show_main_form():
         st.session_state.offset = 0
     if 'offset_size' not in st.session_state:
         st.session_state.offset_size = 20
+    if 'cursor' not in st.session_state:
+        st.session_state.cursor = None
+        st.session_state.cursor_backward = False
+    if 'page_cursors' not in st.session_state:
+        st.session_state.page_cursors = (None, None)
     if 'last_event' not in st.session_state:
         st.session_state.last_event = 'Idle'
     st.session_state[st_label_filter] = st.session_state.global_filters['label_filter']
@@ -142,9 +159,9 @@ def show_main_form():
     st.subheader("Mes transactions financières")
     # --- BARRE DE RECHERCHE
     search_term = st.text_input("🔍", placeholder="Rechercher une transaction...", label_visibility='hidden', key=st_label_filter,
-                                on_change=cb_set_filter, args=('label_filter', st_label_filter))
+                                on_change=cb_set_main_filter, args=('label_filter', st_label_filter))
     empty_cats = st.toggle("Transactions non-catégorisées", value=False, key=st_empty_transactions,
-                           on_change=cb_set_filter, args=('empty_transactions', st_empty_transactions))
+                           on_change=cb_set_main_filter, args=('empty_transactions', st_empty_transactions))
 
     # --- ZONE DE FILTRES ---
     with st.expander("🔍 Autres Filtres et Recherche", expanded=False):
@@ -152,27 +169,27 @@ def show_main_form():
 
         with f_col1:
             cat_filter = st.selectbox("Catégorie", cat_list, index=None, key=st_categorie_filter,
-                                      on_change=cb_set_filter, args=('category', st_categorie_filter))
-            reimb = st.checkbox("Reimbursable Expenses", key=st_reimbursable_filter, on_change=cb_set_filter,
+                                      on_change=cb_set_main_filter, args=('category', st_categorie_filter))
+            reimb = st.checkbox("Reimbursable Expenses", key=st_reimbursable_filter, on_change=cb_set_main_filter,
                                 args=('reimbursable', st_reimbursable_filter))
-            date_from = st.date_input("Date", value=None)
+            date_from = st.date_input("Date", value=None, on_change=cb_reset_page)
 
         with f_col2:
             compte_filter = st.selectbox("Compte", compte_list, index=None, key=st_compte_filter,
-                                         on_change=cb_set_filter, args=('compte', st_compte_filter))
+                                         on_change=cb_set_main_filter, args=('compte', st_compte_filter))
             affect = st.checkbox("Affectable Payments")
 
         with f_col3:
             tag_filter = st.selectbox("Réf.", st.session_state.nos_ref, index=None, key=st_ref_filter,
-                                      on_change=cb_set_filter, args=('reference', st_ref_filter))
+                                      on_change=cb_set_main_filter, args=('reference', st_ref_filter))
             economy = st.toggle("Economy Mode", value=False, key=st_economy_filter,
-                                on_change=cb_set_filter, args=('is_courant', st_economy_filter))
+                                on_change=cb_set_main_filter, args=('is_courant', st_economy_filter))
 
         with f_col4:
             job_filter = st.selectbox("Job", jobmapper.get_job_descriptions(), index=None, key=st_job_filter,
-                                      on_change=cb_set_filter, args=('job', st_job_filter))
+                                      on_change=cb_set_main_filter, args=('job', st_job_filter))
             deactivated = st.toggle("Deactivated Transactions", value=False, key=st_deactivated_filter,
-                                    on_change=cb_set_filter, args=('deactivated', st_deactivated_filter))
+                                    on_change=cb_set_main_filter, args=('deactivated', st_deactivated_filter))
 
     # --- ZONE DE BILANS ---
     with st.expander("Soldes", expanded=False):
@@ -213,27 +230,38 @@ def show_main_form():
             if st.button("⬅Précédent", width='stretch'):
                 if st.session_state.offset >= st.session_state.offset_size:
                     st.session_state.offset -= st.session_state.offset_size
+                    st.session_state.cursor = st.session_state.page_cursors[0]
+                    st.session_state.cursor_backward = True
                 else:
                     st.session_state.offset = 0
+                    st.session_state.cursor = None
+                    st.session_state.cursor_backward = False
         with p2:
-            st.session_state.offset_size = st.selectbox(label='Taille', options=[20, 50, 100], index=0)
+            st.session_state.offset_size = st.selectbox(label='Taille', options=[20, 50, 100], index=0,
+                                                         on_change=cb_reset_page)
 
         with p3:
             st.space()
             if st.button("Suivant➡", width='stretch'):
-                st.session_state.offset += st.session_state.offset_size
+                if not st.session_state.page_cursors[1] is None:
+                    st.session_state.offset += st.session_state.offset_size
+                    st.session_state.cursor = st.session_state.page_cursors[1]
+                    st.session_state.cursor_backward = False
 
         # Création du dataframe
         # FILTRES - récupération
         with mouvements_container:
             with makesession() as s:
-                df_data = fetch_mouvements(s, view_columns, st.session_state.offset_size, st.session_state.offset,
+                df_data = fetch_mouvements(s, view_columns, st.session_state.offset_size,
                                            sort_column='index', sort_order='desc',
                                            category_filter='' if empty_cats else cat_filter,
                                            compte_filter=compte_filter, tag_filter=tag_filter,
                                            search_filter=search_term, reimbursable=reimb,
                                            affectable=affect, economy_mode=economy,
-                                           job_id=jobmapper.get_job_id(job_filter), specific_date=date_from)
+                                           job_id=jobmapper.get_job_id(job_filter), specific_date=date_from,
+                                           cursor=st.session_state.cursor,
+                                           backward=st.session_state.cursor_backward)
+            st.session_state.page_cursors = (df_data.attrs['previous_cursor'], df_data.attrs['next_cursor'])
 
             # Couleur
             mvt_table = st.dataframe(
@@ -4,6 +4,7 @@ from sqlalchemy import select
 from datamodel import MapCategorie
 from functions import find_active_maps, fetch_mouvements, get_categories
 from common import DatabaseOperation
+from registry import keyword_registry
 from datetime import datetime
 
 
@@ -176,6 +177,7 @@ def manage_maps(session):
 
             if not st.session_state.test_mode:
                 session.commit()
+                keyword_registry.invalidate()
             st.rerun()
 
         except Exception as e:
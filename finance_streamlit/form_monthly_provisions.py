@@ -6,6 +6,7 @@ from finance_gui.__main__ import categorize_provisions
 from functions import get_provisions_for_month, makesession, get_categorized_provisions, \
     fetch_mouvements, get_groups, close_provision, get_categories, calculate_over_under
 from datamodel import Classifier
+from registry import keyword_registry
 from common import PAGE_MAIN, custom_label_red_or_green, custom_label_month
 from datetime import date
 
@@ -46,6 +47,7 @@ def cb_save_group():
         s.add(cl)
         if not st.session_state.test_mode:
             s.commit()
+            keyword_registry.invalidate()
         st.toast(f'New classifier {cl} saved !')
 
 
@@ -1,11 +1,15 @@
 import streamlit as st
-from datetime import date
+import pandas as pd
+from datetime import date, datetime
 from engines import makesession
 import finance_streamlit.common as c
+from finance_streamlit.common import log_operation, DatabaseOperation
 from functions import get_yearly_bilan
+from recurring import find_recurrences, propose_provisions, insert_provisions, remove_existing_provisions
 
 # CLES DES WIDGETS HERITANT DE FILTRES UTILISATEURS COMMUNS A TOUTES LES PAGES
 st_is_courant = 'yp_widget_courant'
+st_recurring_provisions = 'yp_recurring_provisions'
 
 # INTERACTIVITE : FONCTIONS CHANGEANT LE COMPORTEMENT DE LA PAGE
 def cb_new_provision_depense():
@@ -22,6 +26,41 @@ def cb_new_provision_recette():
     st.session_state.previous_page = c.PAGE_YEARLY_PROVISIONS
     st.session_state.page = c.PAGE_NEW_PROVISION
 
+def cb_detect_recurring_provisions(year: int):
+    """ Proposes the provisions of the year from the recurring transactions """
+    with makesession() as session:
+        proposal = propose_provisions(find_recurrences(session), year)
+        rows = remove_existing_provisions(session, proposal)
+    st.session_state[st_recurring_provisions] = (year, rows, len(proposal) - len(rows))
+
+
+def cb_save_recurring_provisions():
+    """ Saves the proposed provisions """
+    year, rows, _ = st.session_state[st_recurring_provisions]
+    with makesession() as session:
+        insert_provisions(session, rows)
+        if not st.session_state.test_mode:
+            session.commit()
+    log_operation(DatabaseOperation(datetime.now(), f"Insertion of {len(rows)} recurring provisions for {year}", True))
+    st.session_state[st_recurring_provisions] = None
+
+
+def show_recurring_provisions(selected_year: int):
+    """ Proposes provisions from the recurring transactions (subscriptions, insurance, rent...) """
+    with st.expander("🔁 Provisions issues des transactions récurrentes"):
+        st.button("Détecter les récurrences", on_click=cb_detect_recurring_provisions, args=(selected_year,))
+        proposal = st.session_state.get(st_recurring_provisions)
+        if proposal is not None and proposal[0] == selected_year:
+            if proposal[2]:
+                st.warning(f"{proposal[2]} provisions écartées : leurs catégories sont déjà provisionnées en "
+                           f"{selected_year}.")
+            df = pd.DataFrame(proposal[1], columns=['description', 'categorie', 'mois', 'provision_payer',
+                                                    'provision_recuperer'])
+            st.dataframe(df, use_container_width=True, hide_index=True)
+            st.button(f"✅ Enregistrer {len(df)} provisions", on_click=cb_save_recurring_provisions,
+                      disabled=len(df) == 0)
+
+
 # CONSTRUCTION DE L'IHM
 def show_yearly_provisions():
     # INITIALISATION DE L'ETAT
@@ -58,6 +97,8 @@ def show_yearly_provisions():
         # On appelle ta fonction get_yearly_bilan (renommée ou adaptée selon ton besoin)
         df_bilan = get_yearly_bilan(session=session, annee=selected_year, is_courant=not mode_display)
 
+    show_recurring_provisions(selected_year)
+
     if df_bilan.empty:
         st.warning(f"⚠️ Aucune donnée disponible pour l'année {selected_year} en mode {mode_display}.")
         return
@@ -1,19 +1,32 @@
 import datetime
 import datetime as dt
 from datetime import date, datetime, timedelta
+from pathlib import Path
 from typing import Iterable
 
 import numpy as np
 import pandas as pd
 import sqlalchemy
-from sqlalchemy import Engine, select, and_, or_, not_, MetaData, Table, Column, String, func, Date, Numeric
+from sqlalchemy import Engine, select, insert, update, and_, or_, not_, MetaData, Table, Column, String, func, Date, Numeric
 from sqlalchemy.orm import Session
 
 import engines
-from datamodel import Compte, Mouvement, Job, Categorie, MapCategorie, LabelPrettifier, MapSalaire, ViewBilansAgregation
+import ledger
+import search
+import snapshot
+from datamodel import Compte, Mouvement, Job, Categorie, MapCategorie, LabelPrettifier, MapSalaire, ViewBilansAgregation, \
+    mouvement_no_sequence
 from dateutil import relativedelta
+from matching import KeywordAutomaton
+from registry import keyword_registry
+from querycache import query_cache
+from cube import aggregate_cube, MEASURES
 
+# Maximum number of indexes in a single UPDATE ... WHERE index IN (...) statement
+UPDATE_CHUNK_SIZE = 1000
 
+
+@query_cache.cached()
 def get_comptes(s: Session):
     """ Returns a list of accounts (class Compte)
 
@@ -23,12 +36,14 @@ def get_comptes(s: Session):
     return result
 
 
+@query_cache.cached()
 def get_type_comptes(s: Session) -> []:
     """ returns the various compte types"""
     result = s.scalars(select(Compte.compte_type.distinct())).all()
     return result
 
 
+@query_cache.cached()
 def fetch_mouvements(s: Session, view: Iterable, offset_size, offset=0, search_filter="", sort_column=None,
                      sort_order: str = 'asc',
                      category_filter: str = None,
@@ -38,20 +53,32 @@ def fetch_mouvements(s: Session, view: Iterable, offset_size, offset=0, search_f
                      economy_mode: bool = False,
                      job_id: int = 0,
                      tag_filter: str = None, faits_marquants: bool = False, skip_columns=None,
-                     specific_date: date = None) -> pd.DataFrame:
-    """ Utilisation de l'ORM """
+                     specific_date: date = None, cursor: tuple = None, backward: bool = False) -> pd.DataFrame:
+    """ Utilisation de l'ORM
+
+    Two pagination modes are available :
+    - offset : the page starts at row number `offset` (LIMIT / OFFSET)
+    - keyset : when a `cursor` is given, the page starts right after the cursor row (right before if `backward`),
+      so that page N costs the same as page 1. `offset` is then ignored.
+
+    Whatever the mode, the cursors of the returned page are stored in `df.attrs['previous_cursor']` and
+    `df.attrs['next_cursor']`, and can be passed back to get the previous or next page."""
     if skip_columns is None:
         skip_columns = []
-    stmt = select(Mouvement.index, Mouvement.description, Mouvement.label_utilisateur, Mouvement.categorie,
-                  Mouvement.compte,
-                  Mouvement.date, Mouvement.mois, Mouvement.depense, Mouvement.recette, Mouvement.provision_payer,
-                  Mouvement.provision_recuperer, Mouvement.no_de_reference, Mouvement.fait_marquant,
-                  Mouvement.taux_remboursement).where(
+    sort_column = sort_column or 'index'
+    sort_key = Mouvement.__table__.c[sort_column]
+    columns = [Mouvement.index, Mouvement.description, Mouvement.label_utilisateur, Mouvement.categorie,
+               Mouvement.compte,
+               Mouvement.date, Mouvement.mois, Mouvement.depense, Mouvement.recette, Mouvement.provision_payer,
+               Mouvement.provision_recuperer, Mouvement.no_de_reference, Mouvement.fait_marquant,
+               Mouvement.taux_remboursement]
+    if not sort_column in [c.name for c in columns]:
+        columns.append(sort_key)
+    stmt = select(*columns).where(
         Mouvement.date_out_of_bound == False)
 
     if search_filter:
-        stmt = stmt.where(or_(Mouvement.description.ilike(f"%%{search_filter}%%"),
-                              Mouvement.label_utilisateur.ilike(f"%%{search_filter}%%")))
+        stmt = stmt.where(search.search_condition(s, search_filter))
     if not category_filter is None:
         stmt = stmt.where(Mouvement.categorie == category_filter)
     if not compte_filter is None:
@@ -79,15 +106,39 @@ def fetch_mouvements(s: Session, view: Iterable, offset_size, offset=0, search_f
         stmt = stmt.where(Mouvement.fait_marquant != None)
     if specific_date:
         stmt = stmt.where(Mouvement.date == specific_date)
-    if sort_column:
-        stmt = stmt.order_by(Mouvement.__table__.c[sort_column].desc())
 
-    # Limiting and offsetting
-    stmt = stmt.limit(offset_size).offset(offset)
+    # A cursor built on another sort column cannot be used : we go back to the first page
+    if not cursor is None and cursor[0] != sort_column:
+        cursor = None
+        backward = False
+
+    # Sorting, the index being the tie-breaker
+    if backward and not cursor is None:
+        stmt = stmt.order_by(sort_key.asc().nulls_first(), Mouvement.index.asc())
+    else:
+        stmt = stmt.order_by(sort_key.desc().nulls_last(), Mouvement.index.desc())
+
+    # Limiting and offsetting (or seeking)
+    if cursor is None:
+        stmt = stmt.limit(offset_size).offset(offset)
+    else:
+        stmt = stmt.where(seek_condition(sort_key, cursor, backward)).limit(offset_size)
 
     # returing the result
     df = pd.read_sql(stmt, s.connection())
 
+    if not cursor is None and backward:
+        if len(df) < offset_size:
+            # we reached the beginning : we serve a full first page instead
+            return fetch_mouvements(s, view, offset_size, 0, search_filter, sort_column, sort_order, category_filter,
+                                    compte_filter, month_filter, reimbursable, affectable, provisions, transactions,
+                                    economy_mode, job_id, tag_filter, faits_marquants, skip_columns, specific_date)
+        df = df.iloc[::-1].reset_index(drop=True)
+
+    # Cursors of the page, read before the massaging of the NULL values
+    previous_cursor = build_page_cursor(df.iloc[0], sort_column) if len(df) > 0 else None
+    next_cursor = build_page_cursor(df.iloc[-1], sort_column) if len(df) > 0 else None
+
     # Massaging the result
     df.fillna(
         value={'Recette': 0, 'Dépense': 0, 'Taux remboursement': 0, 'Provision à payer': 0, 'Provision à récupérer': 0},
@@ -97,20 +148,48 @@ def fetch_mouvements(s: Session, view: Iterable, offset_size, offset=0, search_f
     if not view is None:
         df = df[view]
 
+    df.attrs['previous_cursor'] = previous_cursor
+    df.attrs['next_cursor'] = next_cursor
+
     return df
 
 
+def build_page_cursor(row: pd.Series, sort_column: str) -> tuple:
+    """ Builds a pagination cursor from a row of fetch_mouvements
+
+    :returns: a tuple (sort column, sort value, index)"""
+    value = row[sort_column]
+    if pd.isna(value):
+        value = None
+    elif isinstance(value, pd.Timestamp):
+        value = value.to_pydatetime()
+    elif hasattr(value, 'item'):
+        value = value.item()
+    return sort_column, value, int(row['index'])
+
+
+def seek_condition(sort_key: Column, cursor: tuple, backward: bool):
+    """ The keyset condition selecting the rows after the cursor, in the order (sort key desc nulls last, index desc)
+
+    If backward is set, selects the rows before the cursor."""
+    _, value, index = cursor
+    if value is None:
+        if backward:
+            return or_(sort_key != None, and_(sort_key == None, Mouvement.index > index))
+        return and_(sort_key == None, Mouvement.index < index)
+    if backward:
+        return or_(sort_key > value, and_(sort_key == value, Mouvement.index > index))
+    return or_(sort_key < value, and_(sort_key == value, Mouvement.index < index), sort_key == None)
+
+
 def get_groups(s: Session) -> pd.DataFrame:
     """ Returns a dataframe with two columns : patterns, and classes"""
-    # Selection of the patterns
-    metadata_obj = MetaData()
-    classes = Table('classifiers', metadata_obj,
-                    Column('patterns', String),
-                    Column('classes', String),
-                    schema='public')
-    stmt = select(classes).order_by(classes.c['classes'])
-    df_classes = pd.read_sql(stmt, s.connection())
-    return df_classes
+    return keyword_registry.get_groups(s)
+
+
+def get_group_classifier(s: Session) -> KeywordAutomaton:
+    """ Returns the classification automaton built from the classifiers, classifying into 'Common' by default"""
+    return keyword_registry.get_group_classifier(s)
 
 
 def get_categorized_provisions(s: Session, category_filter: str, month: date, number_months: int,
@@ -136,13 +215,18 @@ def get_categorized_provisions(s: Session, category_filter: str, month: date, nu
                                                                        Mouvement.mois < end_month,
                                                                        Mouvement.economie == str_economy)
 
-    df_classes = get_groups(s)
+    classifier = get_group_classifier(s)
 
     # reading the dataframe
     df = pd.read_sql(stmt, s.connection(), parse_dates='Mois')
 
+    return summarize_provisions(df, classifier)
+
+
+def summarize_provisions(df: pd.DataFrame, classifier: KeywordAutomaton) -> pd.DataFrame:
+    """ Classifies and sums the movements read by get_categorized_provisions"""
     # Classifying
-    df['Group'] = df['Description'].apply(classify, classification_matrix=df_classes.values)
+    df['Group'] = classifier.classify_series(df['Description'])
 
     # Grouping
     df = df.drop(['Description', 'Mois'], axis=1).groupby(['Group', df['Mois'].dt.month], as_index=False).sum()
@@ -159,19 +243,18 @@ def get_categorized_provisions(s: Session, category_filter: str, month: date, nu
 def import_transaction(session: Session, mvt: Mouvement):
     """ Generates a transaction"""
     print(f'Importing transaction {mvt}')
-    # retrieve the last valid number
-    max_number = get_max_number(session)
     # create a job
     job = Job(job_key=Job.type_import, job_timestamp=datetime.now())
     # assign the movement
     mvt.job = job
     # add the metadata
-    mvt.no = max_number
+    mvt.no = allocate_number(session)
     mvt.date_insertion = date.today()
     session.add(mvt)
     print(f'Transaction generated')
 
 
+@query_cache.cached()
 def get_categories(s: Session):
     """ Returns a list of categories (class Catégorie)
 
@@ -199,6 +282,12 @@ def get_transaction(session: Session, index: int) -> Mouvement:
 def get_yearly_realise(session: Session, is_provision: bool, is_depense: bool, is_economie: bool, category: str,
                        annee: int,
                        group: str = None) -> pd.DataFrame:
+    if group is None:
+        # sommes mensuelles de la catégorie, lues dans le cube
+        measure = ('Dépense Provisionnée' if is_depense else 'Recette Provisionnée') if is_provision else (
+            'Dépense' if is_depense else 'Recette')
+        return aggregate_cube.get_monthly(session, category, annee, MEASURES.index(measure), is_economie)
+
     # récupérer les mouvements
     stmt = select(Mouvement.mois, Mouvement.description, Mouvement.depense, Mouvement.recette,
                   Mouvement.provision_payer.label('Dépense Provisionnée'),
@@ -210,10 +299,16 @@ def get_yearly_realise(session: Session, is_provision: bool, is_depense: bool, i
 
     df = pd.read_sql(stmt, session.connection())
     # récupérer les classes
-    classes = get_groups(session)
+    classifier = get_group_classifier(session)
+
+    return aggregate_realise(df, classifier, is_provision, is_depense, group)
+
 
+def aggregate_realise(df: pd.DataFrame, classifier: KeywordAutomaton, is_provision: bool, is_depense: bool,
+                      group: str = None) -> pd.DataFrame:
+    """ Classifies and sums per month the movements read by get_yearly_realise"""
     # classifier
-    df['Classe'] = df['Description'].apply(classify, classification_matrix=classes.values)
+    df['Classe'] = classifier.classify_series(df['Description'])
 
     # If a group is specified, filter
     if not group is None:
@@ -237,10 +332,10 @@ def get_groups_of_category(session: Session, category: str, annee: int,
         Mouvement.mois.between(date(annee, 1, 1), date(annee, 12, 1)))
     df = pd.read_sql(stmt, session.connection())
     # récupérer les classes
-    classes = get_groups(session)
+    classifier = get_group_classifier(session)
 
     # classifier
-    df['Classe'] = df['Description'].apply(classify, classification_matrix=classes.values)
+    df['Classe'] = classifier.classify_series(df['Description'])
 
     df = df[['Classe']].drop_duplicates()
 
@@ -248,19 +343,12 @@ def get_groups_of_category(session: Session, category: str, annee: int,
 
 
 def get_solde(s: Session, compte: str, period_begin: date, period_end: date) -> pd.DataFrame:
-    """ calculates the running saldo"""
-    stmt = select(Mouvement.date, Mouvement.depense, Mouvement.recette).where(Mouvement.compte == compte).where(
-        Mouvement.date_out_of_bound == False)
-    df = pd.read_sql(stmt, s.connection(), coerce_float=True, parse_dates='Date')
+    """ calculates the running saldo, read from the daily balance ledger"""
+    ledger.sync_daily_balances(s)
+    df = ledger.read_daily_balances(s, [compte], period_begin, period_end)
 
     # Transformation
-    df = df.fillna(0)
-    df['Solde'] = df['Recette'] - df['Dépense']
-    df = df.groupby('Date')[['Solde']].sum()
-    df = df.loc[df.index.date <= period_end]
-    df = df.sort_index()
-    df['Cumul'] = df['Solde'].cumsum()
-    df = df.loc[df.index.date >= period_begin]
+    df = df.set_index('Date')[['Mouvement', 'Solde']].rename(columns={'Solde': 'Cumul', 'Mouvement': 'Solde'})
     # rounding
     df = df.round(2)
 
@@ -272,66 +360,30 @@ def get_solde(s: Session, compte: str, period_begin: date, period_end: date) ->
 
 
 def get_grouped_transactions(s: Session, compte_type: str, period_begin: date, period_end: date) -> pd.DataFrame:
-    """ calculates the running saldo for all accounts"""
-    # --- STEP 1 : calculates the starting saldos
-    stmt = select(Mouvement.compte, Mouvement.depense, Mouvement.recette).join(
-        Compte).where(
-        Mouvement.date_out_of_bound == False).where(Mouvement.date < period_begin).where(
-        Compte.compte_type == compte_type).where(Compte.compte_actif == True)
-    df = pd.read_sql(stmt, s.connection(), coerce_float=True, parse_dates='Date')
-
-    # aggregate
-    df = df.groupby(['Compte'])[['Dépense', 'Recette']].sum().fillna(0).round(2)
-    df['Solde'] = df['Recette'] - df['Dépense']
-    df = df.drop(columns=['Dépense', 'Recette'])
-    df = df.reset_index()
-    df['Date'] = period_begin
+    """ calculates the running saldo for all accounts, read from the daily balance ledger"""
+    ledger.sync_daily_balances(s)
+    comptes = s.scalars(select(Compte.compte).where(Compte.compte_type == compte_type).where(
+        Compte.compte_actif == True).order_by(Compte.compte)).all()
 
-    # 2. Création de la plage de dates complète
-    all_dates = pd.date_range(start=period_begin, end=period_end, freq='D')
-
-    # Création d'un MultiIndex complet
-    full_index = pd.MultiIndex.from_product(
-        [df['Compte'].unique(), all_dates],
-        names=['Compte', 'Date']
-    )
-
-    # 4. On réindexe le dataframe
-    # On met d'abord l'index sur Compte et Date, puis on réindexe avec le complet
-    df_exploded = (
-        df.set_index(['Compte', 'Date'])
-        .reindex(full_index)
-        .sort_index()
-    )
-
-    # 5. REMPLISSAGE (La partie magique)
-    # On groupe par compte pour ne pas mélanger les soldes, et on remplit vers le bas
-    df_exploded['Solde'] = df_exploded.groupby(level='Compte')['Solde'].ffill().fillna(0)
-
-    #  --- STEP 2 : calculates the variations in the period ---
-    stmt = select(Mouvement.compte, Mouvement.date, Mouvement.depense, Mouvement.recette).join(
-        Compte).where(
-        Mouvement.date_out_of_bound == False).where(Mouvement.date >= period_begin).where(
-        Mouvement.date <= period_end).where(
-        Compte.compte_type == compte_type)
-    df = pd.read_sql(stmt, s.connection(), coerce_float=True, parse_dates='Date')
+    # --- STEP 1 : the starting saldos and the balances in the period
+    opening = ledger.read_opening_balances(s, comptes, period_begin)
+    df = ledger.read_daily_balances(s, comptes, period_begin, period_end)
 
-    # aggregate
-    df = df.groupby(['Compte', 'Date'])[['Dépense', 'Recette']].sum().fillna(0).round(2).sort_index()
-    df['Delta'] = pd.to_numeric(df['Recette'] - df['Dépense'])
-    df['Cumul'] = df.groupby(level='Compte')['Delta'].cumsum()
-    df = df.drop(columns=['Dépense', 'Recette', 'Delta'])
-
-    # --- STEP 3 : join the saldos and the variations ---
-    df_all = df_exploded.join(df)
-    df_all['Cumul'] = df_all.groupby(level='Compte')['Cumul'].ffill().fillna(0)
+    # --- STEP 2 : one row per account and per day, filled with the last known balance
+    all_dates = pd.date_range(start=period_begin, end=period_end, freq='D')
+    full_index = pd.MultiIndex.from_product([comptes, all_dates], names=['Compte', 'Date'])
+    df_all = df.set_index(['Compte', 'Date'])[['Solde']].reindex(full_index).sort_index()
+    df_all['Solde'] = df_all.groupby(level='Compte')['Solde'].ffill()
+    starting = opening.reindex(df_all.index.get_level_values('Compte')).values
+    df_all['Solde'] = df_all['Solde'].fillna(pd.Series(starting, index=df_all.index)).round(2)
 
-    # --- END : calculation
-    df_all['Solde'] = df_all['Solde'] + df_all['Cumul']
+    # --- END : the variation since the beginning of the period
+    df_all['Cumul'] = (df_all['Solde'] - starting).round(2)
 
     return df_all
 
 
+@query_cache.cached()
 def fetch_soldes(s: Session, compte_type: str) -> pd.DataFrame:
     """ Récupère les soldes des comptes courants"""
     """ Returns the current accounts"""
@@ -373,10 +425,51 @@ def get_salaries(s: Session, mois: date = None) -> list:
 
 
 def get_max_number(s: Session) -> int:
-    result = s.scalar(select(Mouvement.no).order_by(Mouvement.no.desc()))
+    result = s.scalar(select(func.max(Mouvement.no)))
     return int(result)
 
 
+# The databases whose number sequence is known to exist
+sequenced_databases = set()
+
+
+def create_number_sequence(bind):
+    """ Creates the sequence of the transaction numbers, starting after the current maximum.
+
+    Nothing is done on databases without sequences (SQLite backups)"""
+    if not bind.engine.dialect.supports_sequences:
+        return
+    with bind.engine.begin() as connection:
+        if not sqlalchemy.inspect(connection).has_sequence(mouvement_no_sequence.name):
+            mouvement_no_sequence.create(connection)
+            max_number = connection.scalar(select(func.max(Mouvement.no)))
+            connection.execute(select(func.setval(mouvement_no_sequence.name, max(max_number or 0, 1),
+                                                  max_number is not None)))
+    sequenced_databases.add(str(bind.engine.url))
+
+
+def allocate_numbers(s: Session, count: int) -> list[int]:
+    """ Reserves a block of transaction numbers in one query.
+
+    The numbers come from the database sequence, so concurrent sessions never get the same ones. Without
+    sequences (SQLite), they follow the current maximum."""
+    if count <= 0:
+        return []
+    bind = s.get_bind()
+    if not bind.engine.dialect.supports_sequences:
+        first = (s.scalar(select(func.max(Mouvement.no))) or 0) + 1
+        return list(range(first, first + count))
+    if not str(bind.engine.url) in sequenced_databases:
+        create_number_sequence(bind)
+    block = select(mouvement_no_sequence.next_value()).select_from(func.generate_series(1, count))
+    return sorted(s.scalars(block).all())
+
+
+def allocate_number(s: Session) -> int:
+    """ Reserves a single transaction number"""
+    return allocate_numbers(s, 1)[0]
+
+
 def get_remaining_provisioned_expenses(s: Session):
     """ function to get an ordered list of remaining provisioned expenses
     :returns: set of tuples (Mois, Catégorie, Dépenses Courante Provisionnée Non Epuisée)"""
@@ -431,8 +524,8 @@ def create_salaries(s: Session, parent_id: int, mois: dt.date, simulate: bool):
     date_insertion = dt.date.today()
 
     # Création du numéro de transaction
-    maxnumber = get_max_number(s) + 1
-    print(f'max number retrieved : {maxnumber}')
+    maxnumber = allocate_number(s)
+    print(f'number allocated : {maxnumber}')
     # retrieve salarial data
     salaire_dataframe = get_salaries(s, mois)
     print(f'infos salaires retrieved : {salaire_dataframe}')
@@ -535,58 +628,60 @@ def save_capital_reimbursements(e: Engine, reimbursement_scheme: pd.Series, targ
     # create the session
     with Session(e) as session:
         # deactivate the previous ones
-        previous_payments = session.scalars(select(Mouvement).where(Mouvement.compte == target_account))
-        for p in previous_payments:
-            p.date_out_of_bound = True
+        touched = set(session.execute(select(Mouvement.compte, Mouvement.date).where(
+            Mouvement.compte == target_account)).tuples())
+        session.execute(update(Mouvement).where(Mouvement.compte == target_account).values(date_out_of_bound=True))
         # Create the new ones
-        # retrieve the last valid number
-        max_number = get_max_number(session)
+        # reserve the numbers of the schedule and of its initialisation
+        numbers = allocate_numbers(session, len(reimbursement_scheme) + 1)
         # create a job
         job = Job(job_key=Job.type_import, job_timestamp=datetime.now())
         # Generate the initial reimbursement
-        max_number += 1
         initial_date = reimbursement_scheme.index[0]
-        mvt = Mouvement(date=initial_date - timedelta(days=1),
-                        description=f"initialisation du remboursement",
-                        compte=target_account,
-                        categorie=target_category,
-                        mois=initial_date,
-                        date_insertion=date.today(),
-                        depense=float(reimbursement_scheme.sum()),
-                        no=max_number,
-                        economie='true',
-                        job=job
-                        )
-        session.add(mvt)
+        rows = [dict(date=initial_date - timedelta(days=1),
+                     description=f"initialisation du remboursement",
+                     compte=target_account,
+                     categorie=target_category,
+                     mois=initial_date,
+                     date_insertion=date.today(),
+                     depense=float(reimbursement_scheme.sum()),
+                     recette=None,
+                     no=numbers[0],
+                     economie='true')]
 
         # generate a set of provisions
-
-        for d in reimbursement_scheme.index:
-            max_number += 1
-            mvt = Mouvement(date=d,
-                            description=f"Remboursement du capital restant dû",
-                            compte=target_account,
-                            categorie=target_category,
-                            mois=d,
-                            date_insertion=date.today(),
-                            recette=float(reimbursement_scheme[d]),
-                            no=max_number,
-                            job=job
-                            )
-            session.add(mvt)
+        rows += [dict(date=d,
+                      description=f"Remboursement du capital restant dû",
+                      compte=target_account,
+                      categorie=target_category,
+                      mois=d,
+                      date_insertion=date.today(),
+                      depense=None,
+                      recette=float(amount),
+                      no=numbers[i + 1],
+                      economie='false') for i, (d, amount) in enumerate(reimbursement_scheme.items())]
+        insert_mouvements(session, job, rows)
 
         # save
         session.flush()
+        ledger.refresh_daily_balances(session, touched)
         session.commit()
 
 
+def get_bilan_labels(annee: int, is_courant: bool) -> tuple:
+    """ Returns the labels of the columns of the yearly bilan : Dépense A-1, Recette A-1, Dépense A, Recette A"""
+    mode_label = "Courante" if is_courant else "Économisée"
+    return (f"Dépense {mode_label} {annee - 1}", f"Recette {mode_label} {annee - 1}", f"Dépense {mode_label} {annee}",
+            f"Recette {mode_label} {annee}")
+
+
 def get_yearly_bilan(session: Session, annee: int, is_courant: bool) -> pd.DataFrame:
     """
         Génère un bilan financier annuel comparatif (A vs A-1) par catégorie.
 
         Cette fonction extrait et fusionne les données de la table `Categorie` et de la
-        vue d'agrégation `view_bilans_agregation`. Elle calcule les enveloppes réelles globales
-        (flux + restants provisionnés) pour l'année précédente (A-1) et extrait les cibles
+        vue d'agrégation `view_bilans_agregation`, servies par le cube en mémoire (voir cube). Elle calcule
+        les enveloppes réelles globales (flux + restants provisionnés) pour l'année précédente (A-1) et extrait les cibles
         provisionnées globales de l'année en cours (A), selon le mode choisi (Courant ou Économisé).
 
         Parameters
@@ -633,53 +728,33 @@ def get_yearly_bilan(session: Session, annee: int, is_courant: bool) -> pd.DataF
         """
 
     # --- Code de la fonction ---
-    mode_label = "Courante" if is_courant else "Économisée"
-
     col_cat = Categorie.categorie.name
-    col_dep_a_1 = f"Dépense {mode_label} {annee - 1}"
-    col_rec_a_1 = f"Recette {mode_label} {annee - 1}"
-    col_dep_a = f"Dépense {mode_label} {annee}"
-    col_rec_a = f"Recette {mode_label} {annee}"
-
-    # --- Récupérer les catégories
-    cat_stmt = (
-        select(
-            Categorie.categorie_groupe,
-            Categorie.categorie_order,
-            Categorie.categorie
-        )
-    )
-    df_categories = pd.read_sql_query(cat_stmt, session.bind)
-
-    # Enveloppes de recettes et dépenses réelles (A-1)
-    prop_recette = ViewBilansAgregation.Recette_Courante if is_courant else ViewBilansAgregation.Recette_Economisee
-    prop_depense = ViewBilansAgregation.Dépense_Courante if is_courant else ViewBilansAgregation.Dépense_Economisee
-
-    # Enveloppes restantes (A-1 ou A selon la colonne)
-    prop_recette_restante = ViewBilansAgregation.Recette_Courante_Provisionnée_restante if is_courant else ViewBilansAgregation.Recette_Economisée_Provisionnée_restante
-    prop_depense_non_epui = ViewBilansAgregation.Dépense_Courante_Provisionnée_non_épuisée if is_courant else ViewBilansAgregation.Dépense_Economisée_Provisionnée_restante
-
-    # Enveloppes globales de provisions (Année A)
-    prop_prov_depense_a = ViewBilansAgregation.Dépense_Courante_Provisionnée if is_courant else ViewBilansAgregation.Dépense_Economisée_Provisionnée
-    prop_prov_recette_a = ViewBilansAgregation.Recette_Courante_Provisionnée if is_courant else ViewBilansAgregation.Recette_Economisée_Provisionnée
-
-    data_stmt = (
-        select(
-            ViewBilansAgregation.Catégorie.label(col_cat),
-            ViewBilansAgregation.Mois_Year.label("Annee"),
-            (prop_recette + prop_recette_restante).label(col_rec_a_1),
-            (prop_depense + prop_depense_non_epui).label(col_dep_a_1),
-            prop_prov_depense_a.label(col_dep_a),
-            prop_prov_recette_a.label(col_rec_a)
-        )
-        .where(
-            or_(
-                ViewBilansAgregation.Mois_Year == float(annee),
-                ViewBilansAgregation.Mois_Year == float(annee - 1)
-            )
-        )
-    )
-    df_data = pd.read_sql_query(data_stmt, session.bind)
+    col_dep_a_1, col_rec_a_1, col_dep_a, col_rec_a = get_bilan_labels(annee, is_courant)
+
+    # --- Récupérer les catégories et les agrégats de A-1 et A depuis le cube
+    year_before = aggregate_cube.get_year(session, annee - 1, is_courant)
+    year = aggregate_cube.get_year(session, annee, is_courant)
+    df_categories = aggregate_cube.get_groups()[[Categorie.categorie_groupe.name, Categorie.categorie_order.name,
+                                                 col_cat]]
+
+    # Enveloppes réelles (flux + restants provisionnés) de A-1, enveloppes globales de provisions de A
+    df_data = pd.concat([
+        pd.DataFrame({col_cat: year_before['Catégorie'], "Annee": float(annee - 1),
+                      col_rec_a_1: year_before['Recette'], col_dep_a_1: year_before['Dépense'],
+                      col_dep_a: year_before['Dépense Provisionnée'], col_rec_a: year_before['Recette Provisionnée']}),
+        pd.DataFrame({col_cat: year['Catégorie'], "Annee": float(annee),
+                      col_rec_a_1: year['Recette'], col_dep_a_1: year['Dépense'],
+                      col_dep_a: year['Dépense Provisionnée'], col_rec_a: year['Recette Provisionnée']})],
+        ignore_index=True)
+
+    return compose_yearly_bilan(df_categories, df_data, annee, is_courant)
+
+
+def compose_yearly_bilan(df_categories: pd.DataFrame, df_data: pd.DataFrame, annee: int,
+                         is_courant: bool) -> pd.DataFrame:
+    """ Builds the result of get_yearly_bilan from the categories and the aggregated view data"""
+    col_cat = Categorie.categorie.name
+    col_dep_a_1, col_rec_a_1, col_dep_a, col_rec_a = get_bilan_labels(annee, is_courant)
 
     cols_finales = list(df_categories.columns) + [col_dep_a_1, col_dep_a, col_rec_a_1, col_rec_a]
 
@@ -730,6 +805,67 @@ def get_yearly_bilan(session: Session, annee: int, is_courant: bool) -> pd.DataF
     return result[cols_finales]
 
 
+def get_categorized_provisions_snapshot(category_filter: str, month: date, number_months: int, economy_mode: bool,
+                                        root: Path = snapshot.SNAPSHOT_ROOT) -> pd.DataFrame:
+    """ Same result as get_categorized_provisions, answered from the Parquet snapshot"""
+    end_month = month + relativedelta.relativedelta(months=number_months)
+    df = snapshot.read_mouvements(root, columns=['Description', 'Dépense', 'Provision à payer', 'Recette',
+                                                 'Provision à récupérer', 'Mois'],
+                                  filters=snapshot.period_filters(month, end_month) + [
+                                      ('Date Out of Bound', '==', False), ('Catégorie', '==', category_filter),
+                                      ('Economie', '==', 'true' if economy_mode else 'false')])
+    return summarize_provisions(df, get_snapshot_classifier(root))
+
+
+def get_yearly_realise_snapshot(is_provision: bool, is_depense: bool, is_economie: bool, category: str, annee: int,
+                                group: str = None, root: Path = snapshot.SNAPSHOT_ROOT) -> pd.DataFrame:
+    """ Same result as get_yearly_realise, answered from the Parquet snapshot"""
+    filters = snapshot.period_filters(date(annee, 1, 1), date(annee + 1, 1, 1)) + [
+        ('Date Out of Bound', '==', False), ('Catégorie', '==', category)]
+    if is_economie:
+        filters.append(('Economie', '==', 'true'))
+    df = snapshot.read_mouvements(root, columns=['Mois', 'Description', 'Dépense', 'Recette', 'Provision à payer',
+                                                 'Provision à récupérer'], filters=filters).rename(
+        columns={'Provision à payer': 'Dépense Provisionnée', 'Provision à récupérer': 'Recette Provisionnée'})
+    df['Mois'] = df['Mois'].dt.date
+    return aggregate_realise(df, get_snapshot_classifier(root), is_provision, is_depense, group)
+
+
+def get_yearly_bilan_snapshot(annee: int, is_courant: bool, root: Path = snapshot.SNAPSHOT_ROOT) -> pd.DataFrame:
+    """ Same result as get_yearly_bilan, answered from the Parquet snapshot"""
+    col_cat = Categorie.categorie.name
+    col_dep_a_1, col_rec_a_1, col_dep_a, col_rec_a = get_bilan_labels(annee, is_courant)
+    v = ViewBilansAgregation
+    if is_courant:
+        recette, depense = v.Recette_Courante, v.Dépense_Courante
+        recette_restante, depense_non_epui = v.Recette_Courante_Provisionnée_restante, \
+            v.Dépense_Courante_Provisionnée_non_épuisée
+        prov_depense_a, prov_recette_a = v.Dépense_Courante_Provisionnée, v.Recette_Courante_Provisionnée
+    else:
+        recette, depense = v.Recette_Economisee, v.Dépense_Economisee
+        recette_restante, depense_non_epui = v.Recette_Economisée_Provisionnée_restante, \
+            v.Dépense_Economisée_Provisionnée_restante
+        prov_depense_a, prov_recette_a = v.Dépense_Economisée_Provisionnée, v.Recette_Economisée_Provisionnée
+
+    df_categories = snapshot.read_table(snapshot.CATEGORIES, root)[
+        [Categorie.categorie_groupe.name, Categorie.categorie_order.name, col_cat]]
+    bilans = snapshot.read_bilans(root, filters=[(snapshot.ANNEE, 'in', [annee - 1, annee]),
+                                                 (v.Mois_Year.name, 'in', [float(annee - 1), float(annee)])])
+    df_data = pd.DataFrame({col_cat: bilans[v.Catégorie.name].astype(object),
+                            "Annee": bilans[v.Mois_Year.name],
+                            col_rec_a_1: bilans[recette.name] + bilans[recette_restante.name],
+                            col_dep_a_1: bilans[depense.name] + bilans[depense_non_epui.name],
+                            col_dep_a: bilans[prov_depense_a.name],
+                            col_rec_a: bilans[prov_recette_a.name]})
+    return compose_yearly_bilan(df_categories, df_data, annee, is_courant)
+
+
+def get_snapshot_classifier(root: Path = snapshot.SNAPSHOT_ROOT) -> KeywordAutomaton:
+    """ Returns the classification automaton built from the classifiers of the snapshot"""
+    groups = snapshot.read_table(snapshot.CLASSIFIERS, root).sort_values('classes', kind='stable')
+    return KeywordAutomaton.from_dataframe(groups, 'patterns', 'classes', 'Common')
+
+
 def get_provisions_for_month(s: Session, month: date, is_courant: bool = True) -> pd.DataFrame:
     """ Returns all the aggregated provisions for a specific month.
 
@@ -739,7 +875,7 @@ def get_provisions_for_month(s: Session, month: date, is_courant: bool = True) -
 
     :param s: An active SQLAlchemy Session object used to hook into the database connection.
     :type s: sqlalchemy.orm.Session
-    :param month: The targeted month filtering the view (`view_bilans_agregation`).
+    :param month: The targeted month, sliced from the aggregate cube (see cube).
     :type month: datetime.date
     :param is_courant: If True, queries operational columns. If False, queries savings columns.
     :type is_courant: bool, optional
@@ -757,97 +893,36 @@ def get_provisions_for_month(s: Session, month: date, is_courant: bool = True) -
         **Solde avec provisions** (float) : Forecasted balance integrating provisions.
     :rtype: pandas.DataFrame
     """
-    metadata_obj = MetaData()
-    provisions = Table('view_bilans_agregation',
-                       metadata_obj,
-                       Column('Catégorie Groupe', String),
-                       Column('Catégorie', String),
-                       Column('Mois', Date),
-                       Column('Recette Courante', Numeric),
-                       Column('Recette Courante Provisionnée', Numeric),
-                       Column('Recette Courante Provisionnée restante', Numeric),
-                       Column('Dépense Courante', Numeric),
-                       Column('Dépense Courante Provisionnée', Numeric),
-                       Column('Dépense Courante Provisionnée non épuisée', Numeric),
-                       Column('Recette Economisée', Numeric),
-                       Column('Recette Economisée Provisionnée', Numeric),
-                       Column('Recette Economisée Provisionnée restante', Numeric),
-                       Column('Dépense Economisée', Numeric),
-                       Column('Dépense Economisée Provisionnée', Numeric),
-                       Column('Dépense Economisée Provisionnée restante', Numeric),
-                       Column('Solde Courant + Provision', Numeric),
-                       Column('Solde Courant', Numeric),
-                       Column('Solde Total', Numeric),
-                       Column('Solde Total + Provision', Numeric),
-                       schema='dbview_schema')
-
-    if not is_courant:
-        stmt = select(provisions.c['Catégorie Groupe'], provisions.c['Catégorie'], provisions.c['Recette Economisée'],
-                      provisions.c['Recette Economisée Provisionnée'],
-                      provisions.c['Recette Economisée Provisionnée restante'],
-                      provisions.c['Dépense Economisée'], provisions.c['Dépense Economisée Provisionnée'],
-                      provisions.c['Dépense Economisée Provisionnée restante'],
-                      provisions.c['Solde Total'],
-                      provisions.c['Solde Total + Provision'])
-    else:
-        stmt = select(provisions.c['Catégorie Groupe'], provisions.c['Catégorie'], provisions.c['Recette Courante'],
-                      provisions.c['Recette Courante Provisionnée'],
-                      provisions.c['Recette Courante Provisionnée restante'],
-                      provisions.c['Dépense Courante'], provisions.c['Dépense Courante Provisionnée'],
-                      provisions.c['Dépense Courante Provisionnée non épuisée'],
-                      provisions.c['Solde Courant'],
-                      provisions.c['Solde Courant + Provision'])
-
-    stmt = stmt.where(
-        provisions.c['Mois'] == month).order_by(
-        provisions.c['Catégorie Groupe'], provisions.c['Catégorie'])
-
-    result = pd.read_sql(stmt, s.connection(), coerce_float=True, parse_dates=('Mois'))
-
-    if not is_courant:
-        result.rename(inplace=True, columns={'Recette Economisée': 'Recette',
-                                             'Recette Economisée Provisionnée': 'Recette Provisionnée',
-                                             'Recette Economisée Provisionnée restante': 'Recette Reste',
-                                             'Dépense Economisée': 'Dépense',
-                                             'Dépense Economisée Provisionnée': 'Dépense Provisionnée',
-                                             'Dépense Economisée Provisionnée restante': 'Dépense Reste',
-                                             'Solde Total': 'Solde sans provisions',
-                                             'Solde Total + Provision': 'Solde avec provisions'})
-    else:
-        result.rename(inplace=True, columns={'Recette Courante': 'Recette',
-                                             'Recette Courante Provisionnée': 'Recette Provisionnée',
-                                             'Recette Courante Provisionnée restante': 'Recette Reste',
-                                             'Dépense Courante': 'Dépense',
-                                             'Dépense Courante Provisionnée': 'Dépense Provisionnée',
-                                             'Dépense Courante Provisionnée non épuisée': 'Dépense Reste',
-                                             'Solde Courant': 'Solde sans provisions',
-                                             'Solde Courant + Provision': 'Solde avec provisions'}
-                      )
-
-    return result
+    return aggregate_cube.get_month(s, month, is_courant)
 
 
 def classify(value: str, classification_matrix):
+    """ Linear classification of a single value. For whole columns, use a KeywordAutomaton instead"""
     for pattern, result in classification_matrix:
         if pattern in value:
             return result
     return 'Common'
 
 
-def deactivate_transactions(s: Session, indexes: list[int]):
-    mvts = s.scalars(select(Mouvement).where(Mouvement.index.in_(indexes))).all()
-    for m in mvts:
-        m.date_out_of_bound = True
-        s.add(m)
+def deactivate_transactions(s: Session, indexes: list[int]) -> int:
+    """ Flags the movements as out of bound, with one UPDATE statement per chunk of indexes
+
+    :returns: the number of movements deactivated"""
+    touched = ledger.get_mouvement_pairs(s, indexes)
+    count = 0
+    for i in range(0, len(indexes), UPDATE_CHUNK_SIZE):
+        result = s.execute(update(Mouvement).where(
+            Mouvement.index.in_(indexes[i:i + UPDATE_CHUNK_SIZE]),
+            Mouvement.date_out_of_bound.is_not(True)).values(date_out_of_bound=True))
+        count += result.rowcount
     s.flush()
+    ledger.refresh_daily_balances(s, touched)
     s.commit()
+    return count
 
 
-def deactivate_transaction(s: Session, index: int):
-    mvt = s.scalar(select(Mouvement).where(Mouvement.index == index))
-    if not mvt is None:
-        mvt.date_out_of_bound = True
-        s.commit()
+def deactivate_transaction(s: Session, index: int) -> int:
+    return deactivate_transactions(s, [index])
 
 
 def update_transaction_category(e: Engine, index: int, cat: str, lab: str, mois: date):
@@ -860,41 +935,54 @@ def update_transaction_category(e: Engine, index: int, cat: str, lab: str, mois:
             session.commit()
 
 
-def apply_mass_update(session: Session, indexes: list[int], template: Mouvement):
-    """ Applies a mass update"""
-    # retrieve the movement
-    for i in indexes:
-        mvt = session.get(Mouvement, ident=i)
-        if not mvt is None:
-            if template.label_utilisateur:
-                mvt.label_utilisateur = template.label_utilisateur
-            if template.no_de_reference:
-                mvt.no_de_reference = template.no_de_reference
-            mvt.date_remboursement = template.date_remboursement
-            if not template.description is None:
-                mvt.description = template.description
-            if not template.categorie is None:
-                mvt.categorie = template.categorie
-            if not template.compte is None:
-                mvt.compte = template.compte
-            if not template.mois is None:
-                mvt.mois = template.mois
+def get_mass_update_values(template: Mouvement) -> dict:
+    """ Returns the attributes of the template to be applied by a mass update.
+
+    Label and reference are applied when filled, the other attributes when not None, and the reimbursement date
+    is always applied."""
+    values = {'date_remboursement': template.date_remboursement}
+    if template.label_utilisateur:
+        values['label_utilisateur'] = template.label_utilisateur
+    if template.no_de_reference:
+        values['no_de_reference'] = template.no_de_reference
+    for attribute in ['description', 'categorie', 'compte', 'mois']:
+        if getattr(template, attribute) is not None:
+            values[attribute] = getattr(template, attribute)
+    return values
+
+
+def apply_mass_update(session: Session, indexes: list[int], template: Mouvement) -> int:
+    """ Applies a mass update, with one UPDATE statement per chunk of indexes. The caller commits.
+
+    :returns: the number of movements updated"""
+    values = get_mass_update_values(template)
+    # the accounts of the movements may change : both old and new days are refreshed in the ledger
+    touched = ledger.get_mouvement_pairs(session, indexes)
+    count = 0
+    for i in range(0, len(indexes), UPDATE_CHUNK_SIZE):
+        result = session.execute(update(Mouvement).where(
+            Mouvement.index.in_(indexes[i:i + UPDATE_CHUNK_SIZE])).values(**values))
+        count += result.rowcount
+    session.flush()
+    if 'compte' in values:
+        touched |= ledger.get_mouvement_pairs(session, indexes)
+    ledger.refresh_daily_balances(session, touched)
+    return count
 
 
 def import_keyword(e: Engine, value: MapCategorie):
     with Session(e) as session:
         session.add(value)
         session.commit()
+    keyword_registry.invalidate()
 
 
 def get_matching_keywords(e: Engine, description: str) -> []:
-    """ filters all the keywords to find the ones corresponding to the description"""
-    stmt = select(MapCategorie)
-    with Session(e) as session:
-        mcs = session.scalars(stmt).all()
+    """ filters all the keywords to find the ones corresponding to the description
 
-    # filters the keywords
-    result = [mc for mc in mcs if mc.keyword in description]
+    :returns: transient MapCategorie objects, to be merged into a session before any update"""
+    with Session(e) as session:
+        result = keyword_registry.get_matching_maps(session, description)
 
     # return the results
     return result
@@ -906,6 +994,47 @@ def get_keywords(e: Engine, active_flag: bool) -> pd.DataFrame:
                        e)
 
 
+# Attributes copied from a transaction to its split sub-transactions
+SPLIT_ATTRIBUTES = ['date', 'description', 'compte', 'categorie', 'economie', 'regle', 'date_insertion',
+                    'provision_payer', 'provision_recuperer', 'date_remboursement', 'organisme', 'date_out_of_bound',
+                    'taux_remboursement', 'fait_marquant', 'no', 'no_de_reference', 'index_parent',
+                    'label_utilisateur', 'declarant', 'employeur']
+
+
+def to_amount(value) -> float:
+    """ Converts numpy and decimal amounts to float, keeping None"""
+    return None if value is None else float(value)
+
+
+def insert_mouvements(session: Session, job: Job, rows: list[dict]) -> list[int]:
+    """ Inserts the movements under the job, with multi-row INSERT ... RETURNING statements.
+
+    :param rows: dictionaries of Mouvement attributes, all with the same keys
+    :returns: the indexes of the new movements"""
+    if len(rows) == 0:
+        return []
+    if job.job_id is None:
+        session.add(job)
+        session.flush()
+    for r in rows:
+        r['job_id'] = job.job_id
+        # the bulk insert bypasses Mouvement.validate_mois : the month is forced to its first day here
+        if r.get('mois') is not None:
+            r['mois'] = (r['mois'].date() if isinstance(r['mois'], datetime) else r['mois']).replace(day=1)
+    return list(session.scalars(insert(Mouvement).returning(Mouvement.index), rows))
+
+
+def insert_split_mouvements(session: Session, parent: Mouvement, job: Job, recettes: list, depenses: list,
+                            months: list, attributes: list[str] = SPLIT_ATTRIBUTES) -> list[int]:
+    """ Inserts the sub-transactions of a parent movement, one per month, in bulk
+
+    :returns: the indexes of the new movements"""
+    common = {a: getattr(parent, a) for a in attributes}
+    rows = [dict(common, recette=to_amount(r), depense=to_amount(d), mois=m)
+            for r, d, m in zip(recettes, depenses, months)]
+    return insert_mouvements(session, job, rows)
+
+
 def simple_split(session: Session, index: int, values: list, months: list):
     """ This is also a splitting function, but which assumes the values and months are already defined
 
@@ -926,34 +1055,9 @@ def simple_split(session: Session, index: int, values: list, months: list):
         job = Job(job_key=Job.type_split, job_timestamp=dt.datetime.now())
 
         # create the sub-transactions
-        for i in range(len(values)):
-            session.add(
-                Mouvement(date=mvt.date,
-                          description=mvt.description,
-                          recette=values[i] if values[i] > 0 else 0,
-                          depense=-values[i] if values[i] < 0 else 0,
-                          compte=mvt.compte,
-                          categorie=mvt.categorie,
-                          economie=mvt.economie,
-                          regle=mvt.regle,
-                          mois=months[i],
-                          date_insertion=mvt.date_insertion,
-                          provision_payer=mvt.provision_payer,
-                          provision_recuperer=mvt.provision_recuperer,
-                          date_remboursement=mvt.date_remboursement,
-                          organisme=mvt.organisme,
-                          date_out_of_bound=mvt.date_out_of_bound,
-                          taux_remboursement=mvt.taux_remboursement,
-                          fait_marquant=mvt.fait_marquant,
-                          no=mvt.no,
-                          no_de_reference=mvt.no_de_reference,
-                          index_parent=mvt.index_parent,
-                          label_utilisateur=mvt.label_utilisateur,
-                          declarant=mvt.declarant,
-                          employeur=mvt.employeur,
-                          job=job
-                          )
-            )
+        recettes = [v if v > 0 else 0 for v in values]
+        depenses = [-v if v < 0 else 0 for v in values]
+        insert_split_mouvements(session, mvt, job, recettes, depenses, months)
 
         # Update the original transaction
         session.add(mvt)
@@ -1002,36 +1106,8 @@ def split_mouvement(session: Session, index: int, mode: str = 'year', periods: i
         job = Job(job_key=Job.type_split, job_timestamp=dt.datetime.now())
 
         # create the sub-transactions
-        for i in range(periods):
-            session.add(
-                Mouvement(date=mvt.date,
-                          description=mvt.description,
-                          recette=recs[i],
-                          depense=deps[i],
-                          compte=mvt.compte,
-                          categorie=mvt.categorie,
-                          economie=mvt.economie,
-                          regle=mvt.regle,
-                          mois=mois[i],
-                          date_insertion=mvt.date_insertion,
-                          provision_payer=mvt.provision_payer,
-                          provision_recuperer=mvt.provision_recuperer,
-                          date_remboursement=mvt.date_remboursement,
-                          organisme=mvt.organisme,
-                          date_out_of_bound=mvt.date_out_of_bound,
-                          taux_remboursement=mvt.taux_remboursement,
-                          fait_marquant=mvt.fait_marquant,
-                          no=mvt.no,
-                          no_de_reference=mvt.no_de_reference,
-                          index_parent=mvt.index_parent,
-                          depense_initiale=mvt.depense_initiale,
-                          recette_initiale=mvt.recette_initiale,
-                          label_utilisateur=mvt.label_utilisateur,
-                          declarant=mvt.declarant,
-                          employeur=mvt.employeur,
-                          job=job
-                          )
-            )
+        insert_split_mouvements(session, mvt, job, recs, deps, mois,
+                                SPLIT_ATTRIBUTES + ['depense_initiale', 'recette_initiale'])
 
         # Update the original transaction
         session.add(mvt)
@@ -1055,24 +1131,21 @@ def generate_provision(e: Engine, category: str, year: int, description: str, de
         # create a job
         job = Job(job_key=Job.type_provision, job_timestamp=dt.datetime.now())
         # generate a set of provisions
-        for i in range(12):
-            mvt = Mouvement(date=dt.date(year, 1, 1),
-                            description=description,
-                            categorie=category,
-                            mois=dt.date(year, i + 1, 1),
-                            date_insertion=dt.date.today(),
-                            provision_payer=depense,
-                            provision_recuperer=recette,
-                            no=0,
-                            job=job
-                            )
-            session.add(mvt)
-            print(f'Transaction generated : {mvt}')
+        rows = [dict(date=dt.date(year, 1, 1),
+                     description=description,
+                     categorie=category,
+                     mois=dt.date(year, i + 1, 1),
+                     date_insertion=dt.date.today(),
+                     provision_payer=to_amount(depense),
+                     provision_recuperer=to_amount(recette),
+                     no=0) for i in range(12)]
+        indexes = insert_mouvements(session, job, rows)
+        print(f'Transactions generated : {indexes}')
 
-        session.flush()
         session.commit()
 
 
+@query_cache.cached()
 def get_balances(session: Session, first_month: date) -> pd.DataFrame:
     """ Calculates the balances per month"""
     stmt = select(Mouvement.mois, func.sum(Mouvement.depense).label('Dépense'),
@@ -1123,29 +1196,63 @@ def find_salary_transaction(s: Session, mois: date, amount: float) -> Mouvement:
     return mvt
 
 
-def get_salary_candidates(e: Engine):
-    """ Checks all the salary candidates and returns a dataframe"""
-    with Session(e) as session:
-        # get all salary rules
-        rules = session.scalars(select(MapSalaire))
-        # iterate over the rules
-        result = []
-        for r in rules:
-            mvts = session.scalars(
-                select(Mouvement).where(Mouvement.description.contains(r.pattern),
-                                        Mouvement.compte == r.compte,
-                                        Mouvement.declarant is None,
-                                        Mouvement.recette > 0))
-            result += mvts
-        # Convert to a dataframe
-        m: Mouvement
-        data = [[m.index, m.description, m.date, m.mois] for m in result]
-        df = pd.DataFrame(data=data, columns=['Index', 'Description', 'Date', 'Solde'])
-
-    # end
+def get_salary_candidates(s: Session, rescan: bool = False) -> pd.DataFrame:
+    """ Matches all the active salary rules against the movements in a single query.
+
+    A candidate is an active receipt, without declarant, on the account of a rule and whose description contains
+    the pattern of the rule (% and _ being plain characters). Unless rescan, only the movements of the jobs after the last_job_id of the rule are
+    scanned : the caller stamps the rules with stamp_salary_rules once the candidates are processed (see
+    document_salary_candidates).
+
+    :returns: a dataframe of the candidates, the last job scanned being stored in df.attrs['last_job_id']"""
+    last_job_id = s.scalar(select(func.max(Job.job_id)))
+    pattern = func.replace(func.replace(func.replace(MapSalaire.pattern, '\\', '\\\\'), '%', '\\%'), '_', '\\_')
+    stmt = select(Mouvement.index.label('Index'), Mouvement.description.label('Description'),
+                  Mouvement.date.label('Date'), Mouvement.mois.label('Mois'), Mouvement.recette.label('Recette'),
+                  MapSalaire.declarant.label('Déclarant'), MapSalaire.pattern.label('Pattern')).join(
+        MapSalaire, and_(Mouvement.compte == MapSalaire.compte,
+                         Mouvement.description.contains(pattern, escape='\\'))).where(
+        MapSalaire.active == True,
+        Mouvement.declarant == None,
+        Mouvement.recette > 0,
+        Mouvement.date_out_of_bound == False)
+    if last_job_id is not None:
+        stmt = stmt.where(Mouvement.job_id <= last_job_id)
+    if not rescan:
+        stmt = stmt.where(or_(MapSalaire.last_job_id == None, Mouvement.job_id > MapSalaire.last_job_id))
+    df = pd.read_sql(stmt.order_by(Mouvement.date.desc(), Mouvement.index.desc()), s.connection())
+    df.attrs['last_job_id'] = last_job_id
     return df
 
 
+def stamp_salary_rules(s: Session, last_job_id: int):
+    """ Records that the active salary rules have scanned the movements up to the job last_job_id"""
+    s.execute(update(MapSalaire).where(MapSalaire.active == True).values(last_job_id=last_job_id))
+
+
+def document_salary_candidates(s: Session, candidates: pd.DataFrame, selected: list[int] = None) -> int:
+    """ Documents the selected candidates of get_salary_candidates (the positions of their rows, all if None) with
+    the declarant of their rule, then stamps the rules with the last job scanned : the candidates left aside are
+    only listed again by a rescan. The caller commits.
+
+    A movement matched by several rules takes the declarant of the longest pattern. It is left undocumented when the
+    longest patterns give different declarants.
+
+    :returns: the number of movements documented"""
+    rows = candidates if selected is None else candidates.iloc[list(selected)]
+    rows = rows.assign(length=rows['Pattern'].str.len())
+    longest = rows[rows['length'] == rows.groupby('Index')['length'].transform('max')]
+    ambiguous = longest.groupby('Index')['Déclarant'].nunique()
+    rows = longest[~longest['Index'].isin(ambiguous[ambiguous > 1].index)].drop_duplicates('Index')
+    if len(rows):
+        s.execute(update(Mouvement), [{'index': int(i), 'declarant': d} for i, d in zip(rows['Index'],
+                                                                                       rows['Déclarant'])])
+    if candidates.attrs.get('last_job_id') is not None:
+        stamp_salary_rules(s, candidates.attrs['last_job_id'])
+    return len(rows)
+
+
+@query_cache.cached()
 def get_jobs(s: Session, limit: int = 10):
     """ Get the last jobs, ordered by execution date """
     stmt = select(Job).order_by(Job.job_id.desc()).limit(limit)
@@ -1153,6 +1260,7 @@ def get_jobs(s: Session, limit: int = 10):
     return jobs
 
 
+@query_cache.cached()
 def get_numeros_reference(s: Session, limit: int = 20):
     """ Get the latest tags"""
     stmt = select(Mouvement.no_de_reference, func.max(Mouvement.date)).where(
@@ -1163,23 +1271,23 @@ def get_numeros_reference(s: Session, limit: int = 20):
 
 def save_map_categorie(e: Engine, value: MapCategorie, check_duplicates: bool):
     with Session(e) as session:
-        existing_keys = session.scalars(select(MapCategorie.keyword)).all()
         # Check that the item to save is not already existing
-        if check_duplicates and (
-                any([value.keyword in k for k in existing_keys]) or any([k in value.keyword for k in existing_keys])):
+        if check_duplicates and keyword_registry.is_conflicting(session, value.keyword):
             raise KeyError(f"the keyword {value.keyword} can already be found in the existing maps")
 
         session.add(value)
         session.commit()
+    keyword_registry.invalidate()
 
 
 def find_active_maps(s: Session, keyword: str) -> list[MapCategorie]:
-    """ Checks if there are any conflicting maps """
-    existing_keys = s.scalars(select(MapCategorie).where(not_(MapCategorie.inactif))).all()
-
-    result = [mc for mc in existing_keys if (mc.keyword in keyword) or (keyword in mc.keyword)]
-
-    return result
+    """ Checks if there are any conflicting maps. The maps added, modified or deleted in the session and not
+    committed yet (an editor batch) take precedence over the ones of the registry"""
+    pending = {m.keyword: m for m in list(s.new) + list(s.dirty) + list(s.deleted) if isinstance(m, MapCategorie)}
+    result = [mc for mc in keyword_registry.find_conflicting_maps(s, keyword, active_only=True)
+              if mc.keyword not in pending]
+    return result + [mc for mc in pending.values() if mc not in s.deleted and mc.inactif == False and (
+            mc.keyword in keyword or keyword in mc.keyword)]
 
 
 def identify_gaps(s: Session, value: MapCategorie):
@@ -1221,7 +1329,7 @@ class JobMapper:
 
 
 def makesession() -> Session:
-    return Session(engines.get_pgfin_engine())
+    return engines.makesession()
 
 
 def split_value(value: float, no_periods: int, rounding: int) -> Iterable:
@@ -0,0 +1,77 @@
+""" A module dedicated to the indexes of the finance database.
+
+The indexes are declared with the models (see datamodel). create_all only creates them with their tables : the
+indexes missing on the existing tables are created by create_indexes, which can be run at every schema update.
+The usage and size of the indexes are then reported by get_index_statistics."""
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import Table, text
+from sqlalchemy.exc import OperationalError
+
+from datamodel import Mouvement, Impot, Declarant
+
+
+def get_indexed_tables() -> list[Table]:
+    """ Returns the mapped tables declaring indexes (the views of dbview_schema are excluded)"""
+    tables = []
+    for metadata in [Mouvement.metadata, Impot.metadata, Declarant.metadata]:
+        tables += [t for t in metadata.sorted_tables if t.schema is None and t.indexes]
+    return tables
+
+
+def get_missing_indexes(bind) -> list[sqlalchemy.Index]:
+    """ Returns the declared indexes which do not exist in the database, the missing tables being ignored"""
+    inspector = sqlalchemy.inspect(bind)
+    missing = []
+    for table in get_indexed_tables():
+        if not inspector.has_table(table.name):
+            continue
+        existing = {i['name'] for i in inspector.get_indexes(table.name)}
+        missing += sorted((i for i in table.indexes if i.name not in existing), key=lambda i: i.name)
+    return missing
+
+
+def create_indexes(bind) -> list[str]:
+    """ Creates the declared indexes which are missing, then refreshes the statistics of their tables
+
+    :returns: the names of the indexes created"""
+    with bind.engine.begin() as connection:
+        missing = get_missing_indexes(connection)
+        for index in missing:
+            index.create(connection)
+        for table_name in sorted({i.table.name for i in missing}):
+            connection.exec_driver_sql(f'ANALYZE {table_name}')
+    return [i.name for i in missing]
+
+
+def get_index_statistics(bind) -> pd.DataFrame:
+    """ Returns the indexes of the database with their size in bytes and, on PostgreSQL, their usage since the last
+    reset of the statistics (number of scans and of index entries read)
+
+    :returns: a dataframe with the columns index, table, scans, tuples_read, size, declared"""
+    declared = {i.name for t in get_indexed_tables() for i in t.indexes}
+    with bind.engine.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            df = pd.read_sql(text(
+                'SELECT s.indexrelname AS "index", s.relname AS "table", s.idx_scan AS scans, '
+                's.idx_tup_read AS tuples_read, pg_relation_size(s.indexrelid) AS size '
+                'FROM pg_stat_user_indexes s WHERE s.schemaname = current_schema()'), connection)
+        else:
+            df = pd.read_sql(text('SELECT name AS "index", tbl_name AS "table" FROM sqlite_master '
+                                  "WHERE type = 'index'"), connection)
+            df['scans'] = None
+            df['tuples_read'] = None
+            try:
+                # dbstat is only available when SQLite is compiled with SQLITE_ENABLE_DBSTAT_VTAB
+                sizes = connection.execute(text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")).all()
+                df['size'] = df['index'].map(dict(sizes))
+            except OperationalError:
+                df['size'] = None
+    df['declared'] = df['index'].isin(declared)
+    return df.sort_values(['table', 'index'], ignore_index=True)
+
+
+def get_unused_indexes(bind) -> list[str]:
+    """ Returns the declared indexes never scanned since the last reset of the statistics (PostgreSQL only)"""
+    df = get_index_statistics(bind)
+    return df.loc[df['declared'] & (df['scans'] == 0), 'index'].tolist()
@@ -0,0 +1,254 @@
+""" A module dedicated to the import of bank statements (CSV, OFX and QIF exports).
+
+The statement is read in chunks, normalized into movements of one account, and inserted under a single import job.
+
+Every movement carries a content hash (column Empreinte) of its date, amount, description and account, and of its
+occurrence number among the identical rows of the statement : the rows of a statement exported twice, or of two
+overlapping exports, are recognized and skipped, while two identical payments of the same day are both kept. The
+movements inserted by other means get their hash the first time a statement covering their dates is imported : a
+split or neutralised movement is hashed with its original amounts, the rows derived from it (splits, salary
+components, provisions) are not hashed. The column is deferred in the datamodel, and added to an older database at
+its first import.
+
+The category maps are then applied to the new job (see rules.apply_category_maps)."""
+import hashlib
+import re
+from datetime import date, datetime
+from pathlib import Path
+from typing import Iterator
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import select, update, or_, Engine
+from sqlalchemy.orm import Session
+
+import rules
+from datamodel import Mouvement, Job
+from functions import allocate_numbers, insert_mouvements
+from search import fold
+
+# Number of rows of the statement processed at once
+CHUNK_SIZE = 5_000
+
+# Layout of the CSV exports. 'amount' is a signed amount column, used when the export has no Débit / Crédit columns
+CSV_FORMAT = {'sep': ';', 'decimal': ',', 'thousands': ' ', 'encoding': 'latin-1', 'skiprows': 0, 'dayfirst': True,
+              'date': 'Date', 'description': 'Libellé', 'debit': 'Débit', 'credit': 'Crédit', 'amount': None}
+
+# Tags of an OFX export, closed (XML) or not (SGML)
+OFX_TAG = re.compile(r'<(/?\w+)>([^<\r\n]*)')
+
+# Columns of the normalized chunks
+STATEMENT_COLUMNS = ['date', 'description', 'montant']
+
+# Databases (urls) known to have the column Empreinte
+checked_databases = set()
+
+
+def add_content_hash_column(bind):
+    """ Adds the column Empreinte to an existing table comptes"""
+    with bind.engine.begin() as connection:
+        columns = [c['name'] for c in sqlalchemy.inspect(connection).get_columns(Mouvement.__tablename__)]
+        if Mouvement.empreinte.name not in columns:
+            connection.exec_driver_sql(f'ALTER TABLE {Mouvement.__tablename__} '
+                                       f'ADD COLUMN "{Mouvement.empreinte.name}" VARCHAR(32)')
+    checked_databases.add(str(bind.engine.url))
+
+
+def clean_description(text) -> str:
+    """ Collapses the spaces and line breaks of a bank label"""
+    return ' '.join(str(text).split()) if text is not None and not pd.isna(text) else ''
+
+
+def parse_amount(text: str) -> float:
+    """ Reads '1 234,56', '-1,234.56' or '12.5' as a float"""
+    text = str(text).replace('\xa0', '').replace(' ', '').replace('+', '')
+    if ',' in text and '.' in text:
+        text = text.replace(',', '') if text.index(',') < text.index('.') else text.replace('.', '').replace(',', '.')
+    return float(text.replace(',', '.'))
+
+
+def get_content_hash(day: date, amount: float, description: str, compte: str, occurrence: int) -> str:
+    """ Returns the hash identifying the occurrence-th movement of this date, amount, description and account"""
+    key = '|'.join([day.isoformat(), str(round(amount * 100)), fold(clean_description(description)), compte,
+                    str(occurrence)])
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def read_csv_statement(path, csv_format: dict = None, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """ Reads a CSV export in chunks of normalized rows (date, description, montant)"""
+    fmt = dict(CSV_FORMAT, **(csv_format or {}))
+    for chunk in pd.read_csv(path, sep=fmt['sep'], decimal=fmt['decimal'], thousands=fmt['thousands'],
+                             encoding=fmt['encoding'], skiprows=fmt['skiprows'], chunksize=chunk_size, dtype=str):
+        chunk = chunk.dropna(subset=[fmt['date']])
+        if fmt['amount'] is not None:
+            amounts = chunk[fmt['amount']].map(parse_amount).astype(float)
+        else:
+            debits, credits = [chunk[fmt[c]].map(parse_amount, na_action='ignore').astype(float).fillna(0).abs()
+                               for c in ['debit', 'credit']]
+            amounts = credits - debits
+        yield pd.DataFrame({'date': pd.to_datetime(chunk[fmt['date']], dayfirst=fmt['dayfirst']).dt.date,
+                            'description': chunk[fmt['description']].map(clean_description),
+                            'montant': amounts})
+
+
+def read_ofx_records(path, chunk_size: int, encoding: str) -> Iterator[list[dict]]:
+    """ Reads the transactions (STMTTRN) of an OFX export line by line, in chunks of dictionaries of tags"""
+    records = []
+    record = None
+    with open(path, encoding=encoding, errors='replace') as f:
+        for line in f:
+            for tag, value in OFX_TAG.findall(line):
+                tag = tag.upper()
+                if tag == 'STMTTRN':
+                    record = {}
+                elif tag == '/STMTTRN' and record is not None:
+                    records.append(record)
+                    record = None
+                elif record is not None and not tag.startswith('/'):
+                    record[tag] = value.strip()
+            if len(records) >= chunk_size:
+                yield records
+                records = []
+    if records:
+        yield records
+
+
+def read_qif_records(path, chunk_size: int, encoding: str) -> Iterator[list[dict]]:
+    """ Reads the transactions of a QIF export line by line, in chunks of dictionaries of fields"""
+    records = []
+    record = {}
+    with open(path, encoding=encoding, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('^'):
+                if 'D' in record:
+                    records.append(record)
+                record = {}
+                if len(records) >= chunk_size:
+                    yield records
+                    records = []
+            elif line and not line.startswith('!'):
+                # a field given on several lines (long memo or payee) is joined, in the order of the lines
+                value = line[1:].strip()
+                record[line[0]] = f'{record[line[0]]} {value}' if line[0] in record else value
+    if 'D' in record:
+        records.append(record)
+    if records:
+        yield records
+
+
+def read_ofx_statement(path, chunk_size: int = CHUNK_SIZE, encoding: str = 'latin-1') -> Iterator[pd.DataFrame]:
+    """ Reads the transactions (STMTTRN) of an OFX export, SGML (v1) or XML (v2)"""
+    for records in read_ofx_records(path, chunk_size, encoding):
+        yield pd.DataFrame({
+            'date': [date(int(r['DTPOSTED'][:4]), int(r['DTPOSTED'][4:6]), int(r['DTPOSTED'][6:8])) for r in records],
+            'description': [clean_description(' '.join(dict.fromkeys(
+                [r.get('NAME', ''), r.get('MEMO', '')]))) for r in records],
+            'montant': [parse_amount(r['TRNAMT']) for r in records]}, columns=STATEMENT_COLUMNS)
+
+
+def read_qif_statement(path, chunk_size: int = CHUNK_SIZE, encoding: str = 'latin-1',
+                       dayfirst: bool = True) -> Iterator[pd.DataFrame]:
+    """ Reads the transactions of a QIF export (fields D date, T amount, P payee, M memo, records ended by ^), the
+    fields repeated in a record being joined"""
+    for records in read_qif_records(path, chunk_size, encoding):
+        yield pd.DataFrame({
+            'date': [pd.to_datetime(r['D'].replace("'", '/'), dayfirst=dayfirst).date() for r in records],
+            'description': [clean_description(' '.join(dict.fromkeys([r.get('P', ''), r.get('M', '')])))
+                            for r in records],
+            'montant': [parse_amount(r.get('T', r.get('U'))) for r in records]}, columns=STATEMENT_COLUMNS)
+
+
+def read_statement(path, csv_format: dict = None, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """ Reads a statement according to its extension (.csv, .ofx or .qif)"""
+    suffix = Path(path).suffix.lower()
+    if suffix == '.csv':
+        return read_csv_statement(path, csv_format, chunk_size)
+    if suffix == '.ofx':
+        return read_ofx_statement(path, chunk_size)
+    if suffix == '.qif':
+        return read_qif_statement(path, chunk_size)
+    raise ValueError(f'unknown statement format : {suffix}')
+
+
+def hash_existing_mouvements(s: Session, compte: str, first_date: date, last_date: date) -> int:
+    """ Computes the missing content hashes of the movements of an account between two dates, the split or
+    neutralised movements with their original amounts
+
+    :returns: the number of movements hashed"""
+    stmt = select(Mouvement.index, Mouvement.date, Mouvement.recette, Mouvement.depense, Mouvement.recette_initiale,
+                  Mouvement.depense_initiale, Mouvement.description, Mouvement.empreinte).outerjoin(
+        Job, Mouvement.job_id == Job.job_id).where(
+        Mouvement.compte == compte, Mouvement.date >= first_date, Mouvement.date <= last_date,
+        or_(Job.job_key == None, Job.job_key.notin_(Job.types_derived))).order_by(Mouvement.index)
+    occurrences = {}
+    changes = []
+    for index, day, recette, depense, recette_initiale, depense_initiale, description, empreinte in s.execute(stmt):
+        if recette_initiale is not None or depense_initiale is not None:
+            recette, depense = recette_initiale, depense_initiale
+        amount = float(recette or 0) - float(depense or 0)
+        key = (day, round(amount * 100), fold(clean_description(description)))
+        occurrence = occurrences.get(key, 0)
+        occurrences[key] = occurrence + 1
+        if empreinte is None:
+            changes.append({'index': index,
+                            'empreinte': get_content_hash(day, amount, description, compte, occurrence)})
+    for i in range(0, len(changes), CHUNK_SIZE):
+        s.execute(update(Mouvement), changes[i:i + CHUNK_SIZE])
+    return len(changes)
+
+
+def ingest_statement(s: Session, path, compte: str, default_category: str, csv_format: dict = None,
+                     chunk_size: int = CHUNK_SIZE) -> dict:
+    """ Imports a bank statement into an account, under a single import job. The caller commits.
+
+    :param default_category: the category of the movements matched by no category map
+    :returns: the number of rows read, of duplicates skipped and of movements inserted, and the job id"""
+    if str(s.get_bind().engine.url) not in checked_databases:
+        add_content_hash_column(s.get_bind())
+    job = Job(job_key=Job.type_import, job_timestamp=datetime.now())
+    occurrences = {}
+    statistics = {'read': 0, 'duplicates': 0, 'inserted': 0, 'job_id': None}
+    for chunk in read_statement(path, csv_format, chunk_size):
+        if len(chunk) == 0:
+            continue
+        statistics['read'] += len(chunk)
+
+        # hashes of the chunk, the identical rows being numbered
+        hashes = []
+        for day, description, amount in chunk[STATEMENT_COLUMNS].itertuples(index=False):
+            key = (day, round(amount * 100), fold(description))
+            occurrence = occurrences.get(key, 0)
+            occurrences[key] = occurrence + 1
+            hashes.append(get_content_hash(day, amount, description, compte, occurrence))
+        chunk = chunk.assign(empreinte=hashes)
+
+        # the existing movements of these dates are compared by their hashes
+        hash_existing_mouvements(s, compte, min(chunk['date']), max(chunk['date']))
+        existing = set(s.scalars(select(Mouvement.empreinte).where(Mouvement.empreinte.in_(hashes))))
+        chunk = chunk[~chunk['empreinte'].isin(existing)]
+        statistics['duplicates'] += len(hashes) - len(chunk)
+        if len(chunk) == 0:
+            continue
+
+        numbers = allocate_numbers(s, len(chunk))
+        rows = [dict(date=day, description=description, compte=compte, categorie=default_category,
+                     mois=day.replace(day=1), date_insertion=date.today(), date_out_of_bound=False,
+                     recette=amount if amount > 0 else None, depense=-amount if amount < 0 else None,
+                     economie='false', no=number, empreinte=empreinte)
+                for (day, description, amount, empreinte), number in
+                zip(chunk[STATEMENT_COLUMNS + ['empreinte']].itertuples(index=False), numbers)]
+        statistics['inserted'] += len(insert_mouvements(s, job, rows))
+
+    if job.job_id is not None:
+        statistics['job_id'] = job.job_id
+        rules.apply_category_maps(s, job_id=job.job_id)
+    return statistics
+
+
+def import_statement(e: Engine, path, compte: str, default_category: str, csv_format: dict = None) -> dict:
+    """ Imports a bank statement and commits, nothing being imported on error"""
+    with Session(e) as session:
+        statistics = ingest_statement(session, path, compte, default_category, csv_format)
+        session.commit()
+    return statistics
@@ -1,32 +1,112 @@
 import datetime as dt
-from dateutil.relativedelta import relativedelta
 import numpy as np
 import pandas as pd
 
-def generate_payment_schedule(start_date: dt.date, nb_mois: int, due: float, rate: float) -> pd.DataFrame:
-    # calcul de la mensualité
-    monthly_rate = (due * rate / 12) / (1 - (1 + rate / 12) ** (-nb_mois))
+# Colonnes des échéanciers
+SCHEDULE_COLUMNS = ['Capital Restant Dû', 'Capital', 'Intérêts', 'Mensualité', 'Remboursement anticipé']
 
-    # Initialisation de la date
-    dates = [start_date + relativedelta(months=i) for i in range(nb_mois)]
-    cap_restant_du = np.empty(nb_mois)
-    intérêts = np.empty(nb_mois)
-    capital = np.empty(nb_mois)
-    # Calcul des rate
-    prêt_initial = due
 
-    for i in range(nb_mois):
-        intérêts[i] = prêt_initial * rate / 12
-        capital[i] = monthly_rate - intérêts[i]
+def schedule_dates(start_date: dt.date, nb_mois: int) -> pd.DatetimeIndex:
+    """ Returns the monthly dates of a schedule, the day of start_date being kept (or the last day of shorter months),
+    as start_date + relativedelta(months=i)"""
+    months = np.datetime64(start_date, 'M') + np.arange(nb_mois)
+    first_days = months.astype('datetime64[D]')
+    days_in_month = ((months + 1).astype('datetime64[D]') - first_days).astype(int)
+    return pd.DatetimeIndex(first_days + np.minimum(start_date.day, days_in_month) - 1)
 
-        cap_restant_du[i] = prêt_initial - capital[i]
-        prêt_initial = cap_restant_du[i]
+
+def annuity(due, monthly_rate, nb_mois):
+    """ Returns the constant monthly payment repaying due in nb_mois months"""
+    nb_mois = np.maximum(nb_mois, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(monthly_rate == 0, due / nb_mois,
+                        due * monthly_rate / (1 - (1 + monthly_rate) ** (-nb_mois.astype(float))))
+
+
+def compute_schedules(nb_mois, due, rate, deferral: int = 0, capitalize_deferral: bool = False,
+                      rate_changes: dict = None, prepayments: dict = None) -> dict:
+    """ Computes the schedules of many loans at once.
+
+    nb_mois, due and rate are broadcast together : rate=[[0.03], [0.04]], nb_mois=[180, 240, 300] gives 2 x 3 loans.
+    Between two events, the balances follow the closed form of the annuity, computed for all the months at once.
+
+    :param deferral: number of months, from the start, during which no capital is repaid. Only the interests are
+        paid, or, if capitalize_deferral, they are added to the capital due
+    :param rate_changes: {month number: new yearly rate}, the payment being recomputed from that month
+    :param prepayments: {month number: amount repaid early}, paid before the payment of the month. The payment is
+        recomputed, the duration being kept
+    :returns: the arrays of SCHEDULE_COLUMNS, of shape (loans shape) + (longest duration,), the months after the end of
+        a loan being 0, and the array 'nb_mois' of the durations. 'Capital' includes the early repayments"""
+    nb_mois, due, rate = np.broadcast_arrays(np.asarray(nb_mois, dtype=int), np.asarray(due, dtype=float),
+                                             np.asarray(rate, dtype=float))
+    shape = nb_mois.shape
+    durations = nb_mois.ravel()
+    balance = due.ravel().copy()
+    rate = rate.ravel().copy()
+    rate_changes = {m: np.broadcast_to(np.asarray(v, dtype=float), shape).ravel() for m, v in
+                    (rate_changes or {}).items()}
+    prepayments = {m: np.broadcast_to(np.asarray(v, dtype=float), shape).ravel() for m, v in
+                   (prepayments or {}).items()}
+
+    total = int(durations.max()) if durations.size else 0
+    result = {c: np.zeros((durations.size, total)) for c in SCHEDULE_COLUMNS}
+    boundaries = sorted({0, deferral, *rate_changes, *prepayments} & set(range(total))) + [total]
+
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        if start in rate_changes:
+            rate = rate_changes[start]
+        if start in prepayments:
+            prepaid = np.where(start < durations, np.minimum(prepayments[start], balance), 0)
+            result['Remboursement anticipé'][:, start] = prepaid
+            balance = balance - prepaid
+
+        # months of the segment, for every loan
+        k = np.arange(end - start)[None, :]
+        monthly_rate = rate[:, None] / 12
+        growth = (1 + monthly_rate) ** k
+        if start < deferral:
+            # différé : le capital n'est pas remboursé
+            before = balance[:, None] * growth if capitalize_deferral else np.repeat(balance[:, None], end - start, 1)
+            interests = before * monthly_rate
+            payment = np.zeros_like(before) if capitalize_deferral else interests
+        else:
+            monthly_payment = annuity(balance, rate / 12, durations - start)[:, None]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                before = np.where(monthly_rate == 0, balance[:, None] - monthly_payment * k,
+                                  balance[:, None] * growth - monthly_payment * (growth - 1) / monthly_rate)
+            interests = before * monthly_rate
+            payment = np.broadcast_to(monthly_payment, before.shape)
+
+        active = start + k < durations[:, None]
+        after = before - (payment - interests)
+        after = np.where(np.abs(after) < 1e-6, 0, after)
+        result['Capital Restant Dû'][:, start:end] = np.where(active, after, 0)
+        result['Capital'][:, start:end] = np.where(active, payment - interests, 0)
+        result['Intérêts'][:, start:end] = np.where(active, interests, 0)
+        result['Mensualité'][:, start:end] = np.where(active, payment, 0)
+        balance = np.where(end - 1 < durations, after[:, -1], 0)
+
+    result['Capital'] += result['Remboursement anticipé']
+    result = {c: v.reshape(shape + (total,)) for c, v in result.items()}
+    result['nb_mois'] = nb_mois
+    return result
+
+
+def get_reimbursement_scheme(start_date: dt.date, schedules: dict, loan: tuple = ()) -> pd.Series:
+    """ Returns the capital repaid every month for one of the loans of compute_schedules, as expected by
+    functions.save_capital_reimbursements"""
+    nb_mois = int(schedules['nb_mois'][loan])
+    return pd.Series(schedules['Capital'][loan][:nb_mois], index=schedule_dates(start_date, nb_mois), name='Capital')
+
+
+def generate_payment_schedule(start_date: dt.date, nb_mois: int, due: float, rate: float, **options) -> pd.DataFrame:
+    """ Returns the schedule of a loan, see compute_schedules for the options (deferral, rate_changes, prepayments)"""
+    schedules = compute_schedules(nb_mois, due, rate, **options)
 
     # construire le dataframe
-    df = pd.DataFrame(index=dates)
-    df.index = pd.to_datetime(df.index)
-    df['Capital Restant Dû'] = np.round(cap_restant_du, 2)
-    df['Capital'] = np.round(capital, 2)
-    df['Intérêts'] = np.round(intérêts, 2)
+    df = pd.DataFrame(index=schedule_dates(start_date, nb_mois))
+    df['Capital Restant Dû'] = np.round(schedules['Capital Restant Dû'], 2)
+    df['Capital'] = np.round(schedules['Capital'], 2)
+    df['Intérêts'] = np.round(schedules['Intérêts'], 2)
 
-    return df
\ No newline at end of file
+    return df
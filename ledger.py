@@ -0,0 +1,259 @@
+""" A module dedicated to the daily balance ledger (table soldes_journaliers).
+
+The ledger stores, for every account and every day with movements, the net variation of the day and the running
+balance at the end of the day. It is maintained incrementally :
+- sync_daily_balances integrates the movements of the jobs not integrated yet. The integrated jobs are listed in
+  soldes_journaliers_jobs rather than by a watermark : a job committed after a newer one (concurrent GUI and CLI
+  sessions) is still integrated. The pending jobs are integrated whenever a session commits
+- refresh_daily_balances recomputes a set of (compte, jour) pairs, for instance after a deactivation. The days of the
+  movements modified or deleted through the ORM (edit forms...) are collected before every flush, both before and after
+  the change, and refreshed when the session commits
+Any date range can then be answered by a range read instead of a computation from the beginning of time.
+
+The ledger tables are created, and the ledger built, by update_schema : the read functions neither create tables nor
+commit. They integrate in their own transaction the jobs written without this module (another tool, raw SQL)."""
+from datetime import date, datetime
+from typing import Iterable
+
+import pandas as pd
+from sqlalchemy import select, func, update, delete, tuple_, insert, and_, event, inspect, exists
+from sqlalchemy.orm import Session
+
+from datamodel import Mouvement, Job, SoldeJournalier, SoldeJournalierEtat, SoldeJournalierJob
+
+# Number of (compte, jour) pairs read in a single query
+CHUNK_SIZE = 500
+
+# The single row of the state table
+ETAT_ID = 1
+
+# The daily variation of a movement
+variation = func.coalesce(Mouvement.recette, 0) - func.coalesce(Mouvement.depense, 0)
+
+
+# Attributes of the movements changing the ledger
+LEDGER_ATTRIBUTES = ['compte', 'date', 'recette', 'depense', 'date_out_of_bound']
+
+# Key, in Session.info, of the days to refresh at commit
+MODIFIED_DAYS = 'ledger_modified_days'
+# The databases whose ledger tables are known to exist
+checked_databases = set()
+
+
+def create_ledger_tables(bind):
+    """ Creates the ledger tables if they do not exist yet"""
+    SoldeJournalier.__table__.create(bind, checkfirst=True)
+    SoldeJournalierEtat.__table__.create(bind, checkfirst=True)
+    SoldeJournalierJob.__table__.create(bind, checkfirst=True)
+    checked_databases.add(str(bind.engine.url))
+
+
+def get_ledger_state(s: Session, lock: bool = False) -> SoldeJournalierEtat:
+    """ Returns the state of the ledger, None if it has never been built"""
+    stmt = select(SoldeJournalierEtat).where(SoldeJournalierEtat.etat_id == ETAT_ID)
+    if lock:
+        stmt = stmt.with_for_update()
+    return s.scalar(stmt)
+
+
+def get_pending_jobs():
+    """ The statement selecting the jobs not integrated in the ledger yet"""
+    return select(Job.job_id).where(~exists().where(SoldeJournalierJob.job_id == Job.job_id))
+
+
+def rebuild_daily_balances(s: Session) -> int:
+    """ Rebuilds the whole ledger from the movements. The caller commits.
+
+    :returns: the number of daily balances written"""
+    state = get_ledger_state(s, lock=True)
+    if state is None:
+        state = SoldeJournalierEtat(etat_id=ETAT_ID)
+        s.add(state)
+    last_job_id = s.scalar(select(func.max(Job.job_id)))
+
+    stmt = select(Mouvement.compte, Mouvement.date, func.sum(variation).label('mouvement')).where(
+        Mouvement.date_out_of_bound == False, Mouvement.compte != None, Mouvement.date != None).group_by(
+        Mouvement.compte, Mouvement.date).order_by(Mouvement.compte, Mouvement.date)
+    df = pd.read_sql(stmt, s.connection(), coerce_float=True)
+    df['mouvement'] = df['mouvement'].astype(float).round(2)
+    df['solde'] = df.groupby('Compte')['mouvement'].cumsum().round(2)
+
+    s.execute(delete(SoldeJournalier))
+    s.execute(delete(SoldeJournalierJob))
+    s.execute(insert(SoldeJournalierJob).from_select(['job_id'], select(Job.job_id)))
+    rows = [{'compte': c, 'jour': d, 'mouvement': m, 'solde': b}
+            for c, d, m, b in df[['Compte', 'Date', 'mouvement', 'solde']].itertuples(index=False)]
+    for i in range(0, len(rows), CHUNK_SIZE):
+        s.execute(insert(SoldeJournalier), rows[i:i + CHUNK_SIZE])
+
+    state.last_job_id = last_job_id
+    state.last_refresh = datetime.now()
+    s.flush()
+    return len(rows)
+
+
+def refresh_daily_balances(s: Session, pairs: Iterable) -> int:
+    """ Recomputes the daily balances of the given (compte, jour) pairs, and shifts the following balances.
+
+    Must be called in the transaction that modified the movements (after a flush), the caller commits.
+    Nothing is done if the ledger has never been built.
+
+    :returns: the number of days whose variation changed"""
+    pairs = sorted({(c, d) for c, d in pairs if c is not None and d is not None})
+    if len(pairs) == 0:
+        return 0
+    state = get_ledger_state(s, lock=True)
+    if state is None:
+        return 0
+
+    # new and old variations of the days
+    new_values = {}
+    old_values = {}
+    for i in range(0, len(pairs), CHUNK_SIZE):
+        chunk = pairs[i:i + CHUNK_SIZE]
+        new_values.update({(c, d): float(v) for c, d, v in s.execute(
+            select(Mouvement.compte, Mouvement.date, func.sum(variation)).where(
+                Mouvement.date_out_of_bound == False,
+                tuple_(Mouvement.compte, Mouvement.date).in_(chunk)).group_by(Mouvement.compte, Mouvement.date))})
+        old_values.update({(c, d): float(v) for c, d, v in s.execute(
+            select(SoldeJournalier.compte, SoldeJournalier.jour, SoldeJournalier.mouvement).where(
+                tuple_(SoldeJournalier.compte, SoldeJournalier.jour).in_(chunk)))})
+
+    changed = 0
+    for c, d in pairs:
+        if (c, d) not in old_values:
+            # a new day : it starts with the balance of the previous day, the variation is applied below
+            previous = s.scalar(select(SoldeJournalier.solde).where(
+                SoldeJournalier.compte == c, SoldeJournalier.jour < d).order_by(
+                SoldeJournalier.jour.desc()).limit(1))
+            s.execute(insert(SoldeJournalier).values(compte=c, jour=d, mouvement=0, solde=previous or 0))
+            old_values[(c, d)] = 0.0
+        diff = round(new_values.get((c, d), 0.0) - old_values[(c, d)], 2)
+        if diff != 0:
+            changed += 1
+            s.execute(update(SoldeJournalier).where(SoldeJournalier.compte == c, SoldeJournalier.jour == d).values(
+                mouvement=SoldeJournalier.mouvement + diff))
+            s.execute(update(SoldeJournalier).where(SoldeJournalier.compte == c, SoldeJournalier.jour >= d).values(
+                solde=SoldeJournalier.solde + diff))
+
+    state.last_refresh = datetime.now()
+    s.flush()
+    return changed
+
+
+def get_mouvement_pairs(s: Session, indexes: list[int]) -> set:
+    """ Returns the (compte, jour) pairs of a list of movements"""
+    result = set()
+    for i in range(0, len(indexes), CHUNK_SIZE):
+        result.update(s.execute(select(Mouvement.compte, Mouvement.date).where(
+            Mouvement.index.in_(indexes[i:i + CHUNK_SIZE]))).tuples())
+    return result
+
+
+def sync_daily_balances(s: Session) -> int:
+    """ Integrates the movements of the jobs not integrated yet. The caller commits.
+
+    The ledger is fully built on the first call. Nothing is locked nor written when every job is integrated.
+
+    :returns: the number of days whose variation changed"""
+    if get_ledger_state(s) is not None and s.scalar(get_pending_jobs().limit(1)) is None:
+        return 0
+    state = get_ledger_state(s, lock=True)
+    if state is None:
+        return rebuild_daily_balances(s)
+
+    job_ids = s.scalars(get_pending_jobs()).all()
+    pairs = set()
+    for i in range(0, len(job_ids), CHUNK_SIZE):
+        pairs.update(s.execute(select(Mouvement.compte, Mouvement.date).where(
+            Mouvement.job_id.in_(job_ids[i:i + CHUNK_SIZE])).distinct()).tuples())
+    changed = refresh_daily_balances(s, pairs)
+
+    for i in range(0, len(job_ids), CHUNK_SIZE):
+        s.execute(insert(SoldeJournalierJob), [{'job_id': j} for j in job_ids[i:i + CHUNK_SIZE]])
+    state.last_job_id = max([state.last_job_id or 0] + job_ids)
+    s.flush()
+    return changed
+
+
+def sync_ledger(bind):
+    """ Synchronises the ledger in its own transaction (update_schema, maintenance)"""
+    with Session(bind) as ls:
+        sync_daily_balances(ls)
+        ls.commit()
+
+
+def get_modified_pairs(session: Session) -> set:
+    """ Returns the (compte, jour) pairs of the modified or deleted movements of the session, before and after the
+    change"""
+    pairs = set()
+    for obj in list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Mouvement):
+            continue
+        state = inspect(obj)
+        histories = {a: state.attrs[a].history for a in LEDGER_ATTRIBUTES}
+        if obj not in session.deleted and not any(h.has_changes() for h in histories.values()):
+            continue
+        pairs.add((obj.compte, obj.date))
+        old_compte, old_date = histories['compte'].deleted, histories['date'].deleted
+        if (histories['compte'].has_changes() and not old_compte) or (histories['date'].has_changes() and not old_date):
+            # the previous values were not loaded : they are still in the database
+            pairs.update(session.connection().execute(select(Mouvement.compte, Mouvement.date).where(
+                Mouvement.index == obj.index)).tuples())
+        else:
+            pairs.add((old_compte[0] if old_compte else obj.compte, old_date[0] if old_date else obj.date))
+    return pairs
+
+
+def has_ledger(session: Session) -> bool:
+    """ Checks if the ledger tables exist in the database of the session"""
+    url = str(session.get_bind().engine.url)
+    if url not in checked_databases and inspect(session.connection()).has_table(
+            SoldeJournalierJob.__tablename__):
+        checked_databases.add(url)
+    return url in checked_databases
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_modified_days(session: Session, flush_context, instances):
+    pairs = get_modified_pairs(session)
+    if pairs:
+        session.info.setdefault(MODIFIED_DAYS, set()).update(pairs)
+
+
+@event.listens_for(Session, 'before_commit')
+def refresh_modified_days(session: Session):
+    session.flush()
+    pairs = session.info.pop(MODIFIED_DAYS, None)
+    if has_ledger(session):
+        if pairs:
+            refresh_daily_balances(session, pairs)
+        if get_ledger_state(session) is not None:
+            sync_daily_balances(session)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_modified_days(session: Session):
+    session.info.pop(MODIFIED_DAYS, None)
+
+
+def read_daily_balances(s: Session, comptes: list[str], period_begin: date, period_end: date) -> pd.DataFrame:
+    """ Range read of the ledger.
+
+    :returns: a dataframe with columns Compte, Date, Mouvement, Solde"""
+    stmt = select(SoldeJournalier.compte.label('Compte'), SoldeJournalier.jour.label('Date'),
+                  SoldeJournalier.mouvement.label('Mouvement'), SoldeJournalier.solde.label('Solde')).where(
+        SoldeJournalier.compte.in_(comptes), SoldeJournalier.jour.between(period_begin, period_end)).order_by(
+        SoldeJournalier.compte, SoldeJournalier.jour)
+    return pd.read_sql(stmt, s.connection(), coerce_float=True, parse_dates='Date')
+
+
+def read_opening_balances(s: Session, comptes: list[str], period_begin: date) -> pd.Series:
+    """ Returns the balance of each account at the end of the day preceding period_begin"""
+    last_day = select(SoldeJournalier.compte, func.max(SoldeJournalier.jour).label('jour')).where(
+        SoldeJournalier.compte.in_(comptes), SoldeJournalier.jour < period_begin).group_by(
+        SoldeJournalier.compte).subquery()
+    stmt = select(SoldeJournalier.compte, SoldeJournalier.solde).join(
+        last_day, and_(SoldeJournalier.compte == last_day.c.compte, SoldeJournalier.jour == last_day.c.jour))
+    values = {c: float(v) for c, v in s.execute(stmt)}
+    return pd.Series([values.get(c, 0.0) for c in comptes], index=comptes, dtype=float)
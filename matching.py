@@ -0,0 +1,136 @@
+""" A module dedicated to the matching of keywords in transaction descriptions"""
+from collections import deque
+from typing import Iterable
+
+import pandas as pd
+
+
+class KeywordAutomaton:
+    """ An Aho-Corasick automaton built once from a list of patterns.
+
+    A description is scanned in a single pass whatever the number of patterns. When several patterns match,
+    the first one in the list wins, exactly as a linear scan `for pattern in patterns: if pattern in value`."""
+
+    def __init__(self, patterns: Iterable, values: Iterable = None, default=None):
+        self.__patterns__ = [str(p) for p in patterns]
+        self.__values__ = list(values) if values is not None else list(self.__patterns__)
+        self.__default__ = default
+        if len(self.__values__) != len(self.__patterns__):
+            raise ValueError(f"{len(self.__patterns__)} patterns but {len(self.__values__)} values")
+
+        # transitions, failure links, own outputs and best (lowest) rank reachable through the failure links
+        self.__goto__ = [{}]
+        self.__fail__ = [0]
+        self.__outputs__ = [[]]
+        self.__best__ = [None]
+        self.__build__()
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, pattern_column: str, value_column: str = None, default=None):
+        """ Builds the automaton from a dataframe, for instance the result of get_groups"""
+        values = df[value_column] if value_column else None
+        return cls(df[pattern_column], values, default)
+
+    def __build__(self):
+        for rank, pattern in enumerate(self.__patterns__):
+            node = 0
+            for char in pattern:
+                if char not in self.__goto__[node]:
+                    self.__goto__.append({})
+                    self.__fail__.append(0)
+                    self.__outputs__.append([])
+                    self.__best__.append(None)
+                    self.__goto__[node][char] = len(self.__goto__) - 1
+                node = self.__goto__[node][char]
+            self.__outputs__[node].append(rank)
+
+        # Breadth-first computation of the failure links
+        self.__best__[0] = min(self.__outputs__[0], default=None)
+        queue = deque()
+        for node in self.__goto__[0].values():
+            queue.append(node)
+        while queue:
+            node = queue.popleft()
+            for char, child in self.__goto__[node].items():
+                fallback = self.__fail__[node]
+                while fallback and char not in self.__goto__[fallback]:
+                    fallback = self.__fail__[fallback]
+                self.__fail__[child] = self.__goto__[fallback].get(char, 0)
+                queue.append(child)
+            own = min(self.__outputs__[node], default=None)
+            inherited = self.__best__[self.__fail__[node]]
+            candidates = [r for r in (own, inherited) if r is not None]
+            self.__best__[node] = min(candidates) if candidates else None
+
+    def __len__(self):
+        return len(self.__patterns__)
+
+    def __step__(self, node: int, char: str) -> int:
+        while node and char not in self.__goto__[node]:
+            node = self.__fail__[node]
+        return self.__goto__[node].get(char, 0)
+
+    def first_match(self, text: str) -> int:
+        """ Returns the rank of the first pattern (in list order) found in the text, or None"""
+        if not isinstance(text, str):
+            return None
+        best = self.__best__[0]
+        node = 0
+        for char in text:
+            if best == 0:
+                break
+            node = self.__step__(node, char)
+            rank = self.__best__[node]
+            if rank is not None and (best is None or rank < best):
+                best = rank
+        return best
+
+    def find_all(self, text: str) -> list[int]:
+        """ Returns the ranks of all the patterns found in the text, in list order"""
+        if not isinstance(text, str):
+            return []
+        found = set(self.__outputs__[0])
+        node = 0
+        for char in text:
+            node = self.__step__(node, char)
+            state = node
+            while state:
+                found.update(self.__outputs__[state])
+                state = self.__fail__[state]
+        return sorted(found)
+
+    def classify(self, text: str):
+        """ Returns the value of the first matching pattern, or the default value"""
+        rank = self.first_match(text)
+        return self.__default__ if rank is None else self.__values__[rank]
+
+    def classify_pattern(self, text: str) -> tuple:
+        """ Returns a tuple (pattern, value) for the first matching pattern, or (None, default value)"""
+        rank = self.first_match(text)
+        if rank is None:
+            return None, self.__default__
+        return self.__patterns__[rank], self.__values__[rank]
+
+    def match_series(self, texts: pd.Series) -> pd.Series:
+        """ Returns the rank of the first matching pattern for every text of the series (NaN if none).
+
+        Every distinct text is scanned only once."""
+        uniques = pd.unique(texts)
+        ranks = {t: self.first_match(t) for t in uniques}
+        return pd.Series([ranks[t] for t in texts], index=texts.index, dtype='float64')
+
+    def classify_series(self, texts: pd.Series) -> pd.Series:
+        """ Classifies a whole column of descriptions, returning the values of the first matching patterns"""
+        ranks = self.match_series(texts)
+        lookup = pd.Series(self.__values__, dtype='object')
+        result = lookup.reindex(ranks.fillna(-1).astype(int).values)
+        result.index = texts.index
+        return result.where(ranks.notna().values, self.__default__)
+
+    def pattern_series(self, texts: pd.Series) -> pd.Series:
+        """ Returns the first matching pattern for every text of the series (None if no match)"""
+        ranks = self.match_series(texts)
+        lookup = pd.Series(self.__patterns__, dtype='object')
+        result = lookup.reindex(ranks.fillna(-1).astype(int).values)
+        result.index = texts.index
+        return result.where(ranks.notna().values, None)
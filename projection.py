@@ -0,0 +1,132 @@
+""" A module dedicated to the projection of the account balances over the coming months.
+
+The projection starts from the balances of the daily ledger at the end of the start day, and adds, per account :
+- the open provisions : what remains of the provisions of a month and a category once the movements of that month are
+  deducted, booked on the first day of the month on the account paying this category the most often
+- the recurring flows (see recurring.find_recurrences) still active, on their expected dates and with their drift,
+  unless their category is provisioned for the month
+
+The events of all the accounts are summed per day and accumulated at once. The projections are cached per data
+version (see querycache)."""
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select, func, case
+from sqlalchemy.orm import Session
+
+import ledger
+from datamodel import Compte, Mouvement
+from querycache import query_cache
+from recurring import find_recurrences, PERIODICITIES
+
+# Years of history read to detect the recurring flows, and to find the account paying a category
+HISTORY_YEARS = 5
+
+# Columns of the projected events
+EVENT_COLUMNS = ['Compte', 'Date', 'Montant']
+
+
+def get_open_provisions(s: Session, first_month: date, last_month: date) -> pd.DataFrame:
+    """ Returns what remains of the provisions of every month and category, once the movements are deducted
+
+    :returns: a dataframe with the columns Mois, Catégorie, Montant (negative for an expense)"""
+    realised = Mouvement.compte != None
+    stmt = select(Mouvement.mois.label('Mois'), Mouvement.categorie.label('Catégorie'),
+                  func.sum(func.coalesce(Mouvement.provision_payer, 0)).label('Provision à payer'),
+                  func.sum(func.coalesce(Mouvement.provision_recuperer, 0)).label('Provision à récupérer'),
+                  func.sum(case((realised, func.coalesce(Mouvement.depense, 0)), else_=0)).label('Dépense'),
+                  func.sum(case((realised, func.coalesce(Mouvement.recette, 0)), else_=0)).label('Recette')).where(
+        Mouvement.date_out_of_bound == False, Mouvement.mois.between(first_month, last_month)).group_by(
+        Mouvement.mois, Mouvement.categorie)
+    df = pd.read_sql(stmt, s.connection(), coerce_float=True)
+    df = df[(df['Provision à payer'] > 0) | (df['Provision à récupérer'] > 0)]
+    remaining = ((df['Provision à récupérer'] - df['Recette']).clip(lower=0) -
+                 (df['Provision à payer'] - df['Dépense']).clip(lower=0))
+    return pd.DataFrame({'Mois': pd.to_datetime(df['Mois']), 'Catégorie': df['Catégorie'],
+                         'Montant': remaining.astype(float)}, columns=['Mois', 'Catégorie', 'Montant'])
+
+
+def get_paying_accounts(s: Session, first_date: date) -> pd.Series:
+    """ Returns the account holding most of the movements of every category since first_date"""
+    stmt = select(Mouvement.categorie, Mouvement.compte, func.count().label('count')).where(
+        Mouvement.date_out_of_bound == False, Mouvement.compte != None, Mouvement.date >= first_date).group_by(
+        Mouvement.categorie, Mouvement.compte)
+    df = pd.DataFrame(s.execute(stmt).all(), columns=['categorie', 'compte', 'count'])
+    df = df.sort_values(['count', 'compte'], ascending=[False, True]).drop_duplicates('categorie')
+    return df.set_index('categorie')['compte']
+
+
+def get_recurring_events(recurrences: pd.DataFrame, start: date, end: date) -> pd.DataFrame:
+    """ Returns the occurrences of the recurrences after start, up to end, with their drifted amounts"""
+    if len(recurrences) == 0:
+        return pd.DataFrame(columns=EVENT_COLUMNS + ['Catégorie'])
+    steps = recurrences['Périodicité'].map(lambda p: PERIODICITIES[p][0]).to_numpy()
+    periods = recurrences['Périodicité'].map(lambda p: PERIODICITIES[p][1]).to_numpy()
+    last_dates = recurrences['Dernière date'].to_numpy().astype('datetime64[D]')
+    count = int((np.datetime64(end, 'M') - last_dates.astype('datetime64[M]')).astype(int).max())
+
+    # occurrence k of every recurrence : k steps after its last month, on the same day (or the last day of the month)
+    k = np.arange(1, max(count, 1) + 1)[None, :]
+    months = last_dates.astype('datetime64[M]')[:, None] + k * steps[:, None]
+    first_days = months.astype('datetime64[D]')
+    days_in_month = ((months + 1).astype('datetime64[D]') - first_days).astype(int)
+    day_of_month = (last_dates - last_dates.astype('datetime64[M]').astype('datetime64[D]')).astype(int)[:, None] + 1
+    dates = first_days + np.minimum(day_of_month, days_in_month) - 1
+
+    # amount on the trend, the expected amount being the one of the first occurrence
+    montants = recurrences['Montant'].to_numpy(dtype=float)[:, None]
+    drifted = montants + recurrences['Dérive annuelle'].to_numpy(dtype=float)[:, None] / 365.25 * (
+            (dates - last_dates[:, None]).astype(int) - periods[:, None])
+    amounts = np.where(np.sign(drifted) == np.sign(montants), drifted, montants)
+
+    within = (dates > np.datetime64(start, 'D')) & (dates <= np.datetime64(end, 'D'))
+    rows, _ = np.nonzero(within)
+    return pd.DataFrame({'Compte': recurrences['Compte'].to_numpy()[rows], 'Date': dates[within],
+                         'Montant': amounts[within], 'Catégorie': recurrences['Catégorie'].to_numpy()[rows]})
+
+
+@query_cache.cached()
+def get_projection(s: Session, compte_type: str, start: date, months: int = 12) -> pd.DataFrame:
+    """ Projects the daily balances of the active accounts of the type, from the day after start, for the given number
+    of months.
+
+    :returns: a dataframe indexed by Compte and Date (every day), with the columns Flux (the projected variation of
+        the day), Solde and Cumul (the variation since start), as get_grouped_transactions"""
+    end = start + relativedelta(months=months)
+    comptes = s.scalars(select(Compte.compte).where(Compte.compte_type == compte_type).where(
+        Compte.compte_actif == True).order_by(Compte.compte)).all()
+    opening = ledger.read_opening_balances(s, comptes, start + timedelta(days=1))
+    history_start = start - relativedelta(years=HISTORY_YEARS)
+
+    # open provisions, from the current month
+    provisions = get_open_provisions(s, start.replace(day=1), end.replace(day=1))
+    provisions['Compte'] = provisions['Catégorie'].map(get_paying_accounts(s, history_start))
+    provisions['Date'] = provisions['Mois'].clip(lower=pd.Timestamp(start + timedelta(days=1)))
+
+    # recurring flows, unless their category is provisioned for the month
+    recurrences = find_recurrences(s, first_date=history_start, reference_date=start)
+    recurrences = recurrences[recurrences['Active'] & recurrences['Compte'].isin(comptes)]
+    flows = get_recurring_events(recurrences, start, end)
+    flows['Mois'] = pd.to_datetime(flows['Date']).dt.to_period('M').dt.to_timestamp()
+    provisioned = pd.MultiIndex.from_frame(provisions[['Mois', 'Catégorie']])
+    flows = flows[~pd.MultiIndex.from_frame(flows[['Mois', 'Catégorie']]).isin(provisioned)]
+
+    # daily sums, then running balances from the opening balances
+    events = pd.concat([provisions[EVENT_COLUMNS], flows[EVENT_COLUMNS]], ignore_index=True)
+    events = events[events['Compte'].isin(comptes)].astype({'Montant': float})
+    events['Date'] = pd.to_datetime(events['Date'])
+    all_dates = pd.date_range(start=start + timedelta(days=1), end=end, freq='D')
+    full_index = pd.MultiIndex.from_product([comptes, all_dates], names=['Compte', 'Date'])
+    df = events.groupby(['Compte', 'Date'])[['Montant']].sum().reindex(full_index, fill_value=0.0)
+    df = df.rename(columns={'Montant': 'Flux'})
+    df['Cumul'] = df.groupby(level='Compte')['Flux'].cumsum().round(2)
+    df['Solde'] = (df['Cumul'] + opening.reindex(df.index.get_level_values('Compte')).values).round(2)
+    return df[['Flux', 'Solde', 'Cumul']]
+
+
+def project_balances(s: Session, compte_type: str, months: int = 12, start: date = None) -> pd.DataFrame:
+    """ Projects the daily balances of the accounts of the type from today (or start), see get_projection"""
+    ledger.sync_daily_balances(s)
+    return get_projection(s, compte_type, start or date.today(), months)
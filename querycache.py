@@ -0,0 +1,178 @@
+""" A cache of the results of the read functions, keyed by their arguments and by a global data version.
+
+The data version is bumped by every commit of a session having written to the database : a flush (new jobs,
+movements...) or an ORM-enabled INSERT / UPDATE / DELETE statement. The update version is only bumped by the commits
+having modified or deleted rows : the structures refreshed job by job (see cube) are reloaded then.
+
+The commits of another process (GUI, CLI, Streamlit) are not seen by these events : the shared cache also keys the
+results by the last job id of the database, read by an indexed max(job_id) on every call, so that the new jobs of the
+other processes are seen at once. Their updates without new job are seen once the results reach their max_age,
+DEFAULT_MAX_AGE by default."""
+import functools
+import threading
+import time
+from typing import Callable
+
+import pandas as pd
+from sqlalchemy import event, inspect, select, func
+from sqlalchemy.orm import Session
+
+from datamodel import Job
+
+# Seconds after which a cached result is read again, for the updates of the other processes
+DEFAULT_MAX_AGE = 60.0
+
+
+class DataVersion:
+    """ A counter bumped on every committed write"""
+
+    def __init__(self):
+        self.__lock__ = threading.Lock()
+        self.__value__ = 0
+
+    @property
+    def value(self) -> int:
+        return self.__value__
+
+    def bump(self):
+        with self.__lock__:
+            self.__value__ += 1
+
+
+data_version = DataVersion()
+update_version = DataVersion()
+
+
+@event.listens_for(Session, 'after_flush')
+def mark_flush(session: Session, flush_context):
+    session.info['data_changed'] = True
+    if session.dirty or session.deleted:
+        session.info['data_updated'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def mark_statement(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['data_changed'] = True
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['data_updated'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def bump_on_commit(session: Session):
+    if session.info.pop('data_updated', False):
+        update_version.bump()
+    if session.info.pop('data_changed', False):
+        data_version.bump()
+
+
+def make_key(value):
+    """ Converts the lists, sets and dictionaries of the arguments to hashable tuples"""
+    if isinstance(value, (list, tuple)):
+        return tuple(make_key(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(make_key(v) for v in value))
+    if isinstance(value, dict):
+        return tuple(sorted((k, make_key(v)) for k, v in value.items()))
+    hash(value)
+    return value
+
+
+def copy_result(result):
+    """ Returns a copy of a cached result, so that the callers cannot modify the cache"""
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+    if isinstance(result, list):
+        return list(result)
+    return result
+
+
+def get_last_job_id(s: Session) -> int:
+    """ Returns the last job of the database, the version of the writes of every process"""
+    return s.scalar(select(func.max(Job.job_id)))
+
+
+class QueryCache:
+    """ Holds the results of the decorated read functions for the current data version.
+
+    The first argument of the decorated functions must be a Session : it is not part of the key, except for the
+    url of the database it is bound to. The ORM objects returned are detached from the session, so that they stay
+    readable once the session is closed.
+
+    :param external_version: a function of the session returning a version of the database, part of the key"""
+
+    def __init__(self, max_entries: int = 256, external_version: Callable[[Session], object] = None):
+        self.__lock__ = threading.Lock()
+        self.__max_entries__ = max_entries
+        self.__external_version__ = external_version
+        self.__version__ = data_version.value
+        self.__entries__ = {}
+        self.__hits__ = 0
+        self.__misses__ = 0
+
+    def clear(self):
+        with self.__lock__:
+            self.__entries__.clear()
+
+    def statistics(self) -> dict:
+        return {'version': self.__version__, 'entries': len(self.__entries__), 'hits': self.__hits__,
+                'misses': self.__misses__}
+
+    def __lookup__(self, key, max_age: float):
+        with self.__lock__:
+            if self.__version__ != data_version.value:
+                self.__entries__.clear()
+                self.__version__ = data_version.value
+            entry = self.__entries__.get(key)
+            if entry is not None and (max_age is None or time.monotonic() - entry[0] <= max_age):
+                self.__hits__ += 1
+                return entry
+            self.__misses__ += 1
+            return None
+
+    def __store__(self, key, version: int, result):
+        with self.__lock__:
+            if version != data_version.value or version != self.__version__:
+                return
+            if len(self.__entries__) >= self.__max_entries__:
+                self.__entries__.pop(next(iter(self.__entries__)))
+            self.__entries__[key] = (time.monotonic(), result)
+
+    def cached(self, max_age: float = DEFAULT_MAX_AGE):
+        """ Decorator caching the results of a read function, for max_age seconds at most (None : no limit)"""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(s: Session, *args, **kwargs):
+                version = data_version.value
+                if s.info.get('data_changed') or s.new or s.dirty or s.deleted:
+                    # the session sees its own uncommitted writes
+                    return function(s, *args, **kwargs)
+                try:
+                    key = (function.__qualname__, str(s.get_bind().url), make_key(args), make_key(kwargs))
+                except TypeError:
+                    # unhashable arguments : no caching
+                    return function(s, *args, **kwargs)
+
+                if self.__external_version__ is not None:
+                    key += (self.__external_version__(s),)
+                entry = self.__lookup__(key, max_age)
+                if entry is not None:
+                    return copy_result(entry[1])
+
+                result = function(s, *args, **kwargs)
+                if isinstance(result, (list, tuple)):
+                    for item in result:
+                        state = inspect(item, raiseerr=False)
+                        if state is not None and state.session is s:
+                            s.expunge(item)
+                self.__store__(key, version, result)
+                return copy_result(result)
+
+            return wrapper
+
+        return decorator
+
+
+# The cache shared by the whole process
+query_cache = QueryCache(external_version=get_last_job_id)
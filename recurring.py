@@ -0,0 +1,194 @@
+""" A module dedicated to the detection of recurring transactions (subscriptions, insurance, rent...), to seed the
+provisions of a year.
+
+The movements are grouped by description, the dates, numbers and references being ignored ('PRLV SEPA NETFLIX 0124'
+and 'PRLV SEPA NETFLIX 0224' are the same group), or by Classifier class. The whole history is processed at once : the
+intervals between the occurrences of a group and the trend of its amounts are computed with grouped aggregations,
+without any loop on the groups.
+
+A group recurs when the median interval between its occurrences is close to a month, a quarter or a year, and when
+most of its intervals are. Its drift is the yearly trend of its amount, found by a least squares fit.
+
+Only the bank movements are read : the movements derived from another one (splits, salary components, provisions)
+are left out, and a split or neutralised movement counts for its original amount."""
+import re
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func, case, or_
+from sqlalchemy.orm import Session
+
+from datamodel import Mouvement, Job
+from functions import insert_mouvements, get_groups, to_amount
+from matching import KeywordAutomaton
+from search import fold
+
+# Periodicities : (months between two occurrences, median interval in days, tolerance in days, minimum occurrences)
+PERIODICITIES = {'Mensuelle': (1, 30.4, 5, 6), 'Trimestrielle': (3, 91.3, 10, 4), 'Annuelle': (12, 365.25, 20, 3)}
+
+# Smallest share of the intervals of a group close to its periodicity
+REGULARITY_THRESHOLD = 0.7
+
+# Number of periods without occurrence after which a recurrence is considered as stopped
+MISSED_PERIODS = 2
+
+# Words holding digits (dates, numbers, references) are not part of the groups
+VARIABLE_WORDS = re.compile(r'\S*\d\S*')
+
+RECURRENCE_COLUMNS = ['Groupe', 'Catégorie', 'Compte', 'Périodicité', 'Occurrences', 'Première date', 'Dernière date',
+                      'Montant', 'Dérive annuelle', 'Active']
+
+
+def get_description_group(description: str) -> str:
+    """ Returns the description without case, accents, and words holding digits"""
+    return ' '.join(VARIABLE_WORDS.sub(' ', fold(description)).split())
+
+
+def get_history(s: Session, first_date: date = None) -> pd.DataFrame:
+    """ Returns the active movements of the accounts, with their signed (original) amount, the oldest first"""
+    amount = case((or_(Mouvement.recette_initiale != None, Mouvement.depense_initiale != None),
+                   func.coalesce(Mouvement.recette_initiale, 0) - func.coalesce(Mouvement.depense_initiale, 0)),
+                  else_=func.coalesce(Mouvement.recette, 0) - func.coalesce(Mouvement.depense, 0))
+    stmt = select(Mouvement.date.label('Date'), Mouvement.description.label('Description'),
+                  Mouvement.categorie.label('Catégorie'), Mouvement.compte.label('Compte'),
+                  amount.label('Montant')).outerjoin(Job, Mouvement.job_id == Job.job_id).where(
+        Mouvement.date_out_of_bound == False, Mouvement.compte != None, Mouvement.date != None,
+        Mouvement.index_parent == None, or_(Job.job_key == None, Job.job_key.notin_(Job.types_derived))).order_by(
+        Mouvement.date, Mouvement.index)
+    if first_date is not None:
+        stmt = stmt.where(Mouvement.date >= first_date)
+    return pd.read_sql(stmt, s.connection())
+
+
+def get_group_series(s: Session, descriptions: pd.Series, by_classifier: bool) -> pd.Series:
+    """ Returns the group of every description : its Classifier class if by_classifier and any, else its
+    description group. Every distinct description is processed once"""
+    codes, uniques = pd.factorize(descriptions.fillna(''))
+    groups = pd.Series([get_description_group(d) for d in uniques], dtype='object')
+    if by_classifier:
+        classifier = KeywordAutomaton.from_dataframe(get_groups(s), 'patterns', 'classes')
+        groups = classifier.classify_series(pd.Series(uniques, dtype='object')).fillna(groups)
+    return pd.Series(groups.to_numpy()[codes], index=descriptions.index)
+
+
+def detect_recurrences(df: pd.DataFrame, groups: pd.Series, reference_date: date = None) -> pd.DataFrame:
+    """ Detects the recurring groups of movements
+
+    :param df: the movements, sorted by date, as returned by get_history
+    :param groups: the group of every movement
+    :param reference_date: the date from which the recurrences still active are judged, the last movement by default
+    :returns: one row per recurring group, with the columns RECURRENCE_COLUMNS. 'Montant' is the amount expected at the
+        next occurrence (negative for an expense), 'Dérive annuelle' the yearly trend of the amount"""
+    df = df.assign(Groupe=groups.to_numpy(), Jour=pd.to_datetime(df['Date']).to_numpy().astype('datetime64[D]').astype(
+        np.int64), Montant=df['Montant'].astype(float))
+    df = df[df['Groupe'] != ''].sort_values(['Groupe', 'Jour'], kind='stable')
+    if reference_date is None:
+        reference_date = df['Date'].max() if len(df) else date.today()
+    reference_day = np.datetime64(reference_date, 'D').astype(np.int64)
+
+    # intervals between consecutive occurrences of a group
+    grouped = df.groupby('Groupe', sort=False)
+    intervals = grouped['Jour'].diff()
+    median = intervals.groupby(df['Groupe']).median()
+
+    # least squares fit of the amounts, per group : slope = cov(t, a) / var(t)
+    t = (df['Jour'] - grouped['Jour'].transform('mean')).astype(float)
+    a = df['Montant'] - grouped['Montant'].transform('mean')
+    fit = pd.DataFrame({'ta': t * a, 'tt': t * t, 'Groupe': df['Groupe']}).groupby('Groupe').sum()
+    slope = (fit['ta'] / fit['tt'].replace(0, np.nan)).fillna(0)
+
+    summary = grouped.agg(**{'Occurrences': ('Jour', 'size'), 'Premier': ('Jour', 'first'),
+                             'Dernier': ('Jour', 'last'), 'Catégorie': ('Catégorie', 'last'),
+                             'Compte': ('Compte', 'last'), 'Dernier montant': ('Montant', 'last')})
+    summary['Médiane'] = median
+    summary['Pente'] = slope
+    summary['Périodicité'] = None
+    for name, (months, days, tolerance, minimum) in PERIODICITIES.items():
+        regular = (intervals - days).abs() <= tolerance
+        regularity = regular.groupby(df['Groupe']).sum() / (summary['Occurrences'] - 1).replace(0, np.nan)
+        matches = ((summary['Médiane'] - days).abs() <= tolerance) & (summary['Occurrences'] >= minimum) & (
+                regularity >= REGULARITY_THRESHOLD) & summary['Périodicité'].isna()
+        summary.loc[matches, 'Périodicité'] = name
+        summary.loc[matches, 'Période'] = days
+    summary = summary[summary['Périodicité'].notna()]
+
+    # expected amount at the next occurrence, on the trend but not beyond a sign change
+    expected = summary['Dernier montant'] + summary['Pente'] * summary['Période']
+    expected = expected.where(np.sign(expected) == np.sign(summary['Dernier montant']), summary['Dernier montant'])
+
+    result = pd.DataFrame({
+        'Groupe': summary.index,
+        'Catégorie': summary['Catégorie'].to_numpy(),
+        'Compte': summary['Compte'].to_numpy(),
+        'Périodicité': summary['Périodicité'].to_numpy(),
+        'Occurrences': summary['Occurrences'].to_numpy(),
+        'Première date': summary['Premier'].to_numpy().astype('datetime64[D]'),
+        'Dernière date': summary['Dernier'].to_numpy().astype('datetime64[D]'),
+        'Montant': expected.round(2).to_numpy(),
+        'Dérive annuelle': (summary['Pente'] * 365.25).round(2).to_numpy(),
+        'Active': (reference_day - summary['Dernier'] <= summary['Période'] * MISSED_PERIODS).to_numpy()})
+    return result[RECURRENCE_COLUMNS].sort_values(['Catégorie', 'Groupe'], ignore_index=True)
+
+
+def find_recurrences(s: Session, first_date: date = None, by_classifier: bool = False,
+                     reference_date: date = None) -> pd.DataFrame:
+    """ Detects the recurring transactions of the history, see detect_recurrences"""
+    df = get_history(s, first_date)
+    return detect_recurrences(df, get_group_series(s, df['Description'], by_classifier), reference_date)
+
+
+def get_provision_months(recurrence: pd.Series, year: int) -> list[date]:
+    """ Returns the months of the year in which the recurrence is expected"""
+    months = PERIODICITIES[recurrence['Périodicité']][0]
+    last_month = pd.Timestamp(recurrence['Dernière date']).month
+    return [date(year, m, 1) for m in range(1, 13) if (m - last_month) % months == 0]
+
+
+def propose_provisions(recurrences: pd.DataFrame, year: int, active_only: bool = True) -> list[dict]:
+    """ Proposes the provisions of the year for the recurrences, in the format of generate_provision : one provision
+    per expected occurrence, the amount following the drift of the recurrence
+
+    :returns: dictionaries of Mouvement attributes, to be inserted by insert_provisions"""
+    if active_only:
+        recurrences = recurrences[recurrences['Active']]
+    rows = []
+    for _, r in recurrences.iterrows():
+        last_date = pd.Timestamp(r['Dernière date']).date()
+        for mois in get_provision_months(r, year):
+            # the amount at the last occurrence is 'Montant' minus one period of drift
+            period = PERIODICITIES[r['Périodicité']][1]
+            amount = r['Montant'] + r['Dérive annuelle'] / 365.25 * ((mois - last_date).days - period)
+            if np.sign(amount) != np.sign(r['Montant']):
+                amount = r['Montant']
+            rows.append(dict(date=date(year, 1, 1),
+                             description=r['Groupe'],
+                             categorie=r['Catégorie'],
+                             mois=mois,
+                             date_insertion=date.today(),
+                             provision_payer=to_amount(-amount) if amount < 0 else None,
+                             provision_recuperer=to_amount(amount) if amount > 0 else None,
+                             no=0))
+    return rows
+
+
+def remove_existing_provisions(s: Session, rows: list[dict]) -> list[dict]:
+    """ Returns the proposed provisions of the categories having no provision yet in their year, so that saving the
+    proposal twice does not double the budget"""
+    years = {r['mois'].year for r in rows}
+    if not years:
+        return rows
+    stmt = select(Mouvement.categorie, Mouvement.mois).where(
+        Mouvement.date_out_of_bound == False, Mouvement.mois >= date(min(years), 1, 1),
+        Mouvement.mois <= date(max(years), 12, 1),
+        or_(Mouvement.provision_payer != None, Mouvement.provision_recuperer != None)).distinct()
+    existing = {(categorie, mois.year) for categorie, mois in s.execute(stmt)}
+    return [r for r in rows if (r['categorie'], r['mois'].year) not in existing]
+
+
+def insert_provisions(s: Session, rows: list[dict]) -> list[int]:
+    """ Inserts the proposed provisions under a single provision job. The caller commits.
+
+    :returns: the indexes of the provisions"""
+    job = Job(job_key=Job.type_provision, job_timestamp=datetime.now())
+    return insert_mouvements(s, job, rows)
@@ -0,0 +1,114 @@
+""" An in-process registry of the keyword tables (classifiers and map_categories).
+
+The tables are read once and kept together with prebuilt lookup structures, until a write invalidates them."""
+import threading
+
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from datamodel import Classifier, MapCategorie
+from matching import KeywordAutomaton
+
+# Separator used to concatenate the keywords, it cannot be found in a keyword
+KEY_SEPARATOR = '\x00'
+
+
+def is_active(values: dict) -> bool:
+    """ A map is active when its flag 'inactif' is explicitly false, as in SQL"""
+    return values['inactif'] == False
+
+
+class KeywordRegistry:
+    """ Holds the classifiers and the category maps, with a version stamp.
+
+    Every write to the classifiers or map_categories tables must call invalidate(). The tables are then
+    reloaded on the next read."""
+
+    def __init__(self):
+        self.__lock__ = threading.RLock()
+        self.__version__ = 0
+        self.__groups__ = None
+        self.__group_classifier__ = None
+        self.__maps__ = None
+        self.__map_automaton__ = None
+        self.__joined_keys__ = None
+        self.__joined_active_keys__ = None
+
+    @property
+    def version(self) -> int:
+        return self.__version__
+
+    def invalidate(self):
+        """ Drops the loaded tables and bumps the version"""
+        with self.__lock__:
+            self.__version__ += 1
+            self.__groups__ = None
+            self.__group_classifier__ = None
+            self.__maps__ = None
+            self.__map_automaton__ = None
+            self.__joined_keys__ = None
+            self.__joined_active_keys__ = None
+
+    def __load_groups__(self, s: Session):
+        with self.__lock__:
+            if self.__groups__ is None:
+                stmt = select(Classifier.patterns, Classifier.classes).order_by(Classifier.classes)
+                self.__groups__ = pd.read_sql(stmt, s.connection())
+                self.__group_classifier__ = KeywordAutomaton.from_dataframe(self.__groups__, 'patterns', 'classes',
+                                                                            'Common')
+
+    def __load_maps__(self, s: Session):
+        with self.__lock__:
+            if self.__maps__ is None:
+                stmt = select(MapCategorie.keyword, MapCategorie.categorie, MapCategorie.declarant,
+                              MapCategorie.organisme, MapCategorie.monthshift, MapCategorie.inactif,
+                              MapCategorie.employeur).order_by(MapCategorie.categorie)
+                self.__maps__ = [dict(row) for row in s.execute(stmt).mappings()]
+                keys = [m['keyword'] for m in self.__maps__]
+                self.__map_automaton__ = KeywordAutomaton(keys)
+                self.__joined_keys__ = KEY_SEPARATOR.join(keys)
+                self.__joined_active_keys__ = KEY_SEPARATOR.join([m['keyword'] for m in self.__maps__
+                                                                  if is_active(m)])
+
+    def get_groups(self, s: Session) -> pd.DataFrame:
+        """ Returns a copy of the classifiers, as a dataframe with two columns : patterns, and classes"""
+        self.__load_groups__(s)
+        return self.__groups__.copy()
+
+    def get_group_classifier(self, s: Session) -> KeywordAutomaton:
+        """ Returns the automaton classifying descriptions into classes ('Common' by default)"""
+        self.__load_groups__(s)
+        return self.__group_classifier__
+
+    def get_maps(self, s: Session, active_only: bool = False) -> list[MapCategorie]:
+        """ Returns new (transient) MapCategorie objects, ordered by catégorie"""
+        self.__load_maps__(s)
+        return [MapCategorie(**m) for m in self.__maps__ if not active_only or is_active(m)]
+
+    def get_matching_maps(self, s: Session, description: str) -> list[MapCategorie]:
+        """ Returns the maps whose keyword can be found in the description"""
+        self.__load_maps__(s)
+        return [MapCategorie(**self.__maps__[rank]) for rank in self.__map_automaton__.find_all(description)]
+
+    def find_conflicting_maps(self, s: Session, keyword: str, active_only: bool) -> list[MapCategorie]:
+        """ Returns the maps whose keyword contains, or is contained in, the given keyword"""
+        if not self.is_conflicting(s, keyword, active_only):
+            return []
+        return [MapCategorie(**m) for m in self.__maps__
+                if (not active_only or is_active(m)) and (m['keyword'] in keyword or keyword in m['keyword'])]
+
+    def is_conflicting(self, s: Session, keyword: str, active_only: bool = False) -> bool:
+        """ Checks quickly if a keyword contains, or is contained in, an existing keyword"""
+        self.__load_maps__(s)
+        if len(self.__maps__) == 0:
+            return False
+        joined = self.__joined_active_keys__ if active_only else self.__joined_keys__
+        if keyword in joined:
+            return True
+        contained = self.__map_automaton__.find_all(keyword)
+        return any(not active_only or is_active(self.__maps__[rank]) for rank in contained)
+
+
+# The registry shared by the whole process
+keyword_registry = KeywordRegistry()
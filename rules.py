@@ -0,0 +1,122 @@
+""" A module dedicated to the application of the category maps (table map_categories) to the imported movements.
+
+Only the movements of the import jobs are mapped : the splits, provisions, salaries... keep their values. Every map
+keeps, in map_categories_etat, the range of jobs it was applied to (after first_job_id, up to last_job_id) : a run only
+reads the movements of the newer jobs. A map seen for the first time starts at the last job, and is only applied to
+the next imports, unless the whole history is explicitly rescanned. The movements are matched against all the active
+maps at once (see matching.KeywordAutomaton), and updated in bulk by primary key.
+
+A movement is mapped by its most specific (longest) map only, and left alone when this map has already seen its job.
+It gets the catégorie of the map, as well as its déclarant, organisme and employeur when they are set. When the map
+has a monthshift, the mois of the movement is shifted by it, once : a rescan does not shift again the movements of the
+range of jobs the map has already been applied to."""
+from datetime import datetime
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select, func, update
+from sqlalchemy.orm import Session
+
+from datamodel import Mouvement, Job, MapCategorie, MapCategorieEtat
+from matching import KeywordAutomaton
+
+# Number of movements read, or updated, at once
+CHUNK_SIZE = 5_000
+
+# Columns of the movements set by a map
+MAPPED_ATTRIBUTES = ['categorie', 'declarant', 'organisme', 'employeur']
+
+
+def get_active_maps(s: Session) -> list[MapCategorie]:
+    """ Returns the active maps, the most specific (longest) keywords first"""
+    maps = s.scalars(select(MapCategorie).where(MapCategorie.inactif == False)).all()
+    return sorted(maps, key=lambda m: (-len(m.keyword), m.keyword))
+
+
+def get_mapped_values(m: MapCategorie, mois, shift: bool = True) -> dict:
+    """ Returns the values given by a map to a movement of the given month"""
+    values = {'categorie': m.categorie}
+    for attribute in MAPPED_ATTRIBUTES[1:]:
+        if getattr(m, attribute) is not None:
+            values[attribute] = getattr(m, attribute)
+    if shift and m.monthshift is not None and mois is not None:
+        values['mois'] = mois + relativedelta(months=int(m.monthshift))
+    return values
+
+
+def apply_category_maps(s: Session, rescan: bool = False, job_id: int = None) -> dict:
+    """ Applies the active maps to the imported movements of the jobs they have not seen yet (of all the jobs if
+    rescan), then moves their watermark to the last job. The caller commits.
+
+    :param job_id: the import job just inserted : every map is applied to it, and to the older jobs it has not seen
+        yet (the manual entries since its last run), not to the newer jobs
+    :returns: the number of movements matched by every map"""
+    maps = get_active_maps(s)
+    last_job_id = s.scalar(select(func.max(Job.job_id)))
+    if not maps or last_job_id is None:
+        return {}
+    states = {e.keyword: e for e in s.scalars(select(MapCategorieEtat).where(
+        MapCategorieEtat.keyword.in_([m.keyword for m in maps])))}
+    # the range of jobs (first, last] seen by every map, empty for the new maps, which start at the last job (at the
+    # previous one for a single job)
+    start = last_job_id if job_id is None else job_id - 1
+    seen = [(states[m.keyword].first_job_id or 0, states[m.keyword].last_job_id) if m.keyword in states else
+            (start, start) for m in maps]
+    if job_id is not None:
+        last_job_id = job_id
+    watermarks = [None if rescan else last for _, last in seen]
+
+    automaton = KeywordAutomaton([m.keyword for m in maps])
+    stmt = select(Mouvement.index, Mouvement.description, Mouvement.job_id, Mouvement.mois,
+                  *[getattr(Mouvement, a) for a in MAPPED_ATTRIBUTES]).join(
+        Job, Mouvement.job_id == Job.job_id).where(
+        Job.job_key == Job.type_import, Mouvement.date_out_of_bound == False, Mouvement.job_id <= last_job_id)
+    if None not in watermarks:
+        stmt = stmt.where(Mouvement.job_id > min(watermarks))
+
+    hits = {m.keyword: 0 for m in maps}
+    changes = []
+    matches = {}
+    for rows in s.execute(stmt).mappings().partitions(CHUNK_SIZE):
+        for row in rows:
+            description = row['description']
+            if description not in matches:
+                matches[description] = automaton.first_match(description) if description else None
+            rank = matches[description]
+            # the shorter maps never override the best one, even when it has already seen the job
+            if rank is None or (watermarks[rank] is not None and row['job_id'] <= watermarks[rank]):
+                continue
+            hits[maps[rank].keyword] += 1
+            # the months already shifted by the map are not shifted again
+            first, last = seen[rank]
+            values = get_mapped_values(maps[rank], row['mois'], not first < row['job_id'] <= (last or 0))
+            if any(row[k] != v for k, v in values.items()):
+                changes.append({'index': row['index'], **values})
+
+    # ORM bulk update by primary key
+    for i in range(0, len(changes), CHUNK_SIZE):
+        s.execute(update(Mouvement), changes[i:i + CHUNK_SIZE])
+
+    now = datetime.now()
+    for m in maps:
+        state = states.get(m.keyword)
+        if state is None:
+            state = MapCategorieEtat(keyword=m.keyword, first_job_id=start, hits=0)
+            s.add(state)
+        if rescan:
+            state.first_job_id = 0
+        state.last_job_id = max(last_job_id, state.last_job_id or last_job_id)
+        state.hits = (state.hits or 0) + hits[m.keyword]
+        state.last_hits = hits[m.keyword]
+        state.last_run = now
+    s.flush()
+    return hits
+
+
+def get_rule_statistics(s: Session) -> pd.DataFrame:
+    """ Returns the maps with their watermark and hit counts, the maps never applied having no watermark"""
+    stmt = select(MapCategorie.keyword, MapCategorie.categorie, MapCategorie.inactif, MapCategorieEtat.last_job_id,
+                  MapCategorieEtat.hits, MapCategorieEtat.last_hits, MapCategorieEtat.last_run).outerjoin(
+        MapCategorieEtat, MapCategorie.keyword == MapCategorieEtat.keyword).order_by(
+        MapCategorieEtat.hits.desc().nulls_last(), MapCategorie.keyword)
+    return pd.read_sql(stmt, s.connection())
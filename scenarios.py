@@ -0,0 +1,104 @@
+""" Comparison of loan scenarios, for instance when renegotiating a mortgage.
+
+Every combination of rate, duration, insurance and early repayment is evaluated, the schedules being computed by
+interests.compute_schedules for a whole chunk of combinations at once. The chunks are spread over the CPU cores.
+
+When the current loan is given, the cost of the renegotiation (fees and early repayment penalty) is compared to the
+monthly savings, which gives the month from which the renegotiation pays off."""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from interests import compute_schedules, annuity
+
+# Number of combinations evaluated at once by a process
+CHUNK_SIZE = 2_000
+
+# Indemnités de remboursement anticipé : 6 mois d'intérêts, dans la limite de 3 % du capital restant dû
+PENALTY_MONTHS = 6
+PENALTY_CAP = 0.03
+
+SCENARIO_COLUMNS = ['Taux', 'Durée', 'Assurance', 'Remboursement anticipé']
+METRIC_COLUMNS = ['Mensualité', 'Mensualité assurance', 'Intérêts totaux', 'Assurance totale', 'Coût total']
+RENEGOTIATION_COLUMNS = ['Économie mensuelle', 'Gain net', 'Mois de rentabilité']
+
+
+def get_combinations(rates, durations, insurance_rates, prepayments) -> np.ndarray:
+    """ Returns every combination of the parameters, one per row, in the order of SCENARIO_COLUMNS"""
+    grid = np.meshgrid(np.asarray(rates, dtype=float), np.asarray(durations, dtype=float),
+                       np.asarray(insurance_rates, dtype=float), np.asarray(prepayments, dtype=float), indexing='ij')
+    return np.stack([g.ravel() for g in grid], axis=1)
+
+
+def get_renegotiation_cost(due: float, current_rate: float, fees: float) -> float:
+    """ Returns the fees and the early repayment penalty of the current loan"""
+    return fees + min(due * current_rate / 12 * PENALTY_MONTHS, due * PENALTY_CAP)
+
+
+def evaluate_chunk(combinations: np.ndarray, due: float, prepayment_month: int, current_rate: float = None,
+                   current_months: int = None, current_insurance: float = 0.0, cost: float = 0.0) -> np.ndarray:
+    """ Computes the metrics of a chunk of combinations
+
+    :returns: one row per combination, in the order of METRIC_COLUMNS (and RENEGOTIATION_COLUMNS if the current
+        loan is given)"""
+    rates, durations, insurance_rates, prepayments = combinations.T
+    durations = durations.astype(int)
+    schedules = compute_schedules(durations, due, rates, prepayments={prepayment_month: prepayments})
+    insurance = due * insurance_rates / 12
+    insurance_total = insurance * durations
+    interests_total = schedules['Intérêts'].sum(axis=1)
+    metrics = [schedules['Mensualité'][:, 0], insurance, interests_total, insurance_total,
+               interests_total + insurance_total]
+
+    if current_rate is not None:
+        horizon = max(schedules['Mensualité'].shape[1], current_months)
+        months = np.arange(horizon)
+        current = np.where(months < current_months,
+                           annuity(due, current_rate / 12, np.asarray(current_months)) + current_insurance, 0)
+        new = np.zeros((len(combinations), horizon))
+        new[:, :schedules['Mensualité'].shape[1]] = schedules['Mensualité'] + schedules['Remboursement anticipé']
+        new += np.where(months[None, :] < durations[:, None], insurance[:, None], 0)
+        savings = np.cumsum(current[None, :] - new, axis=1) - cost
+        paid_off = savings >= 0
+        metrics += [current[0] - new[:, 0], savings[:, -1],
+                    np.where(paid_off.any(axis=1), paid_off.argmax(axis=1) + 1, np.nan)]
+
+    return np.stack(metrics, axis=1)
+
+
+def evaluate_scenarios(due: float, rates, durations, insurance_rates=(0.0,), prepayments=(0.0,),
+                       prepayment_month: int = 12, current_rate: float = None, current_months: int = None,
+                       current_insurance: float = 0.0, fees: float = 0.0, workers: int = None) -> pd.DataFrame:
+    """ Evaluates every combination of the rates, durations (months), yearly insurance rates (on the initial
+    capital) and early repayments (made at prepayment_month).
+
+    When current_rate and current_months are given, due is the capital remaining on the current loan, which is
+    renegotiated : the fees and the penalty of the current loan are compared to the cumulated monthly savings.
+
+    :param workers: number of processes, all the CPU cores by default. The small sweeps are evaluated in process
+    :returns: one row per combination, with the columns SCENARIO_COLUMNS, METRIC_COLUMNS and, for a renegotiation,
+        RENEGOTIATION_COLUMNS ('Mois de rentabilité' is the month from which the renegotiation pays off, NaN if it
+        never does)"""
+    if (current_rate is None) != (current_months is None):
+        raise ValueError('current_rate and current_months must be given together')
+    combinations = get_combinations(rates, durations, insurance_rates, prepayments)
+    cost = get_renegotiation_cost(due, current_rate, fees) if current_rate is not None else 0.0
+    evaluate = partial(evaluate_chunk, due=due, prepayment_month=prepayment_month, current_rate=current_rate,
+                       current_months=current_months, current_insurance=current_insurance, cost=cost)
+
+    chunks = [combinations[i:i + CHUNK_SIZE] for i in range(0, len(combinations), CHUNK_SIZE)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers <= 1:
+        results = [evaluate(c) for c in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(evaluate, chunks))
+
+    columns = METRIC_COLUMNS + (RENEGOTIATION_COLUMNS if current_rate is not None else [])
+    df = pd.DataFrame(combinations, columns=SCENARIO_COLUMNS)
+    df['Durée'] = df['Durée'].astype(int)
+    df[columns] = np.concatenate(results) if results else np.empty((0, len(columns)))
+    return df
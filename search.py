@@ -0,0 +1,210 @@
+""" A module dedicated to the search of the movements by their labels (Description and Label utilisateur).
+
+The search is accent and case insensitive : 'cafe' finds 'Café', 'societe generale' finds 'SOCIÉTÉ GÉNÉRALE'.
+
+- on PostgreSQL, the folded labels are indexed by a trigram GIN index (extensions pg_trgm and unaccent), which serves
+  the LIKE '%term%' conditions, and the results are ranked by the trigram similarity. The extensions, the folding
+  function and the index are created on the first search when missing
+- on the other databases (SQLite backups), or when they cannot be created, an in-memory index of the trigrams of the
+  folded labels is built on the first search, and rebuilt after every committed write
+
+The two labels are joined by a line feed, which a term cannot hold : a term is never found across them."""
+import threading
+import unicodedata
+
+import pandas as pd
+from sqlalchemy import select, func, bindparam
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from datamodel import Mouvement
+from querycache import data_version
+
+SEARCH_INDEX = 'mouvements_labels_trgm'
+UNACCENT_FUNCTION = 'finance_unaccent'
+
+# The former index, on the labels joined by a space
+FORMER_SEARCH_INDEX = 'mouvements_search_trgm'
+
+# Separator of the labels in the searched document
+FIELD_SEPARATOR = '\n'
+
+# Number of rows read at once when the in-memory index is built
+CHUNK_SIZE = 50_000
+
+
+def fold(text: str) -> str:
+    """ Lower case, without accents nor ligatures ('Œuvre Café' -> 'oeuvre cafe')"""
+    if text is None:
+        return ''
+    text = unicodedata.normalize('NFKD', text.lower().replace('œ', 'oe').replace('æ', 'ae'))
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def trigrams(text: str) -> set:
+    """ Returns the trigrams of the words of a folded text, as pg_trgm computes them"""
+    result = set()
+    for word in ''.join(c if c.isalnum() else ' ' for c in text).split():
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(term: str, document: str) -> float:
+    """ Share of the trigrams common to the term and the document, as the function similarity of pg_trgm"""
+    term_trigrams = trigrams(term)
+    document_trigrams = trigrams(document)
+    if not term_trigrams or not document_trigrams:
+        return 0.0
+    return len(term_trigrams & document_trigrams) / len(term_trigrams | document_trigrams)
+
+
+def substrings(text: str) -> set:
+    """ Returns the sliding trigrams of a text, which must all be found in the texts containing it"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def fold_term(term: str) -> str:
+    """ The folded term, without the separator of the labels"""
+    return fold(term).replace(FIELD_SEPARATOR, ' ')
+
+
+# The PostgreSQL databases, per url, whose search index exists (True) or cannot be created (False)
+indexed_databases = {}
+
+
+def is_indexed(s: Session) -> bool:
+    """ Checks if the database of the session has the search index, creating it on the first call"""
+    bind = s.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return False
+    url = str(bind.engine.url)
+    if url not in indexed_databases:
+        try:
+            create_search_index(bind)
+            indexed_databases[url] = True
+        except DBAPIError:
+            # missing privileges or extensions : the in-memory index is used
+            indexed_databases[url] = False
+    return indexed_databases[url]
+
+
+def search_document():
+    """ The folded labels of a movement, as indexed on PostgreSQL"""
+    return func.finance_unaccent(func.lower(
+        func.coalesce(Mouvement.description, '') + FIELD_SEPARATOR + func.coalesce(Mouvement.label_utilisateur, '')))
+
+
+def create_search_index(bind):
+    """ Creates the extensions, the folding function and the trigram index of the labels, if missing.
+
+    Nothing is done on databases other than PostgreSQL, which use the in-memory index"""
+    if bind.engine.dialect.name != 'postgresql':
+        return
+    with bind.engine.begin() as connection:
+        connection.exec_driver_sql('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        connection.exec_driver_sql('CREATE EXTENSION IF NOT EXISTS unaccent')
+        # unaccent is only stable : an immutable wrapper is needed to be used in an index
+        connection.exec_driver_sql(
+            f"CREATE OR REPLACE FUNCTION {UNACCENT_FUNCTION}(text) RETURNS text "
+            f"LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS $$ SELECT public.unaccent('public.unaccent', $1) $$")
+        connection.exec_driver_sql(f'DROP INDEX IF EXISTS {FORMER_SEARCH_INDEX}')
+        connection.exec_driver_sql(
+            f'CREATE INDEX IF NOT EXISTS {SEARCH_INDEX} ON {Mouvement.__tablename__} USING gin '
+            f'(({UNACCENT_FUNCTION}(lower(coalesce("Description", \'\') || E\'\\n\' || '
+            f'coalesce("Label utilisateur", \'\')))) gin_trgm_ops)')
+
+
+class NgramIndex:
+    """ The in-memory trigram index of the folded labels of the active movements, for one database"""
+
+    def __init__(self):
+        self.__lock__ = threading.Lock()
+        self.__version__ = None
+        self.__documents__ = {}
+        self.__postings__ = {}
+
+    def __build__(self, s: Session):
+        documents = {}
+        postings = {}
+        stmt = select(Mouvement.index, Mouvement.description, Mouvement.label_utilisateur).where(
+            Mouvement.date_out_of_bound == False)
+        result = s.connection().execution_options(stream_results=True).execute(stmt)
+        for rows in result.partitions(CHUNK_SIZE):
+            for index, description, label in rows:
+                document = FIELD_SEPARATOR.join([fold(description), fold(label)])
+                documents[index] = document
+                for trigram in substrings(document):
+                    postings.setdefault(trigram, []).append(index)
+        self.__documents__ = documents
+        self.__postings__ = postings
+
+    def refresh(self, s: Session):
+        """ Rebuilds the index if data was committed since the last build"""
+        with self.__lock__:
+            if self.__version__ != data_version.value:
+                version = data_version.value
+                self.__build__(s)
+                # a session with uncommitted writes sees data the other sessions do not see
+                self.__version__ = None if s.info.get('data_changed') else version
+
+    def lookup(self, term: str) -> dict:
+        """ Returns the folded labels of the movements containing the folded term, per index"""
+        with self.__lock__:
+            keys = substrings(term)
+            if keys:
+                # the movements having the rarest trigram of the term are the only candidates
+                candidates = min((self.__postings__.get(k, []) for k in keys), key=len)
+            else:
+                # one or two characters : no trigram to look up
+                candidates = self.__documents__.keys()
+            return {i: self.__documents__[i] for i in candidates if term in self.__documents__[i]}
+
+    def __len__(self):
+        return len(self.__documents__)
+
+
+# The in-memory indexes of the process, per database url
+ngram_indexes = {}
+ngram_indexes_lock = threading.Lock()
+
+
+def get_ngram_index(s: Session) -> NgramIndex:
+    """ Returns the up-to-date in-memory index of the database of the session"""
+    key = str(s.get_bind().url)
+    with ngram_indexes_lock:
+        if key not in ngram_indexes:
+            ngram_indexes[key] = NgramIndex()
+        index = ngram_indexes[key]
+    index.refresh(s)
+    return index
+
+
+def search_condition(s: Session, term: str):
+    """ Returns the condition selecting the movements whose labels contain the term, accents and case ignored"""
+    term = fold_term(term)
+    if is_indexed(s):
+        return search_document().contains(term, autoescape=True)
+    matches = get_ngram_index(s).lookup(term)
+    return Mouvement.index.in_(bindparam('search_indexes', sorted(matches), expanding=True, literal_execute=True))
+
+
+def search_mouvements(s: Session, term: str, limit: int = 50) -> pd.DataFrame:
+    """ Returns the active movements whose labels contain the term, the most similar first
+
+    :returns: a dataframe with the columns index, Description, Label utilisateur, Date, rank"""
+    term = fold_term(term)
+    columns = [Mouvement.index, Mouvement.description, Mouvement.label_utilisateur, Mouvement.date]
+    if is_indexed(s):
+        rank = func.similarity(term, search_document()).label('rank')
+        stmt = select(*columns, rank).where(Mouvement.date_out_of_bound == False,
+                                            search_document().contains(term, autoescape=True)).order_by(
+            rank.desc(), Mouvement.index.desc()).limit(limit)
+        return pd.read_sql(stmt, s.connection())
+
+    matches = get_ngram_index(s).lookup(term)
+    ranks = sorted(((similarity(term, document), index) for index, document in matches.items()), reverse=True)[:limit]
+    stmt = select(*columns).where(Mouvement.index.in_([index for _, index in ranks]))
+    df = pd.read_sql(stmt, s.connection())
+    df['rank'] = df['index'].map({index: rank for rank, index in ranks}).astype('float64')
+    return df.sort_values(['rank', 'index'], ascending=False, ignore_index=True)
@@ -3,10 +3,10 @@ from distutils.core import setup
 setup(
     name='sqlalchemyProject',
     version='',
-    packages=['tests', 'finance_cli', 'finance_gui', 'finance_orm_cli', 'finance_streamlit'],
+    packages=['tests', 'finance_cli', 'finance_gui', 'finance_orm_cli', 'finance_streamlit', 'benchmarks'],
     url='',
     license='',
     author='vincent scherrer',
     author_email='',
-    description='', requires=['pysimplegui', 'matplotlib', 'sqlalchemy', 'pandas', 'streamlit', 'plotly']
+    description='', requires=['pysimplegui', 'matplotlib', 'sqlalchemy', 'pandas', 'streamlit', 'plotly', 'pyarrow']
 )
@@ -0,0 +1,146 @@
+""" A module dedicated to the columnar (Parquet) snapshot of the finance database, for the analytical pages.
+
+The movements, joined with their categories and jobs, are written partitioned by year and month of the column Mois,
+and the rows of view_bilans_agregation partitioned by year. A read filtering on the partition columns only opens
+the matching files, and the other filters are pushed down to the row groups.
+
+Parquet files are written and read by pyarrow, through pandas."""
+import json
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from sqlalchemy.types import Numeric, Float, Integer, Boolean, Date, DateTime
+
+from datamodel import Mouvement, Categorie, Job, Classifier, ViewBilansAgregation
+
+SNAPSHOT_ROOT = Path.home().joinpath('FinanceSnapshots')
+
+# Datasets of the snapshot
+MOUVEMENTS = 'mouvements'
+BILANS = 'bilans'
+CATEGORIES = 'categories'
+CLASSIFIERS = 'classifiers'
+INFO = 'snapshot.json'
+
+# Partition columns
+ANNEE = 'annee'
+MOIS = 'mois'
+
+# Number of rows read from the database at once
+CHUNK_SIZE = 100_000
+
+
+def get_mouvements_statement(s: Session):
+    """ The movements joined with their category and job, the columns missing in an older database (Empreinte before
+    the first import) being left out"""
+    existing = {c['name'] for c in sqlalchemy.inspect(s.connection()).get_columns(Mouvement.__tablename__)}
+    return select(*[c for c in Mouvement.__table__.columns if c.name in existing], Categorie.categorie_groupe,
+                  Categorie.categorie_order,
+                  Categorie.provision_type, Job.job_key, Job.job_timestamp).outerjoin(
+        Categorie, Mouvement.categorie == Categorie.categorie).outerjoin(Job, Mouvement.job_id == Job.job_id)
+
+
+def set_dtypes(df: pd.DataFrame, stmt) -> pd.DataFrame:
+    """ Gives every column the same dtype in every chunk, whatever its values"""
+    for column in stmt.selected_columns:
+        name = column.name
+        if isinstance(column.type, (Numeric, Float)):
+            df[name] = df[name].astype('float64')
+        elif isinstance(column.type, Boolean):
+            df[name] = df[name].astype('boolean')
+        elif isinstance(column.type, Integer):
+            df[name] = df[name].astype('Int64')
+        elif isinstance(column.type, (Date, DateTime)):
+            df[name] = pd.to_datetime(df[name])
+        else:
+            df[name] = df[name].astype('string')
+    return df
+
+
+def add_partitions(df: pd.DataFrame, date_column: str, monthly: bool) -> pd.DataFrame:
+    df[ANNEE] = df[date_column].dt.year.fillna(0).astype('int32')
+    if monthly:
+        df[MOIS] = df[date_column].dt.month.fillna(0).astype('int32')
+    return df
+
+
+def export_query(s: Session, stmt, path: Path, date_column: str, monthly: bool) -> int:
+    """ Writes the result of a query to a partitioned dataset, chunk by chunk
+
+    :returns: the number of rows written"""
+    count = 0
+    for df in pd.read_sql(stmt, s.connection(), chunksize=CHUNK_SIZE):
+        df = add_partitions(set_dtypes(df, stmt), date_column, monthly)
+        df.to_parquet(path, partition_cols=[ANNEE, MOIS] if monthly else [ANNEE], index=False)
+        count += len(df)
+    return count
+
+
+def export_snapshot(s: Session, root: Path = SNAPSHOT_ROOT) -> dict:
+    """ Writes a new snapshot, which replaces the previous one once complete.
+
+    The view view_bilans_agregation is only exported when it exists (PostgreSQL).
+
+    :returns: the number of rows per dataset"""
+    root = Path(root)
+    work = root.with_name(root.name + '.new')
+    if work.exists():
+        shutil.rmtree(work)
+    work.mkdir(parents=True)
+
+    counts = {MOUVEMENTS: export_query(s, get_mouvements_statement(s), work.joinpath(MOUVEMENTS), 'Mois', True)}
+
+    if s.get_bind().dialect.name == 'postgresql' and sqlalchemy.inspect(s.connection()).has_table(
+            ViewBilansAgregation.__tablename__, schema=ViewBilansAgregation.__table__.schema):
+        counts[BILANS] = export_query(s, select(ViewBilansAgregation.__table__), work.joinpath(BILANS), 'Mois',
+                                      False)
+
+    for name, stmt in [(CATEGORIES, select(Categorie.__table__)), (CLASSIFIERS, select(Classifier.__table__))]:
+        df = set_dtypes(pd.read_sql(stmt, s.connection()), stmt)
+        df.to_parquet(work.joinpath(f'{name}.parquet'), index=False)
+        counts[name] = len(df)
+
+    info = {'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'last_job_id': s.scalar(select(func.max(Job.job_id))), 'counts': counts}
+    work.joinpath(INFO).write_text(json.dumps(info, indent=2))
+
+    if root.exists():
+        shutil.rmtree(root)
+    work.rename(root)
+    return counts
+
+
+def get_snapshot_info(root: Path = SNAPSHOT_ROOT) -> dict:
+    """ Returns the timestamp, last job and row counts of the snapshot"""
+    return json.loads(Path(root).joinpath(INFO).read_text())
+
+
+def period_filters(period_begin, period_end) -> list:
+    """ Returns the filters selecting the months from period_begin (included) to period_end (excluded)"""
+    years = list(range(period_begin.year, period_end.year + 1))
+    return [(ANNEE, 'in', years), ('Mois', '>=', pd.Timestamp(period_begin)), ('Mois', '<', pd.Timestamp(period_end))]
+
+
+def read_mouvements(root: Path = SNAPSHOT_ROOT, columns: list = None, filters: list = None) -> pd.DataFrame:
+    """ Reads the movements of the snapshot.
+
+    :param filters: pyarrow filters, e.g. [('annee', '==', 2025), ('Catégorie', '==', 'Courses')]"""
+    return pd.read_parquet(Path(root).joinpath(MOUVEMENTS), columns=columns, filters=filters)
+
+
+def read_bilans(root: Path = SNAPSHOT_ROOT, columns: list = None, filters: list = None) -> pd.DataFrame:
+    """ Reads the rows of view_bilans_agregation of the snapshot"""
+    path = Path(root).joinpath(BILANS)
+    if not path.exists():
+        raise KeyError(f'the snapshot {root} has no {BILANS} dataset')
+    return pd.read_parquet(path, columns=columns, filters=filters)
+
+
+def read_table(name: str, root: Path = SNAPSHOT_ROOT) -> pd.DataFrame:
+    """ Reads one of the small tables of the snapshot (categories, classifiers)"""
+    return pd.read_parquet(Path(root).joinpath(f'{name}.parquet'))
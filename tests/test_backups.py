@@ -0,0 +1,76 @@
+from datetime import date, datetime
+from unittest import TestCase
+
+from sqlalchemy import create_engine, select, func, update, insert
+
+from backups import backup_database, incremental_backup, get_table_checksum, get_block_checksums, \
+    get_stored_checksums
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import Mouvement, Job
+
+
+class TestBackupDatabase(TestCase):
+    def setUp(self) -> None:
+        self.source = create_engine('sqlite://')
+        create_synthetic_database(self.source, 1500)
+        self.target = create_engine('sqlite://')
+
+    def test_backup(self):
+        progress = []
+        copied = backup_database(self.source, self.target, chunk_size=400,
+                                 progress=lambda table, done, total: progress.append((table.name, done, total)))
+        self.assertEqual(1500, copied['comptes'])
+        self.assertIn(('comptes', 1500, 1500), progress)
+        self.assertEqual(4, len([p for p in progress if p[0] == 'comptes']))
+        with self.target.connect() as connection:
+            self.assertEqual(1500, connection.scalar(select(func.count(Mouvement.index))))
+
+    def test_incremental_backup(self):
+        incremental_backup(self.source, self.target, progress=None)
+        with self.source.begin() as connection:
+            connection.execute(update(Mouvement).where(Mouvement.index == 150).values(date_out_of_bound=True))
+        written = incremental_backup(self.source, self.target, block_size=100, progress=None)
+        self.assertEqual(100, written['comptes'])
+        with self.source.connect() as source, self.target.connect() as target:
+            self.assertEqual(get_table_checksum(source, Mouvement.__table__),
+                             get_table_checksum(target, Mouvement.__table__))
+
+    def test_stored_checksums(self):
+        incremental_backup(self.source, self.target, block_size=100, progress=None)
+        with self.source.begin() as connection:
+            job_id = connection.execute(insert(Job.__table__).values(
+                job_key=Job.type_import, job_timestamp=datetime(2030, 5, 2)).returning(Job.job_id)).scalar()
+            values = dict(index=20_000, date=date(2030, 3, 9), description='CB LIDL', categorie='Courses',
+                          compte='Crédit Agricole', depense=30, economie='false', mois=date(2030, 3, 1),
+                          date_insertion=date(2030, 3, 9), no=20_000, job_id=job_id, date_out_of_bound=False)
+            connection.execute(insert(Mouvement.__table__).values(
+                {getattr(Mouvement, k).name: v for k, v in values.items()}))
+            connection.execute(update(Mouvement).where(Mouvement.index == 150).values(date_out_of_bound=True))
+        # the new movement, then the block of the modified one
+        written = incremental_backup(self.source, self.target, block_size=100, progress=None)
+        self.assertEqual(101, written['comptes'])
+        self.assertEqual(1, written['jobs'])
+        written = incremental_backup(self.source, self.target, block_size=100, progress=None)
+        self.assertEqual(0, sum(written.values()))
+        with self.source.connect() as source, self.target.connect() as target:
+            self.assertEqual(get_table_checksum(source, Mouvement.__table__),
+                             get_table_checksum(target, Mouvement.__table__))
+            # the checksums compared by the next backup
+            self.assertEqual(get_block_checksums(source, 100), {block: checksum for (table, block), checksum in
+                                                                 get_stored_checksums(target, 100).items()
+                                                                 if table == 'comptes'})
+
+    def test_older_databases(self):
+        with self.source.begin() as connection:
+            connection.exec_driver_sql('DROP INDEX comptes_empreinte_idx')
+            connection.exec_driver_sql('ALTER TABLE comptes DROP COLUMN "Empreinte"')
+        self.assertEqual(1500, incremental_backup(self.source, self.target, progress=None)['comptes'])
+        # the source gets the column, not the backup
+        with self.source.begin() as connection:
+            connection.exec_driver_sql('ALTER TABLE comptes ADD COLUMN "Empreinte" VARCHAR(32)')
+            connection.execute(update(Mouvement).where(Mouvement.index == 150).values(date_out_of_bound=True))
+        with self.target.begin() as connection:
+            connection.exec_driver_sql('DROP INDEX comptes_empreinte_idx')
+            connection.exec_driver_sql('ALTER TABLE comptes DROP COLUMN "Empreinte"')
+        written = incremental_backup(self.source, self.target, block_size=100, progress=None)
+        self.assertEqual(100, written['comptes'])
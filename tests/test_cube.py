@@ -0,0 +1,144 @@
+from datetime import date, datetime
+from unittest import TestCase, mock
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, insert, update, select
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import create_synthetic_database
+from cube import aggregate_cube
+from datamodel import Mouvement, Job, Categorie
+from functions import get_provisions_for_month, get_yearly_realise, get_yearly_bilan, deactivate_transactions
+
+
+class TestAggregateCube(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        create_synthetic_database(self.engine, 10, years=1)
+        aggregate_cube.invalidate()
+        # groceries : 400 provisioned in March, 150 spent ; 300 provisioned in April, 350 spent
+        # a salary of 2000, and 500 saved on the savings account
+        self.insert([(date(2030, 3, 1), 'Provision courses', 'Courses', None, None, None, 400, None),
+                     (date(2030, 3, 3), 'CB CARREFOUR', 'Courses', 'Crédit Agricole', None, 150, None, None),
+                     (date(2030, 4, 1), 'Provision courses', 'Courses', None, None, None, 300, None),
+                     (date(2030, 4, 5), 'CB CARREFOUR', 'Courses', 'Crédit Agricole', None, 350, None, None),
+                     (date(2030, 3, 28), 'VIR SALAIRE', 'Salaire', 'Crédit Agricole', 2000, None, None, None),
+                     (date(2030, 3, 29), 'VIR EPARGNE', 'Banque', 'Livret A', 500, None, None, 'true')])
+
+    def insert(self, rows: list, first_index: int = 10_000) -> int:
+        with Session(self.engine) as session:
+            job = Job(job_key=Job.type_import, job_timestamp=datetime(2030, 5, 1))
+            session.add(job)
+            session.flush()
+            session.execute(insert(Mouvement), [
+                dict(index=first_index + i, date=d, description=desc, categorie=categorie, compte=compte,
+                     recette=recette, depense=depense, provision_payer=provision, economie=economie or 'false',
+                     mois=d.replace(day=1), date_insertion=d, no=first_index + i, job_id=job.job_id,
+                     date_out_of_bound=False) for i, (d, desc, categorie, compte, recette, depense, provision, economie)
+                in enumerate(rows)])
+            session.commit()
+            return job.job_id
+
+    def month(self, month: date, is_courant: bool = True):
+        with Session(self.engine) as session:
+            return get_provisions_for_month(session, month, is_courant).set_index('Catégorie')
+
+    def test_month(self):
+        df = self.month(date(2030, 3, 1))
+        self.assertEqual(['Banque', 'Courses', 'Salaire'], sorted(df.index))
+        self.assertEqual((150, 400, 250), tuple(df.loc['Courses', ['Dépense', 'Dépense Provisionnée',
+                                                                    'Dépense Reste']]))
+        self.assertEqual((-150, -400), tuple(df.loc['Courses', ['Solde sans provisions', 'Solde avec provisions']]))
+        self.assertEqual(0, df.loc['Banque', 'Recette'])
+        # the savings balances hold both modes
+        df = self.month(date(2030, 3, 1), is_courant=False)
+        self.assertEqual((500, 500), tuple(df.loc['Banque', ['Recette', 'Solde sans provisions']]))
+        self.assertEqual(2000, df.loc['Salaire', 'Solde sans provisions'])
+        # an exceeded provision leaves nothing
+        self.assertEqual(0, self.month(date(2030, 4, 1)).loc['Courses', 'Dépense Reste'])
+        self.assertEqual(0, len(self.month(date(2031, 1, 1))))
+
+    def test_incremental_refresh(self):
+        self.month(date(2030, 3, 1))
+        job_id = self.insert([(date(2030, 3, 10), 'CB LIDL', 'Courses', 'Crédit Agricole', None, 50, None, None),
+                              (date(2031, 2, 2), 'CB LIDL', 'Loyer', 'Crédit Agricole', None, 900, None, None)],
+                             first_index=11_000)
+        df = self.month(date(2030, 3, 1))
+        self.assertEqual(job_id, aggregate_cube.last_job_id)
+        self.assertEqual((200, 200), tuple(df.loc['Courses', ['Dépense', 'Dépense Reste']]))
+        self.assertEqual(900, self.month(date(2031, 2, 1)).loc['Loyer', 'Dépense'])
+
+    def test_reload_after_update(self):
+        self.month(date(2030, 3, 1))
+        with Session(self.engine) as session:
+            deactivate_transactions(session, [10_001])
+        df = self.month(date(2030, 3, 1))
+        self.assertEqual((0, 400), tuple(df.loc['Courses', ['Dépense', 'Dépense Reste']]))
+
+    def test_reload_after_external_write(self):
+        self.month(date(2030, 3, 1))
+        # a reassignment by another process, unseen by the session events, keeping the totals
+        with self.engine.begin() as connection:
+            connection.execute(update(Mouvement.__table__).where(Mouvement.__table__.c.index == 10_001).values(
+                {Mouvement.categorie.name: 'Loyer'}))
+        self.assertEqual(150, self.month(date(2030, 3, 1)).loc['Courses', 'Dépense'])
+        with mock.patch('cube.MAX_AGE', 0):
+            df = self.month(date(2030, 3, 1))
+        self.assertEqual((0, 400, 150), (df.loc['Courses', 'Dépense'], df.loc['Courses', 'Dépense Reste'],
+                                         df.loc['Loyer', 'Dépense']))
+
+    def test_other_process_jobs(self):
+        self.month(date(2030, 3, 1))
+        with self.engine.begin() as connection:
+            job_id = connection.execute(insert(Job.__table__).values(
+                job_key=Job.type_import, job_timestamp=datetime(2030, 5, 2)).returning(Job.job_id)).scalar()
+            values = dict(index=12_000, date=date(2030, 3, 9), description='CB LIDL', categorie='Courses',
+                          compte='Crédit Agricole', depense=30, economie='false', mois=date(2030, 3, 1),
+                          date_insertion=date(2030, 3, 9), no=12_000, job_id=job_id, date_out_of_bound=False)
+            connection.execute(insert(Mouvement.__table__).values(
+                {getattr(Mouvement, k).name: v for k, v in values.items()}))
+        self.assertEqual(180, self.month(date(2030, 3, 1)).loc['Courses', 'Dépense'])
+
+    def test_parity(self):
+        engine = create_engine('sqlite://')
+        create_synthetic_database(engine, 3000, years=2)
+        aggregate_cube.invalidate()
+        # the figures of view_bilans_agregation, from the movements
+        columns = [Mouvement.mois, Mouvement.categorie, Mouvement.economie, Mouvement.recette, Mouvement.depense,
+                   Mouvement.provision_recuperer, Mouvement.provision_payer]
+        with Session(engine) as session:
+            rows = pd.DataFrame(session.execute(select(*columns).where(Mouvement.date_out_of_bound == False)).all(),
+                                columns=['mois', 'categorie', 'economie', 'Recette', 'Dépense',
+                                         'Recette Provisionnée', 'Dépense Provisionnée']).fillna(0)
+            amounts = ['Recette', 'Dépense', 'Recette Provisionnée', 'Dépense Provisionnée']
+            rows[amounts] = rows[amounts].astype(float)
+            rows.loc[rows['economie'] == 'true', amounts] = 0
+            sums = rows.groupby(['mois', 'categorie'])[amounts].sum()
+            for month in pd.unique(rows['mois'])[:6]:
+                expected = sums.loc[month]
+                df = get_provisions_for_month(session, month).set_index('Catégorie')
+                self.assertEqual(sorted(expected.index), sorted(df.index))
+                for measure in ['Recette', 'Dépense']:
+                    remaining = (expected[f'{measure} Provisionnée'] - expected[measure]).clip(lower=0)
+                    self.assertTrue(np.allclose(expected[measure], df.loc[expected.index, measure]), month)
+                    self.assertTrue(np.allclose(remaining, df.loc[expected.index, f'{measure} Reste']), month)
+
+    def test_yearly_realise(self):
+        with Session(self.engine) as session:
+            df = get_yearly_realise(session, False, True, False, 'Courses', 2030)
+            self.assertEqual(['Mois', 'Dépense'], list(df.columns))
+            self.assertEqual([date(2030, 3, 1), date(2030, 4, 1)], df['Mois'].tolist())
+            self.assertEqual([150, 350], df['Dépense'].tolist())
+            df = get_yearly_realise(session, True, True, False, 'Courses', 2030)
+            self.assertEqual([400, 300], df['Dépense Provisionnée'].tolist())
+            self.assertEqual([500], get_yearly_realise(session, False, False, True, 'Banque', 2030)['Recette'].tolist())
+
+    def test_yearly_bilan(self):
+        with Session(self.engine) as session:
+            df = get_yearly_bilan(session, 2031, True).set_index(Categorie.categorie.name)
+        # realised amounts plus the remaining provisions of 2030
+        self.assertEqual(400 + 350, df.loc['Courses', 'Dépense Courante 2030'])
+        self.assertEqual(2000, df.loc['Salaire', 'Recette Courante 2030'])
+        self.assertEqual(0, df.loc['Courses', 'Dépense Courante 2031'])
+        self.assertEqual('⚠️', df.loc['Courses', 'Statut Dépense 2031'])
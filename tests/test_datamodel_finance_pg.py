@@ -2,13 +2,14 @@ import datetime
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
+import numpy as np
 import pandas as pd
-from sqlalchemy import select
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
 
 from datamodel import LabelPrettifier, ViewBilansAgregation, Mouvement
 from functions import get_categorized_provisions, get_events, get_solde, get_salaries, get_max_number, get_balances, \
-    get_jobs, get_numeros_reference
+    get_jobs, get_numeros_reference, get_provisions_for_month
 from engines import get_pgfin_engine
 from datetime import date, timedelta
 
@@ -89,6 +90,22 @@ class TestViewBilans(TestCase):
 
         print(vb)
 
+    def test_cube_parity(self):
+        e = get_pgfin_engine()
+        v = ViewBilansAgregation
+        with Session(e) as session:
+            month = session.scalar(select(func.max(v.Mois)))
+            view = pd.read_sql(select(v.Catégorie, v.Recette_Courante, v.Dépense_Courante,
+                                      v.Recette_Courante_Provisionnée_restante,
+                                      v.Dépense_Courante_Provisionnée_non_épuisée).where(v.Mois == month),
+                               session.connection()).set_index('Catégorie').fillna(0)
+            cube = get_provisions_for_month(session, month).set_index('Catégorie')
+        view = view[view.abs().sum(axis=1) > 0]
+        for column, measure in [('Recette Courante', 'Recette'), ('Dépense Courante', 'Dépense'),
+                                ('Recette Courante Provisionnée restante', 'Recette Reste'),
+                                ('Dépense Courante Provisionnée non épuisée', 'Dépense Reste')]:
+            self.assertTrue(np.allclose(view[column], cube.reindex(view.index)[measure].fillna(0)), measure)
+
 
 class TestPrettifier(TestCase):
     def test_prettifier(self):
@@ -0,0 +1,71 @@
+from datetime import date, datetime
+from unittest import TestCase
+
+from sqlalchemy import create_engine, insert, select, func
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import Mouvement, Job
+from duplicates import find_duplicates, deactivate_duplicates
+from functions import split_mouvement
+
+
+class TestDuplicates(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        create_synthetic_database(self.engine, 10)
+        rows = [
+            # exact duplicate
+            (5000, date(2030, 3, 2), 'CB MONOPRIX PARIS 02/03', None, 'Crédit Agricole', 45.2),
+            (5001, date(2030, 3, 2), 'CB  Monoprix Paris 02/03', None, 'Crédit Agricole', 45.2),
+            # manual entry, imported two days later
+            (5002, date(2030, 3, 5), 'Facture EDF', 'Electricité mars', 'Crédit Agricole', 61),
+            (5003, date(2030, 3, 7), 'PRLV SEPA EDF', 'Electricité mars', 'Crédit Agricole', 61),
+            # same amount, different merchant
+            (5004, date(2030, 3, 7), 'CB BOULANGERIE PAUL', None, 'Crédit Agricole', 61),
+            # too late
+            (5005, date(2030, 3, 20), 'PRLV SEPA EDF', None, 'Crédit Agricole', 61),
+            # other account
+            (5006, date(2030, 3, 2), 'CB MONOPRIX PARIS 02/03', None, 'Boursorama', 45.2),
+        ]
+        with Session(self.engine) as session:
+            job = Job(job_key=Job.type_import, job_timestamp=datetime(2030, 3, 21))
+            session.add(job)
+            session.flush()
+            session.execute(insert(Mouvement), [
+                dict(index=i, date=d, description=desc, label_utilisateur=label, compte=compte, depense=amount,
+                     categorie='Courses', mois=d.replace(day=1), date_insertion=d, no=i, job_id=job.job_id,
+                     date_out_of_bound=False) for i, d, desc, label, compte, amount in rows])
+            session.commit()
+
+    def find(self, **options):
+        with Session(self.engine) as session:
+            df = find_duplicates(session, first_date=date(2030, 1, 1), **options)
+        return df.set_index('index')
+
+    def test_find_duplicates(self):
+        df = self.find()
+        self.assertEqual([5003, 5001], df.index.tolist())
+        self.assertEqual((5000, 'exact', 0, 1.0), tuple(df.loc[5001, ['Original', 'Type', 'Écart (jours)',
+                                                                       'Similarité']]))
+        self.assertEqual((5002, 'fuzzy', 2), tuple(df.loc[5003, ['Original', 'Type', 'Écart (jours)']]))
+
+    def test_options(self):
+        df = self.find(across_accounts=True)
+        self.assertEqual([5003, 5006, 5001], df.index.tolist())
+        self.assertEqual(5000, df.loc[5006, 'Original'])
+        self.assertEqual([5001], self.find(max_days=1).index.tolist())
+
+    def test_deactivate_duplicates(self):
+        with Session(self.engine) as session:
+            count = deactivate_duplicates(session, find_duplicates(session, first_date=date(2030, 1, 1)))
+            self.assertEqual(2, count)
+            self.assertEqual(0, len(find_duplicates(session, first_date=date(2030, 1, 1))))
+            self.assertEqual(5, session.scalar(select(func.count()).where(
+                Mouvement.index >= 5000, Mouvement.date_out_of_bound == False)))
+
+    def test_split_ignored(self):
+        with Session(self.engine) as session:
+            split_mouvement(session, 5005, mode='custom', periods=12)
+            session.commit()
+        self.assertEqual([5003, 5001], self.find().index.tolist())
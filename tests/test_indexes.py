@@ -0,0 +1,36 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+import indexes
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import Mouvement
+
+
+class TestIndexes(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        create_synthetic_database(self.engine, 1000)
+
+    def test_create_missing_indexes(self):
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('DROP INDEX comptes_actifs_categorie_mois_idx')
+            connection.exec_driver_sql('DROP INDEX comptes_job_idx')
+        self.assertEqual(['comptes_actifs_categorie_mois_idx', 'comptes_job_idx'],
+                         indexes.create_indexes(self.engine))
+        # idempotent
+        self.assertEqual([], indexes.create_indexes(self.engine))
+
+    def test_statistics(self):
+        df = indexes.get_index_statistics(self.engine)
+        declared = df.loc[df['declared'], 'index'].tolist()
+        self.assertEqual(sorted(i.name for i in Mouvement.__table__.indexes), declared)
+
+    def test_partial_index_used(self):
+        stmt = select(Mouvement.index).where(Mouvement.date_out_of_bound == False,
+                                             Mouvement.categorie == 'Courses')
+        with Session(self.engine) as session:
+            compiled = stmt.compile(session.get_bind(), compile_kwargs={'literal_binds': True})
+            plan = session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}').all()
+        self.assertIn('comptes_actifs_categorie_mois_idx', ' '.join(str(r[-1]) for r in plan))
@@ -0,0 +1,160 @@
+import os
+import tempfile
+from datetime import date, datetime
+from unittest import TestCase
+
+from sqlalchemy import create_engine, select, func, insert
+from sqlalchemy.orm import Session, undefer
+
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import Mouvement, MapCategorie, Job
+from functions import split_mouvement, import_transaction
+import ingestion
+from ingestion import ingest_statement, read_statement, parse_amount, get_content_hash
+
+CSV_STATEMENT = """Date;Libellé;Débit;Crédit
+03/02/2026;CB   MONOPRIX PARIS;45,20;
+03/02/2026;CB   MONOPRIX PARIS;45,20;
+05/02/2026;VIR SALAIRE;;2 500,00
+07/02/2026;PRLV EDF;61,00;
+"""
+
+OFX_STATEMENT = """OFXHEADER:100
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20260203<TRNAMT>-45.20<NAME>CB MONOPRIX PARIS</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20260205120000<TRNAMT>2500.00<NAME>VIR SALAIRE<MEMO>FEVRIER</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+QIF_STATEMENT = """!Type:Bank
+D03/02/2026
+T-45.20
+PCB MONOPRIX PARIS
+^
+D05/02/2026
+T2,500.00
+PVIR SALAIRE
+^
+"""
+
+
+class TestIngestion(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        create_synthetic_database(self.engine, 100)
+        with Session(self.engine) as session:
+            session.execute(insert(MapCategorie).values(keyword='MONOPRIX', categorie='Courses', inactif=False))
+            session.commit()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write(self, name: str, content: str) -> str:
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='latin-1') as f:
+            f.write(content)
+        return path
+
+    def ingest(self, path: str) -> dict:
+        with Session(self.engine) as session:
+            statistics = ingest_statement(session, path, 'Crédit Agricole', 'Banque', chunk_size=2)
+            session.commit()
+        return statistics
+
+    def get_imported(self, job_id: int) -> list[Mouvement]:
+        with Session(self.engine) as session:
+            return session.scalars(select(Mouvement).where(Mouvement.job_id == job_id).order_by(
+                Mouvement.index).options(undefer(Mouvement.empreinte))).all()
+
+    def test_parse_amount(self):
+        self.assertEqual([1234.56, -1234.56, 12.5, 2500.0],
+                         [parse_amount(t) for t in ['1 234,56', '-1,234.56', '12.5', '+2500']])
+
+    def test_readers(self):
+        for name, content in [('s.csv', CSV_STATEMENT), ('s.ofx', OFX_STATEMENT), ('s.qif', QIF_STATEMENT)]:
+            rows = [r for chunk in read_statement(self.write(name, content)) for r in chunk.itertuples(index=False)]
+            self.assertEqual((date(2026, 2, 3), 'CB MONOPRIX PARIS', -45.2), tuple(rows[0]), name)
+            self.assertEqual(2500.0, rows[-2 if name == 's.csv' else -1].montant, name)
+        with self.assertRaises(ValueError):
+            read_statement('statement.xls')
+
+    def test_csv_import(self):
+        statistics = self.ingest(self.write('s.csv', CSV_STATEMENT))
+        self.assertEqual({'read': 4, 'duplicates': 0, 'inserted': 4}, {k: statistics[k] for k in
+                                                                       ['read', 'duplicates', 'inserted']})
+        imported = self.get_imported(statistics['job_id'])
+        # the identical payments of the same day are both kept
+        self.assertEqual(2, len({m.empreinte for m in imported[:2]}))
+        self.assertEqual(['Courses', 'Courses', 'Banque', 'Banque'], [m.categorie for m in imported])
+        self.assertEqual((2500, None, date(2026, 2, 1)), (imported[2].recette, imported[2].depense, imported[2].mois))
+        self.assertEqual(4, len({m.no for m in imported}))
+
+        # importing the same statement again inserts nothing
+        statistics = self.ingest(self.write('s.csv', CSV_STATEMENT))
+        self.assertEqual((4, 4, 0, None), (statistics['read'], statistics['duplicates'], statistics['inserted'],
+                                           statistics['job_id']))
+
+    def test_import_after_manual_entry(self):
+        self.ingest(self.write('s.ofx', OFX_STATEMENT))
+        with Session(self.engine) as session:
+            import_transaction(session, Mouvement(date=date(2026, 2, 4), description='MONOPRIX', depense=12,
+                                                  compte='Crédit Agricole', categorie='Banque',
+                                                  mois=date(2026, 2, 1), date_out_of_bound=False))
+            session.commit()
+        statistics = self.ingest(self.write('s.csv', CSV_STATEMENT.replace('03/02/2026', '13/02/2026')))
+        self.assertEqual(['Courses', 'Courses', 'Banque', 'Banque'],
+                         [m.categorie for m in self.get_imported(statistics['job_id'])])
+
+    def test_overlapping_formats(self):
+        self.ingest(self.write('s.ofx', OFX_STATEMENT.replace('<MEMO>FEVRIER', '')))
+        statistics = self.ingest(self.write('s.qif', QIF_STATEMENT.replace('D05/02', 'D06/02')))
+        self.assertEqual((1, 1), (statistics['duplicates'], statistics['inserted']))
+
+    def test_multiline_qif_fields(self):
+        path = self.write('s.qif', QIF_STATEMENT.replace('PVIR SALAIRE\n', 'PVIR SALAIRE\nMFEVRIER\nM2026\n'))
+        rows = [r for chunk in read_statement(path) for r in chunk.itertuples(index=False)]
+        self.assertEqual('VIR SALAIRE FEVRIER 2026', rows[1].description)
+
+    def insert_edf(self):
+        with Session(self.engine) as session:
+            job = Job(job_key=Job.type_import, job_timestamp=datetime(2026, 2, 8))
+            session.add(job)
+            session.flush()
+            session.execute(insert(Mouvement).values(
+                index=5000, date=date(2026, 2, 7), description='PRLV  EDF', depense=61, compte='Crédit Agricole',
+                categorie='Electricité', mois=date(2026, 2, 1), date_insertion=date(2026, 2, 8), no=5000,
+                job_id=job.job_id, date_out_of_bound=False))
+            session.commit()
+
+    def test_existing_movements_are_hashed(self):
+        self.insert_edf()
+
+        statistics = self.ingest(self.write('s.csv', CSV_STATEMENT))
+        self.assertEqual((1, 3), (statistics['duplicates'], statistics['inserted']))
+        with Session(self.engine) as session:
+            self.assertEqual(get_content_hash(date(2026, 2, 7), -61, 'PRLV EDF', 'Crédit Agricole', 0),
+                             session.get(Mouvement, 5000).empreinte)
+            self.assertEqual(1, session.scalar(select(func.count()).where(Mouvement.date == date(2026, 2, 7))))
+
+    def test_split_movements_are_hashed(self):
+        self.insert_edf()
+        with Session(self.engine) as session:
+            split_mouvement(session, 5000)
+            session.commit()
+        # the parent is recognized by its original amount, the sub-transactions are left aside
+        statistics = self.ingest(self.write('s.csv', CSV_STATEMENT))
+        self.assertEqual((1, 3), (statistics['duplicates'], statistics['inserted']))
+        with Session(self.engine) as session:
+            self.assertEqual(1, session.scalar(select(func.count()).where(Mouvement.empreinte != None,
+                                                                          Mouvement.date == date(2026, 2, 7))))
+
+    def test_older_database(self):
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('DROP INDEX comptes_empreinte_idx')
+            connection.exec_driver_sql('ALTER TABLE comptes DROP COLUMN "Empreinte"')
+        ingestion.checked_databases.discard(str(self.engine.url))
+        with Session(self.engine) as session:
+            self.assertIsNotNone(session.scalars(select(Mouvement)).first())
+        statistics = self.ingest(self.write('s.csv', CSV_STATEMENT))
+        self.assertEqual(4, statistics['inserted'])
@@ -1,7 +1,27 @@
 from datetime import timedelta
 from unittest import TestCase
 import datetime as dt
-from interests import generate_payment_schedule
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import Mouvement
+from functions import save_capital_reimbursements
+from interests import generate_payment_schedule, compute_schedules, get_reimbursement_scheme, schedule_dates
+
+
+def loop_schedule(nb_mois: int, due: float, rate: float) -> np.ndarray:
+    """ The month by month computation of the balances"""
+    monthly_payment = (due * rate / 12) / (1 - (1 + rate / 12) ** (-nb_mois))
+    balances = np.empty(nb_mois)
+    for i in range(nb_mois):
+        due -= monthly_payment - due * rate / 12
+        balances[i] = due
+    return balances
 
 
 class Test(TestCase):
@@ -13,3 +33,53 @@ class Test(TestCase):
         for d in df.index:
             print(d.year)
 
+    def test_same_as_loop(self):
+        df = generate_payment_schedule(dt.date(2025, 1, 1), 240, 200000, 0.035)
+        np.testing.assert_allclose(df['Capital Restant Dû'], np.round(loop_schedule(240, 200000, 0.035), 2), atol=0.01)
+        self.assertAlmostEqual(200000, df['Capital'].sum(), delta=0.5)
+        self.assertEqual(0, df['Capital Restant Dû'].iloc[-1])
+
+    def test_dates(self):
+        start_date = dt.date(2024, 1, 31)
+        expected = [start_date + relativedelta(months=i) for i in range(14)]
+        self.assertEqual(expected, [d.date() for d in schedule_dates(start_date, 14)])
+
+    def test_matrix(self):
+        schedules = compute_schedules([[180], [240]], [[100000]], [0.0, 0.02, 0.04])
+        self.assertEqual((2, 3, 240), schedules['Capital'].shape)
+        np.testing.assert_allclose(schedules['Capital'].sum(axis=-1), 100000)
+        # the shorter loans end after 180 months
+        self.assertEqual(0, schedules['Mensualité'][0, 1, 180:].sum())
+        np.testing.assert_allclose(schedules['Capital Restant Dû'][1, 2], loop_schedule(240, 100000, 0.04), atol=1e-6)
+
+    def test_deferral_rate_change_prepayment(self):
+        schedules = compute_schedules(120, 50000, 0.03, deferral=12, rate_changes={60: 0.01},
+                                      prepayments={24: 10000})
+        self.assertEqual(0, schedules['Capital'][:12].sum())
+        np.testing.assert_allclose(schedules['Intérêts'][:12], 50000 * 0.03 / 12)
+        self.assertEqual(10000, schedules['Remboursement anticipé'][24])
+        self.assertLess(schedules['Mensualité'][24], schedules['Mensualité'][23])
+        self.assertLess(schedules['Mensualité'][60], schedules['Mensualité'][59])
+        self.assertAlmostEqual(50000, schedules['Capital'].sum(), places=6)
+
+        capitalized = compute_schedules(120, 50000, 0.03, deferral=12, capitalize_deferral=True)
+        self.assertAlmostEqual(50000 * (1 + 0.03 / 12) ** 12, capitalized['Capital Restant Dû'][11], places=6)
+
+    def test_reimbursement_scheme(self):
+        schedules = compute_schedules([120, 60], 10000, 0.02)
+        scheme = get_reimbursement_scheme(dt.date(2025, 3, 1), schedules, (1,))
+        self.assertEqual(60, len(scheme))
+        self.assertAlmostEqual(10000, scheme.sum(), places=6)
+
+    def test_save_capital_reimbursements(self):
+        engine = create_engine('sqlite://')
+        create_synthetic_database(engine, 10, years=1)
+        schedules = compute_schedules([12], 10000, 0.02)
+        scheme = get_reimbursement_scheme(dt.date(2025, 3, 15), schedules, (0,))
+        save_capital_reimbursements(engine, scheme, 'LDDS', 'Banque', dt.date(2025, 3, 15))
+        with Session(engine) as session:
+            months = session.scalars(select(Mouvement.mois).where(
+                Mouvement.compte == 'LDDS', Mouvement.date_out_of_bound == False).order_by(Mouvement.date)).all()
+        self.assertEqual(13, len(months))
+        self.assertEqual({1}, {m.day for m in months})
+        self.assertEqual(dt.date(2025, 3, 1), months[0])
@@ -0,0 +1,104 @@
+from datetime import date, datetime
+from unittest import TestCase
+
+import pandas as pd
+from sqlalchemy import create_engine, select, func, insert
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import Mouvement, SoldeJournalier, Job
+from functions import update_transaction_category, get_solde
+import ledger
+from ledger import sync_ledger, rebuild_daily_balances, get_ledger_state
+
+
+class TestLedger(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        create_synthetic_database(self.engine, 500, years=2)
+        sync_ledger(self.engine)
+        with Session(self.engine) as session:
+            self.index = session.scalar(select(Mouvement.index).where(
+                Mouvement.compte != None, Mouvement.depense != None, Mouvement.date_out_of_bound == False).limit(1))
+
+    def read_ledger(self) -> pd.DataFrame:
+        with Session(self.engine) as session:
+            return pd.read_sql(select(SoldeJournalier.compte, SoldeJournalier.jour, SoldeJournalier.solde).where(
+                SoldeJournalier.mouvement != 0).order_by(SoldeJournalier.compte, SoldeJournalier.jour),
+                session.connection())
+
+    def assertLedgerUpToDate(self):
+        current = self.read_ledger()
+        with Session(self.engine) as session:
+            rebuild_daily_balances(session)
+            session.commit()
+        pd.testing.assert_frame_equal(self.read_ledger(), current)
+
+    def test_edit_amount_account_and_date(self):
+        with Session(self.engine) as session:
+            mvt = session.get(Mouvement, self.index)
+            mvt.depense = float(mvt.depense) + 100
+            mvt.compte = 'Boursorama' if mvt.compte != 'Boursorama' else 'Crédit Agricole'
+            mvt.date = date(2015, 6, 15)
+            session.commit()
+        self.assertLedgerUpToDate()
+
+    def test_detached_edit_and_delete(self):
+        with Session(self.engine) as session:
+            mvt = session.get(Mouvement, self.index)
+        # edited outside of any session, as by the edit forms
+        mvt.recette = 1234.56
+        with Session(self.engine) as session:
+            session.add(mvt)
+            session.commit()
+        self.assertLedgerUpToDate()
+        with Session(self.engine) as session:
+            session.delete(session.get(Mouvement, self.index))
+            session.commit()
+        self.assertLedgerUpToDate()
+
+    def test_update_transaction_category(self):
+        # a category change does not touch the balances
+        before = self.read_ledger()
+        update_transaction_category(self.engine, self.index, 'Cadeaux', 'label', date(2020, 1, 1))
+        pd.testing.assert_frame_equal(before, self.read_ledger())
+
+    def insert_job(self, job_id: int, amount: float):
+        """ Writes a job and its movement outside of the ORM, as another process would"""
+        with self.engine.begin() as connection:
+            connection.execute(insert(Job.__table__).values(
+                job_id=job_id, job_key=Job.type_import, job_timestamp=datetime(2030, 5, 2)))
+            values = dict(index=20_000 + job_id, date=date(2030, 3, 9), description='CB LIDL', categorie='Courses',
+                          compte='Crédit Agricole', depense=amount, economie='false', mois=date(2030, 3, 1),
+                          date_insertion=date(2030, 3, 9), no=20_000 + job_id, job_id=job_id,
+                          date_out_of_bound=False)
+            connection.execute(insert(Mouvement.__table__).values(
+                {getattr(Mouvement, k).name: v for k, v in values.items()}))
+
+    def test_job_committed_after_newer_one(self):
+        with Session(self.engine) as session:
+            last_job_id = session.scalar(select(func.max(Job.job_id)))
+        self.insert_job(last_job_id + 2, 30)
+        sync_ledger(self.engine)
+        # the job with the lower id commits last
+        self.insert_job(last_job_id + 1, 70)
+        sync_ledger(self.engine)
+        self.assertLedgerUpToDate()
+
+    def test_read_path(self):
+        self.insert_job(10_000, 45)
+        with Session(self.engine) as session:
+            df = get_solde(session, 'Crédit Agricole', date(2030, 3, 1), date(2030, 3, 31))
+            self.assertEqual([-45], df.loc[df['Jour'] == date(2030, 3, 9), 'Solde'].tolist())
+        # integrated in the transaction of the reader, which did not commit
+        with Session(self.engine) as session:
+            self.assertEqual(1, session.scalar(select(func.count()).select_from(
+                ledger.get_pending_jobs().subquery())))
+
+    def test_sync_without_new_job(self):
+        with Session(self.engine) as session:
+            last_refresh = get_ledger_state(session).last_refresh
+        sync_ledger(self.engine)
+        with Session(self.engine) as session:
+            self.assertEqual(last_refresh, get_ledger_state(session).last_refresh)
+            self.assertGreater(session.scalar(select(func.count()).select_from(SoldeJournalier)), 0)
@@ -0,0 +1,32 @@
+from unittest import TestCase
+
+import pandas as pd
+
+from functions import classify
+from matching import KeywordAutomaton
+
+
+class TestKeywordAutomaton(TestCase):
+    def setUp(self) -> None:
+        self.patterns = ['NETFLIX', 'CARREFOUR', 'CARREFOUR MARKET', 'TOTAL', 'FLIX']
+        self.classes = ['Abonnements', 'Courses', 'Courses Proximité', 'Essence', 'Streaming']
+        self.automaton = KeywordAutomaton(self.patterns, self.classes, 'Common')
+
+    def test_first_match_wins(self):
+        matrix = list(zip(self.patterns, self.classes))
+        for description in ['PRLV NETFLIX.COM', 'CB CARREFOUR MARKET 12/03', 'TOTAL ENERGIES', 'VIR SALAIRE', '']:
+            self.assertEqual(classify(description, matrix), self.automaton.classify(description))
+
+    def test_classify_series(self):
+        descriptions = pd.Series(['CB CARREFOUR MARKET', None, 'NETFLIX', 'CB CARREFOUR MARKET', 'RIEN'])
+        result = self.automaton.classify_series(descriptions)
+        self.assertEqual(['Courses', 'Common', 'Abonnements', 'Courses', 'Common'], result.tolist())
+
+    def test_pattern_series(self):
+        descriptions = pd.Series(['CB CARREFOUR MARKET', 'RIEN'])
+        result = self.automaton.pattern_series(descriptions)
+        self.assertEqual(['CARREFOUR', None], result.tolist())
+
+    def test_find_all(self):
+        self.assertEqual([0, 4], self.automaton.find_all('PRLV NETFLIX'))
+        self.assertEqual([1, 2], self.automaton.find_all('CARREFOUR MARKET'))
@@ -0,0 +1,73 @@
+from datetime import date, datetime
+from unittest import TestCase
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import Mouvement, Job
+from ledger import create_ledger_tables, sync_ledger
+from projection import project_balances, get_projection
+from querycache import query_cache
+
+
+class TestProjection(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        create_synthetic_database(self.engine, 10, years=1)
+        create_ledger_tables(self.engine)
+        sync_ledger(self.engine)
+        rows = [(date(2030, 1, 1), 'Solde initial', 'Banque', 'LDDS', 1000, None)]
+        # a monthly salary on the 28th, and a yearly insurance in March
+        for i in range(12):
+            rows.append((date(2029, 1, 28) + relativedelta(months=i), f'VIR SALAIRE {i}', 'Salaire', 'LDDS', 2000,
+                         None))
+        for i in range(3):
+            rows.append((date(2027, 3, 10) + relativedelta(years=i), 'PRLV MAAF', 'Assurance Habitation', 'LDDS',
+                         None, 300))
+        with Session(self.engine) as session:
+            job = Job(job_key=Job.type_import, job_timestamp=datetime(2030, 1, 1))
+            session.add(job)
+            session.flush()
+            session.execute(insert(Mouvement), [
+                dict(index=10_000 + i, date=d, description=desc, compte=compte, recette=recette, depense=depense,
+                     categorie=categorie, mois=d.replace(day=1), date_insertion=d, no=10_000 + i, job_id=job.job_id,
+                     date_out_of_bound=False) for i, (d, desc, categorie, compte, recette, depense) in enumerate(rows)])
+            # the provisions of the groceries : 400 in January, of which 150 are spent, and 400 in February
+            session.execute(insert(Mouvement), [
+                dict(index=20_000, date=date(2030, 1, 3), description='CB CARREFOUR', compte='LDDS', depense=150,
+                     categorie='Courses', mois=date(2030, 1, 1), date_insertion=date(2030, 1, 3), no=20_000,
+                     job_id=job.job_id, date_out_of_bound=False)] + [
+                dict(index=20_001 + i, date=date(2030, 1, 1), description='Courses', categorie='Courses',
+                     mois=date(2030, i + 1, 1), date_insertion=date(2030, 1, 1), provision_payer=400, no=0,
+                     job_id=job.job_id, date_out_of_bound=False) for i in range(2)])
+            session.commit()
+
+    def project(self, months: int = 12):
+        with Session(self.engine) as session:
+            return project_balances(session, 'Economies', months, start=date(2030, 1, 15)).loc['LDDS']
+
+    def test_projection(self):
+        df = self.project()
+        self.assertEqual(date(2030, 1, 16), df.index[0].date())
+        self.assertEqual(date(2031, 1, 15), df.index[-1].date())
+        opening = 1000 + 2000 * 12 - 300 * 3 - 150
+        self.assertEqual(opening - 250, df['Solde'].iloc[0])
+        # the salary goes on, with no drift
+        self.assertEqual(2000, df.loc['2030-01-28', 'Flux'])
+        self.assertEqual(2000, df.loc['2030-06-28', 'Flux'])
+        # the groceries are provisioned in February only
+        self.assertEqual(-400, df.loc['2030-02-01', 'Flux'])
+        self.assertEqual(0, df.loc['2030-03-01', 'Flux'])
+        self.assertEqual(-300, df.loc['2030-03-10', 'Flux'])
+        self.assertEqual(opening - 250 - 400 - 300 + 2000 * 12, df['Solde'].iloc[-1])
+        self.assertEqual(df['Solde'].iloc[-1] - opening, df['Cumul'].iloc[-1])
+
+    def test_cached(self):
+        query_cache.clear()
+        with Session(self.engine) as session:
+            project_balances(session, 'Economies', 24, start=date(2030, 1, 15))
+            hits = query_cache.statistics()['hits']
+            self.assertEqual(730, len(get_projection(session, 'Economies', date(2030, 1, 15), 24).loc['LDDS']))
+            self.assertEqual(hits + 1, query_cache.statistics()['hits'])
@@ -0,0 +1,76 @@
+import time
+from datetime import datetime
+from unittest import TestCase, mock
+
+import pandas as pd
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import Job
+from querycache import QueryCache, data_version, make_key, get_last_job_id
+
+
+class TestQueryCache(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        self.cache = QueryCache()
+        self.calls = 0
+
+        @self.cache.cached()
+        def read(s: Session, columns: list, limit: int = 10) -> pd.DataFrame:
+            self.calls += 1
+            return pd.DataFrame({'value': range(limit)})
+
+        self.read = read
+
+    def test_hit(self):
+        with Session(self.engine) as s:
+            first = self.read(s, ['a', 'b'], limit=5)
+            first['value'] = 0
+            second = self.read(s, ['a', 'b'], limit=5)
+        self.assertEqual(1, self.calls)
+        self.assertEqual(list(range(5)), second['value'].tolist())
+
+    def test_arguments(self):
+        with Session(self.engine) as s:
+            self.read(s, ['a'], limit=5)
+            self.read(s, ['a'], limit=6)
+        self.assertEqual(2, self.calls)
+
+    def test_version(self):
+        with Session(self.engine) as s:
+            self.read(s, ['a'])
+            data_version.bump()
+            self.read(s, ['a'])
+        self.assertEqual(2, self.calls)
+
+    def test_make_key(self):
+        self.assertEqual((('a', 1), ('b', (1, 2))), make_key({'b': [1, 2], 'a': 1}))
+        self.assertRaises(TypeError, make_key, pd.DataFrame())
+
+    def test_max_age(self):
+        with Session(self.engine) as s:
+            self.read(s, ['a'])
+            with mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+                self.read(s, ['a'])
+        self.assertEqual(2, self.calls)
+
+    def test_other_process_jobs(self):
+        create_synthetic_database(self.engine, 10)
+        cache = QueryCache(external_version=get_last_job_id)
+
+        @cache.cached()
+        def read(s: Session) -> int:
+            self.calls += 1
+            return self.calls
+
+        with Session(self.engine) as s:
+            read(s)
+            read(s)
+            # a job committed outside of the sessions, as by another process
+            with self.engine.begin() as connection:
+                connection.execute(insert(Job.__table__).values(job_key=Job.type_import,
+                                                                job_timestamp=datetime.now()))
+            read(s)
+        self.assertEqual(2, self.calls)
@@ -0,0 +1,97 @@
+from datetime import date, datetime
+from unittest import TestCase
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import Mouvement, Job, Classifier
+from functions import split_mouvement
+from recurring import find_recurrences, propose_provisions, insert_provisions, get_description_group, \
+    remove_existing_provisions
+from registry import keyword_registry
+
+
+class TestRecurring(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        create_synthetic_database(self.engine, 2000, years=10)
+        rows = []
+        # a subscription raised by 1 € a year, a quarterly insurance, a yearly tax and a stopped rent
+        for i in range(48):
+            day = date(2021, 1, 5) + relativedelta(months=i)
+            rows.append((day, f'PRLV SEPA NETFLIX {day:%m%y}', 'Abonnements', 10 + i / 12))
+        for i in range(16):
+            rows.append((date(2021, 2, 20) + relativedelta(months=3 * i), f'PRLV AXA CONTRAT 12345 Q{i % 4 + 1}',
+                         'Assurance Habitation', 150))
+        for i in range(4):
+            rows.append((date(2021, 9, 15) + relativedelta(years=i), 'Impôt taxe foncière', 'Impôt Revenu', 900 + 50 * i))
+        for i in range(12):
+            rows.append((date(2021, 1, 1) + relativedelta(months=i), 'VIR LOYER APPARTEMENT', 'Loyer', 700))
+        with Session(self.engine) as session:
+            job = Job(job_key=Job.type_import, job_timestamp=datetime(2025, 1, 1))
+            session.add(job)
+            session.flush()
+            session.execute(insert(Mouvement), [
+                dict(index=10_000 + i, date=d, description=desc, compte='Crédit Agricole', depense=amount,
+                     categorie=categorie, mois=d.replace(day=1), date_insertion=d, no=10_000 + i, job_id=job.job_id,
+                     date_out_of_bound=False) for i, (d, desc, categorie, amount) in enumerate(rows)])
+            session.commit()
+
+    def find(self, **options):
+        with Session(self.engine) as session:
+            return find_recurrences(session, reference_date=date(2024, 12, 31), **options).set_index('Groupe')
+
+    def test_description_group(self):
+        self.assertEqual('prlv sepa netflix', get_description_group('PRLV  SEPA Netflix 0124'))
+
+    def test_find_recurrences(self):
+        df = self.find()
+        self.assertEqual({'prlv sepa netflix': 'Mensuelle', 'prlv axa contrat': 'Trimestrielle',
+                          'impot taxe fonciere': 'Annuelle', 'vir loyer appartement': 'Mensuelle'},
+                         df['Périodicité'].to_dict())
+        self.assertAlmostEqual(-1, df.loc['prlv sepa netflix', 'Dérive annuelle'], 1)
+        self.assertAlmostEqual(-14, df.loc['prlv sepa netflix', 'Montant'], 1)
+        self.assertEqual(-150, df.loc['prlv axa contrat', 'Montant'])
+        self.assertEqual([True, True, True, False], df['Active'][['prlv sepa netflix', 'prlv axa contrat',
+                                                                  'impot taxe fonciere',
+                                                                  'vir loyer appartement']].tolist())
+
+    def test_by_classifier(self):
+        with Session(self.engine) as session:
+            session.add(Classifier(patterns='NETFLIX', classes='Streaming'))
+            session.commit()
+            keyword_registry.invalidate()
+        self.assertEqual('Mensuelle', self.find(by_classifier=True).loc['Streaming', 'Périodicité'])
+
+    def test_propose_provisions(self):
+        rows = propose_provisions(self.find().reset_index(), 2025)
+        netflix = [r for r in rows if r['description'] == 'prlv sepa netflix']
+        self.assertEqual(12, len(netflix))
+        self.assertLess(netflix[0]['provision_payer'], netflix[-1]['provision_payer'])
+        axa = [r['mois'] for r in rows if r['description'] == 'prlv axa contrat']
+        self.assertEqual([date(2025, m, 1) for m in (2, 5, 8, 11)], axa)
+        tax = [r for r in rows if r['description'] == 'impot taxe fonciere']
+        self.assertEqual(date(2025, 9, 1), tax[0]['mois'])
+        self.assertAlmostEqual(1100, tax[0]['provision_payer'], delta=5)
+        self.assertFalse(any(r['description'] == 'vir loyer appartement' for r in rows))
+
+        with Session(self.engine) as session:
+            indexes = insert_provisions(session, rows)
+            session.commit()
+            provisions = session.scalars(select(Mouvement).where(Mouvement.index.in_(indexes))).all()
+        self.assertEqual(len(rows), len(provisions))
+        self.assertTrue(all(p.compte is None and p.job_id == provisions[0].job_id for p in provisions))
+        # the categories provisioned are not proposed again
+        with Session(self.engine) as session:
+            self.assertEqual([], remove_existing_provisions(session, rows))
+
+    def test_split_charges(self):
+        with Session(self.engine) as session:
+            for index in range(10_064, 10_068):
+                split_mouvement(session, index)
+            session.commit()
+        df = self.find()
+        self.assertEqual('Annuelle', df.loc['impot taxe fonciere', 'Périodicité'])
+        self.assertAlmostEqual(-1100, df.loc['impot taxe fonciere', 'Montant'], delta=1)
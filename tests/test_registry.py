@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import MapCategorie
+from functions import find_active_maps
+from registry import keyword_registry
+
+
+class TestFindActiveMaps(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        create_synthetic_database(self.engine, 10)
+        keyword_registry.invalidate()
+        with Session(self.engine) as session:
+            session.add(MapCategorie(keyword='NETFLIX', categorie='Abonnements', inactif=False))
+            session.add(MapCategorie(keyword='SPOTIFY', categorie='Abonnements', inactif=True))
+            session.commit()
+
+    def test_registry(self):
+        with Session(self.engine) as session:
+            self.assertEqual(['NETFLIX'], [m.keyword for m in find_active_maps(session, 'PRLV NETFLIX')])
+            self.assertEqual([], find_active_maps(session, 'SPOTIFY'))
+
+    def test_pending_batch(self):
+        with Session(self.engine) as session:
+            # an editor batch : a new map, a reactivated one, a deactivated one, before the commit
+            session.add(MapCategorie(keyword='DEEZER', categorie='Abonnements', inactif=False))
+            session.get(MapCategorie, 'SPOTIFY').inactif = False
+            session.get(MapCategorie, 'NETFLIX').inactif = True
+            self.assertEqual(['DEEZER'], [m.keyword for m in find_active_maps(session, 'DEEZER PREMIUM')])
+            self.assertEqual(['SPOTIFY'], [m.keyword for m in find_active_maps(session, 'SPOTIFY')])
+            self.assertEqual([], find_active_maps(session, 'NETFLIX'))
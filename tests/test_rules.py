@@ -0,0 +1,124 @@
+from datetime import date, datetime
+from unittest import TestCase
+
+from sqlalchemy import create_engine, select, func, update, insert
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import Mouvement, MapCategorie, MapCategorieEtat, Job
+from rules import apply_category_maps, get_rule_statistics
+
+
+class TestRules(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        create_synthetic_database(self.engine, 2000)
+        with Session(self.engine) as session:
+            self.first_hits = apply_category_maps(session)
+            session.commit()
+
+    def insert(self, session: Session, index: int, description: str, job_key: str = Job.type_import) -> int:
+        job = Job(job_key=job_key, job_timestamp=datetime.now())
+        session.add(job)
+        session.flush()
+        session.execute(insert(Mouvement).values(index=index, description=description, job_id=job.job_id,
+                                                 categorie='Courses', date=date(2025, 4, 12), mois=date(2025, 4, 1),
+                                                 date_insertion=date(2025, 4, 13), no=index,
+                                                 date_out_of_bound=False))
+        return job.job_id
+
+    def test_first_run(self):
+        # the new maps start at the last job, the history being only mapped on demand
+        self.assertEqual(0, sum(self.first_hits.values()))
+        with Session(self.engine) as session:
+            last_job_id = session.scalar(select(func.max(Job.job_id)))
+            self.assertEqual({last_job_id}, set(session.scalars(select(MapCategorieEtat.last_job_id))))
+            hits = apply_category_maps(session, rescan=True)
+            session.commit()
+            self.assertGreater(sum(hits.values()), 1900)
+            statistics = get_rule_statistics(session)
+        self.assertEqual(sum(hits.values()), statistics['hits'].sum())
+
+    def test_only_new_jobs(self):
+        with Session(self.engine) as session:
+            keyword = session.scalar(select(MapCategorie.keyword).limit(1))
+            session.execute(update(MapCategorie).where(MapCategorie.keyword == keyword).values(
+                categorie='Impôts', monthshift=-1, declarant='Vincent'))
+            # a manual change in an old job is kept
+            session.execute(update(Mouvement).where(Mouvement.index == 1).values(categorie='Cadeaux'))
+            self.insert(session, 5000, f'CB {keyword} 01/04')
+            session.commit()
+
+            hits = apply_category_maps(session)
+            session.commit()
+            self.assertEqual(1, sum(hits.values()))
+            self.assertEqual(1, hits[keyword])
+            new = session.get(Mouvement, 5000)
+            self.assertEqual(('Impôts', date(2025, 3, 1), 'Vincent'), (new.categorie, new.mois, new.declarant))
+            self.assertEqual('Cadeaux', session.get(Mouvement, 1).categorie)
+
+            hits = apply_category_maps(session, rescan=True)
+            session.commit()
+            self.assertGreater(sum(hits.values()), 1900)
+            self.assertNotEqual('Cadeaux', session.get(Mouvement, 1).categorie)
+            # the month already shifted is not shifted again
+            self.assertEqual(date(2025, 3, 1), session.get(Mouvement, 5000).mois)
+
+    def test_month_kept_without_shift(self):
+        with Session(self.engine) as session:
+            keyword = session.scalar(select(MapCategorie.keyword).where(MapCategorie.monthshift == None).limit(1))
+            self.insert(session, 5000, f'CB {keyword}')
+            session.commit()
+            self.assertEqual(1, apply_category_maps(session)[keyword])
+            self.assertEqual(date(2025, 4, 1), session.get(Mouvement, 5000).mois)
+
+    def test_other_jobs_untouched(self):
+        with Session(self.engine) as session:
+            keyword = session.scalar(select(MapCategorie.keyword).limit(1))
+            session.execute(update(MapCategorie).where(MapCategorie.keyword == keyword).values(monthshift=1))
+            for i, job_key in enumerate([Job.type_split, Job.type_provision, Job.type_salary]):
+                self.insert(session, 5000 + i, f'CB {keyword}', job_key)
+            session.commit()
+            self.assertEqual(0, apply_category_maps(session)[keyword])
+            self.assertEqual({('Courses', date(2025, 4, 1))}, set(session.execute(select(
+                Mouvement.categorie, Mouvement.mois).where(Mouvement.index >= 5000)).all()))
+
+    def test_single_job(self):
+        with Session(self.engine) as session:
+            keyword = session.scalar(select(MapCategorie.keyword).limit(1))
+            self.insert(session, 5000, f'CB {keyword}')
+            job_id = self.insert(session, 5001, f'CB {keyword}')
+            session.commit()
+            # the maps catch up with the previous job they have not seen, not with the newer ones
+            self.insert(session, 5002, f'CB {keyword}')
+            session.commit()
+            self.assertEqual(2, apply_category_maps(session, job_id=job_id)[keyword])
+            self.assertEqual({job_id}, set(session.scalars(select(MapCategorieEtat.last_job_id))))
+            self.assertEqual(1, apply_category_maps(session)[keyword])
+
+    def test_best_map_only(self):
+        with Session(self.engine) as session:
+            session.execute(insert(MapCategorie), [{'keyword': 'ABCD LONG', 'categorie': 'Cadeaux', 'inactif': False},
+                                                   {'keyword': 'ABCD', 'categorie': 'Impôts', 'inactif': False}])
+            apply_category_maps(session)
+            session.execute(update(MapCategorie).where(MapCategorie.keyword == 'ABCD').values(inactif=True))
+            self.insert(session, 5000, 'CB ABCD LONG')
+            apply_category_maps(session)
+            # the shorter map, reactivated later, does not override the longer one
+            session.execute(update(MapCategorie).where(MapCategorie.keyword == 'ABCD').values(inactif=False))
+            apply_category_maps(session)
+            self.assertEqual('Cadeaux', session.get(Mouvement, 5000).categorie)
+
+    def test_new_map_rescan_shifts(self):
+        with Session(self.engine) as session:
+            self.insert(session, 5000, 'CB ZZQ')
+            session.execute(insert(MapCategorie).values(keyword='ZZQ', categorie='Impôts', monthshift=-1,
+                                                        inactif=False))
+            apply_category_maps(session)
+            self.assertEqual('Courses', session.get(Mouvement, 5000).categorie)
+            self.assertEqual(1, apply_category_maps(session, rescan=True)['ZZQ'])
+            self.assertEqual(('Impôts', date(2025, 3, 1)), (session.get(Mouvement, 5000).categorie,
+                                                            session.get(Mouvement, 5000).mois))
+            # a second rescan does not shift again
+            apply_category_maps(session, rescan=True)
+            self.assertEqual(date(2025, 3, 1), session.get(Mouvement, 5000).mois)
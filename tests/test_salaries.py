@@ -0,0 +1,94 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine, update, select, func
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import Mouvement, MapSalaire, Job
+from functions import get_salary_candidates, stamp_salary_rules, document_salary_candidates
+
+
+class TestSalaryCandidates(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        create_synthetic_database(self.engine, 3000)
+        with Session(self.engine) as session:
+            self.compte = session.scalar(select(Mouvement.compte).where(Mouvement.index == 100))
+            self.first_job, self.last_job = session.execute(select(func.min(Job.job_id), func.max(Job.job_id))).one()
+            for index, description, job_id in [(100, 'VIR SALAIRE ACME', self.first_job),
+                                               (200, 'VIR ACME PRIME', self.last_job),
+                                               (300, 'VIR PAIE GLOBEX', self.last_job)]:
+                session.execute(update(Mouvement).where(Mouvement.index == index).values(
+                    description=description, compte=self.compte, recette=1000, declarant=None, job_id=job_id,
+                    date_out_of_bound=False))
+            session.add_all([MapSalaire(pattern='ACME', declarant='Vincent', compte=self.compte, active=True),
+                             MapSalaire(pattern='GLOBEX', declarant='Aurélie', compte=self.compte, active=False)])
+            session.commit()
+
+    def test_candidates(self):
+        with Session(self.engine) as session:
+            df = get_salary_candidates(session)
+        self.assertEqual({100, 200}, set(df['Index']))
+        self.assertEqual({'Vincent'}, set(df['Déclarant']))
+        self.assertEqual(self.last_job, df.attrs['last_job_id'])
+
+    def test_only_new_jobs(self):
+        with Session(self.engine) as session:
+            stamp_salary_rules(session, self.last_job - 1)
+            session.commit()
+            self.assertEqual([200], get_salary_candidates(session)['Index'].tolist())
+            self.assertEqual({100, 200}, set(get_salary_candidates(session, rescan=True)['Index']))
+
+    def test_document_candidates(self):
+        with Session(self.engine) as session:
+            # a scan alone does not stamp the rules
+            get_salary_candidates(session)
+            self.assertEqual({100, 200}, set(get_salary_candidates(session)['Index']))
+            self.assertEqual(2, document_salary_candidates(session, get_salary_candidates(session)))
+            session.commit()
+            self.assertEqual('Vincent', session.get(Mouvement, 200).declarant)
+            self.assertEqual({self.last_job}, set(session.scalars(select(MapSalaire.last_job_id).where(
+                MapSalaire.active == True))))
+            self.assertEqual(0, len(get_salary_candidates(session, rescan=True)))
+
+    def test_document_selection(self):
+        with Session(self.engine) as session:
+            df = get_salary_candidates(session)
+            position = df.index[df['Index'] == 200][0]
+            self.assertEqual(1, document_salary_candidates(session, df, [position]))
+            session.commit()
+            self.assertEqual('Vincent', session.get(Mouvement, 200).declarant)
+            self.assertIsNone(session.get(Mouvement, 100).declarant)
+            # left aside, until a rescan
+            self.assertEqual(0, len(get_salary_candidates(session)))
+            self.assertEqual([100], get_salary_candidates(session, rescan=True)['Index'].tolist())
+
+    def test_longest_pattern(self):
+        with Session(self.engine) as session:
+            session.add(MapSalaire(pattern='PAIE ACME', declarant='Aurélie', compte=self.compte, active=True))
+            session.execute(update(Mouvement).where(Mouvement.index == 200).values(description='VIR PAIE ACME'))
+            session.commit()
+            df = get_salary_candidates(session)
+            self.assertEqual(3, len(df))
+            self.assertEqual(2, document_salary_candidates(session, df))
+            self.assertEqual('Aurélie', session.get(Mouvement, 200).declarant)
+            self.assertEqual('Vincent', session.get(Mouvement, 100).declarant)
+
+    def test_ambiguous_patterns(self):
+        with Session(self.engine) as session:
+            # as long as ACME
+            session.add(MapSalaire(pattern='PRIM', declarant='Aurélie', compte=self.compte, active=True))
+            session.commit()
+            self.assertEqual(1, document_salary_candidates(session, get_salary_candidates(session)))
+            self.assertIsNone(session.get(Mouvement, 200).declarant)
+            self.assertEqual('Vincent', session.get(Mouvement, 100).declarant)
+
+    def test_pattern_wildcards(self):
+        with Session(self.engine) as session:
+            session.add(MapSalaire(pattern='VIR_%', declarant='Aurélie', compte=self.compte, active=True))
+            session.execute(update(Mouvement).where(Mouvement.index == 400).values(
+                description='VIR_% SALAIRE', compte=self.compte, recette=1000, declarant=None,
+                date_out_of_bound=False))
+            session.commit()
+            df = get_salary_candidates(session, rescan=True)
+        self.assertEqual([400], df.loc[df['Déclarant'] == 'Aurélie', 'Index'].tolist())
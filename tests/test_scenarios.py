@@ -0,0 +1,38 @@
+from unittest import TestCase, mock
+
+import numpy as np
+
+import scenarios
+from interests import compute_schedules
+from scenarios import evaluate_scenarios, get_renegotiation_cost
+
+
+class TestScenarios(TestCase):
+    def test_metrics(self):
+        df = evaluate_scenarios(200000, [0.02, 0.03], [180, 240], [0.0, 0.003], workers=1)
+        self.assertEqual(8, len(df))
+        row = df[(df['Taux'] == 0.03) & (df['Durée'] == 240) & (df['Assurance'] == 0.003)].iloc[0]
+        schedules = compute_schedules(240, 200000, 0.03)
+        self.assertAlmostEqual(schedules['Mensualité'][0], row['Mensualité'])
+        self.assertAlmostEqual(schedules['Intérêts'].sum(), row['Intérêts totaux'])
+        self.assertAlmostEqual(200000 * 0.003 * 20, row['Assurance totale'])
+
+    def test_renegotiation(self):
+        df = evaluate_scenarios(150000, [0.015, 0.045], [180], current_rate=0.04, current_months=180, fees=1000,
+                                workers=1)
+        self.assertEqual(['Économie mensuelle', 'Gain net', 'Mois de rentabilité'], list(df.columns[-3:]))
+        cheaper, dearer = df.iloc[0], df.iloc[1]
+        self.assertGreater(cheaper['Économie mensuelle'], 0)
+        self.assertAlmostEqual(cheaper['Économie mensuelle'] * 180 - get_renegotiation_cost(150000, 0.04, 1000),
+                               cheaper['Gain net'], places=4)
+        self.assertEqual(np.ceil(get_renegotiation_cost(150000, 0.04, 1000) / cheaper['Économie mensuelle']),
+                         cheaper['Mois de rentabilité'])
+        self.assertTrue(np.isnan(dearer['Mois de rentabilité']))
+
+    def test_parallel(self):
+        rates = np.linspace(0.01, 0.05, 50)
+        serial = evaluate_scenarios(100000, rates, [120, 240], [0.0, 0.002], [0.0, 5000.0], workers=1)
+        with mock.patch.object(scenarios, 'CHUNK_SIZE', 100):
+            parallel = evaluate_scenarios(100000, rates, [120, 240], [0.0, 0.002], [0.0, 5000.0], workers=2)
+        self.assertEqual(400, len(parallel))
+        np.testing.assert_allclose(serial.values, parallel.values)
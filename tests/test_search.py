@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine, update, select, func
+from sqlalchemy.orm import Session
+
+import search
+from benchmarks.synthetic import create_synthetic_database
+from datamodel import Mouvement
+from functions import fetch_mouvements
+
+
+class TestSearch(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        create_synthetic_database(self.engine, 2000)
+        with Session(self.engine) as session:
+            session.execute(update(Mouvement).where(Mouvement.index == 10).values(
+                description='CB CAFÉ DE LA GARE', label_utilisateur='Café'))
+            session.execute(update(Mouvement).where(Mouvement.index == 20).values(
+                description='PRLV SOCIÉTÉ GÉNÉRALE', label_utilisateur=None))
+            session.commit()
+
+    def test_fold(self):
+        self.assertEqual('oeuvre cafe', search.fold('Œuvre Café'))
+        self.assertEqual('', search.fold(None))
+
+    def test_accents(self):
+        with Session(self.engine) as session:
+            df = fetch_mouvements(session, None, 50, search_filter='cafe de la')
+            self.assertEqual([10], df['index'].tolist())
+            df = fetch_mouvements(session, None, 50, search_filter='Societe generale')
+            self.assertEqual([20], df['index'].tolist())
+
+    def test_same_as_like(self):
+        with Session(self.engine) as session:
+            term = session.scalar(select(Mouvement.description).where(Mouvement.index == 500))[2:6]
+            expected = session.scalar(select(func.count(Mouvement.index)).where(
+                Mouvement.date_out_of_bound == False, Mouvement.description.ilike(f'%{term}%')))
+            df = fetch_mouvements(session, None, 5000, search_filter=term)
+            self.assertEqual(expected, len(df))
+
+    def test_index_refreshed_after_commit(self):
+        with Session(self.engine) as session:
+            self.assertEqual(0, len(fetch_mouvements(session, None, 50, search_filter='brasserie')))
+            session.execute(update(Mouvement).where(Mouvement.index == 30).values(label_utilisateur='Brasserie'))
+            session.commit()
+            self.assertEqual([30], fetch_mouvements(session, None, 50, search_filter='brasserie')['index'].tolist())
+
+    def test_ranking(self):
+        with Session(self.engine) as session:
+            session.execute(update(Mouvement).where(Mouvement.index == 40).values(
+                description='CAFE', label_utilisateur=None))
+            session.commit()
+            df = search.search_mouvements(session, 'café')
+            self.assertEqual([40, 10], df['index'].tolist()[:2])
+            self.assertGreater(df['rank'].iloc[0], df['rank'].iloc[1])
+
+    def test_fields_separated(self):
+        with Session(self.engine) as session:
+            # 'gare cafe' is only found across the description and the label
+            self.assertEqual([], fetch_mouvements(session, None, 50, search_filter='gare cafe')['index'].tolist())
+            self.assertEqual([], fetch_mouvements(session, None, 50, search_filter='gare\ncafe')['index'].tolist())
+            self.assertEqual([10], fetch_mouvements(session, None, 50, search_filter='la gare')['index'].tolist())
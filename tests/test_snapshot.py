@@ -0,0 +1,50 @@
+import tempfile
+from datetime import date
+from pathlib import Path
+from unittest import TestCase
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import snapshot
+from benchmarks.synthetic import create_synthetic_database
+from functions import get_categorized_provisions, get_categorized_provisions_snapshot, get_yearly_realise, \
+    get_yearly_realise_snapshot
+
+
+class TestSnapshot(TestCase):
+    def setUp(self) -> None:
+        self.engine = create_engine('sqlite://')
+        create_synthetic_database(self.engine, 3000)
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name).joinpath('snapshot')
+        with Session(self.engine) as session:
+            self.counts = snapshot.export_snapshot(session, self.root)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_export(self):
+        self.assertEqual(3000, self.counts[snapshot.MOUVEMENTS])
+        self.assertEqual(3000, len(snapshot.read_mouvements(self.root, columns=['index'])))
+        self.assertEqual(self.counts, snapshot.get_snapshot_info(self.root)['counts'])
+
+    def test_older_database(self):
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('DROP INDEX comptes_empreinte_idx')
+            connection.exec_driver_sql('ALTER TABLE comptes DROP COLUMN "Empreinte"')
+        with Session(self.engine) as session:
+            self.assertEqual(3000, snapshot.export_snapshot(session, self.root)[snapshot.MOUVEMENTS])
+
+    def test_categorized_provisions(self):
+        with Session(self.engine) as session:
+            expected = get_categorized_provisions(session, 'Courses', date(2015, 1, 1), 12, False)
+        result = get_categorized_provisions_snapshot('Courses', date(2015, 1, 1), 12, False, self.root)
+        pd.testing.assert_frame_equal(expected, result, check_dtype=False)
+
+    def test_yearly_realise(self):
+        with Session(self.engine) as session:
+            expected = get_yearly_realise(session, False, True, False, 'Courses', 2015)
+        result = get_yearly_realise_snapshot(False, True, False, 'Courses', 2015, root=self.root)
+        pd.testing.assert_frame_equal(expected, result, check_dtype=False)
@@ -0,0 +1,25 @@
+from unittest import TestCase
+
+from sqlalchemy import create_engine, select, func
+
+from benchmarks.synthetic import create_synthetic_database, JOB_SIZE
+from datamodel import Mouvement
+
+
+class TestSyntheticDatabase(TestCase):
+    def build(self, seed: int):
+        engine = create_engine('sqlite://')
+        counts = create_synthetic_database(engine, 2500, seed)
+        with engine.connect() as connection:
+            total = connection.scalar(select(func.sum(Mouvement.depense)))
+            jobs = connection.scalar(select(func.count(Mouvement.job_id.distinct())))
+        return counts, total, jobs
+
+    def test_counts(self):
+        counts, total, jobs = self.build(0)
+        self.assertEqual(2500, counts['comptes'])
+        self.assertEqual((2500 - 1) // JOB_SIZE + 1, jobs)
+
+    def test_reproducible(self):
+        self.assertEqual(self.build(1), self.build(1))
+        self.assertNotEqual(self.build(1)[1], self.build(2)[1])
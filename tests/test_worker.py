@@ -0,0 +1,64 @@
+import queue
+import threading
+from unittest import TestCase
+
+from finance_gui.worker import QueryWorker, QUERY_DONE
+
+
+class FakeWindow:
+    """ Collects the events posted by the worker, as window.read() would"""
+
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def write_event_value(self, key, value):
+        self.events.put((key, value))
+
+
+class TestQueryWorker(TestCase):
+    def setUp(self) -> None:
+        self.window = FakeWindow()
+        self.worker = QueryWorker(self.window, max_workers=1)
+
+    def tearDown(self) -> None:
+        self.worker.shutdown()
+
+    def test_result_posted(self):
+        generation = self.worker.submit('sum', sum, [1, 2, 3])
+        key, query = self.window.events.get(timeout=5)
+        self.assertEqual(QUERY_DONE, key)
+        self.assertEqual(('sum', generation, 6, None), tuple(query))
+
+    def test_error_posted(self):
+        self.worker.submit('div', lambda: 1 / 0)
+        key, query = self.window.events.get(timeout=5)
+        self.assertIsInstance(query.error, ZeroDivisionError)
+
+    def test_stale_queries_dropped(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow(value):
+            started.set()
+            release.wait(5)
+            return value
+
+        self.worker.submit('page', slow, 1)
+        started.wait(5)
+        # the first query is running, the second one waits and is replaced by the third one
+        self.worker.submit('page', slow, 2)
+        last = self.worker.submit('page', slow, 3)
+        self.assertTrue(self.worker.is_busy('page'))
+        release.set()
+        key, query = self.window.events.get(timeout=5)
+        self.assertEqual((last, 3), (query.generation, query.result))
+        self.assertTrue(self.window.events.empty())
+
+    def test_cancel(self):
+        release = threading.Event()
+        self.worker.submit('page', release.wait, 5)
+        self.worker.cancel('page')
+        release.set()
+        self.worker.submit('other', sum, [1])
+        key, query = self.window.events.get(timeout=5)
+        self.assertEqual('other', query.name)